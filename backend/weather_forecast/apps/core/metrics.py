@@ -0,0 +1,24 @@
+"""Prometheus metrics of the Redis pools of core.redis, labelled with the pool name.
+
+They are exposed on /metrics along with the forecast app's ones, see forecast.metrics.
+"""
+
+from prometheus_client import Counter, Histogram
+
+# Redis round trips take well under the default buckets' smallest bound of 5ms
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+REDIS_POOL_WAIT = Histogram(
+    "redis_pool_wait_seconds",
+    "Time to get a connection from a Redis pool, connecting included",
+    ["pool"],
+    buckets=REDIS_BUCKETS,
+)
+REDIS_POOL_EXHAUSTED = Counter(
+    "redis_pool_exhausted_total", "Commands failed for want of a free pooled connection", ["pool"]
+)
+REDIS_ROUND_TRIP = Histogram(
+    "redis_round_trip_seconds",
+    "Time a pooled connection is held by one command or one pipeline",
+    ["pool"],
+    buckets=REDIS_BUCKETS,
+)
@@ -1,10 +1,184 @@
+"""Redis clients of the project, on connection pools shared per database.
+
+Every client of a database uses the same pool of at most REDIS_MAX_CONNECTIONS
+connections, so the pool bounds the connections of a process whatever the number of
+clients. A command waits up to REDIS_POOL_TIMEOUT seconds for a free connection before
+failing, and connections idle for more than REDIS_HEALTH_CHECK_INTERVAL seconds are
+pinged before use, so a connection dropped by a server or a proxy fails fast instead of
+failing the command. The time spent waiting for a connection, the commands failed for want
+of one and the time connections are held are observed in core.metrics.
+
+Pools are created on first use, not on import. Sync pools drop the connections inherited
+from a parent process on their own; asyncio ones are bound to the event loop they are
+created on, so each loop gets its own.
+
+`batched` groups the writes queued with `write` during a block into one pipeline per
+pool, sent when the block ends: one round trip for all of them.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
 import os
+import time
+import typing as t
+import weakref
 
 import redis
+import redis.asyncio
+from core import metrics
+from django.conf import settings
+
+# message of the ConnectionError raised by blocking pools that have no free connection
+NO_CONNECTION_AVAILABLE = "No connection available."
 
-conn = redis.Redis(
-    host=os.environ["REDIS_HOST"],
-    port=os.environ["REDIS_PORT"],
-    db=2,
-    decode_responses=True,
+_batch: contextvars.ContextVar[dict[t.Any, redis.client.Pipeline] | None] = contextvars.ContextVar(
+    "redis_batch", default=None
 )
+
+
+def _pool_options(db: int, decode_responses: bool) -> dict[str, t.Any]:
+    return {
+        "host": os.environ["REDIS_HOST"],
+        "port": int(os.environ["REDIS_PORT"]),
+        "db": db,
+        "decode_responses": decode_responses,
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+        "name": f"db{db}",
+    }
+
+
+def _observe_round_trip(pool_name: str, connection: t.Any) -> None:
+    # unset when the pool releases a connection that failed to connect
+    checked_out_at = getattr(connection, "checked_out_at", None)
+    if checked_out_at is not None:
+        metrics.REDIS_ROUND_TRIP.labels(pool_name).observe(time.perf_counter() - checked_out_at)
+        connection.checked_out_at = None
+
+
+class BlockingConnectionPool(redis.BlockingConnectionPool):
+    """`redis.BlockingConnectionPool` observed in core.metrics under its `name`.
+
+    Also usable as the "pool_class" of Django's Redis cache backend, with "name" among its
+    OPTIONS.
+    """
+
+    def __init__(self, *args, name: str = "default", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.name = name
+
+    def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if str(e) == NO_CONNECTION_AVAILABLE:
+                metrics.REDIS_POOL_EXHAUSTED.labels(self.name).inc()
+            raise
+        finally:
+            metrics.REDIS_POOL_WAIT.labels(self.name).observe(time.perf_counter() - start)
+        connection.checked_out_at = time.perf_counter()
+        return connection
+
+    def release(self, connection) -> None:
+        _observe_round_trip(self.name, connection)
+        super().release(connection)
+
+
+class AsyncBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+    """Asyncio counterpart of `BlockingConnectionPool`."""
+
+    def __init__(self, *args, name: str = "default", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.name = name
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if str(e) == NO_CONNECTION_AVAILABLE:
+                metrics.REDIS_POOL_EXHAUSTED.labels(self.name).inc()
+            raise
+        finally:
+            metrics.REDIS_POOL_WAIT.labels(self.name).observe(time.perf_counter() - start)
+        connection.checked_out_at = time.perf_counter()
+        return connection
+
+    async def release(self, connection) -> None:
+        _observe_round_trip(self.name, connection)
+        await super().release(connection)
+
+
+@functools.cache
+def _pool(db: int, decode_responses: bool) -> BlockingConnectionPool:
+    return BlockingConnectionPool(**_pool_options(db, decode_responses))
+
+
+_async_pools: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple[int, bool], AsyncBlockingConnectionPool]
+] = weakref.WeakKeyDictionary()
+
+
+def get_connection(db: int = 2, decode_responses: bool = False) -> redis.Redis:
+    return redis.Redis(connection_pool=_pool(db, decode_responses))
+
+
+def get_async_connection(db: int = 2, decode_responses: bool = False) -> redis.asyncio.Redis:
+    """Asyncio connection on the pool of the running event loop. Must be called from a coroutine."""
+    pools = _async_pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get((db, decode_responses))
+    if pool is None:
+        pool = AsyncBlockingConnectionPool(**_pool_options(db, decode_responses))
+        pools[db, decode_responses] = pool
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def get_default_connection() -> redis.Redis:
+    """Connection shared by the whole process, created on first use instead of on import."""
+    return get_connection(decode_responses=True)
+
+
+@contextlib.contextmanager
+def batched() -> t.Iterator[None]:
+    """Sends the writes queued with `write` in the block together, once the block ends.
+
+    The writes of one pool go out in one pipeline, in the order they were queued. Blocks
+    nest, the writes are sent when the outermost one ends. The writes of a block that
+    raised are dropped.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+    pipes: dict[t.Any, redis.client.Pipeline] = {}
+    token = _batch.set(pipes)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    for pipe in pipes.values():
+        pipe.execute()
+
+
+@contextlib.contextmanager
+def write(connection: redis.Redis) -> t.Iterator[redis.client.Pipeline]:
+    """Pipeline to queue writes whose replies aren't needed on.
+
+    Within `batched` the pipeline is shared by every write to the same pool and sent when the
+    batch ends, otherwise it is sent when the block ends.
+    """
+    pipes = _batch.get()
+    if pipes is None:
+        pipe = connection.pipeline(transaction=False)
+        yield pipe
+        pipe.execute()
+        return
+    pipe = pipes.get(connection.connection_pool)
+    if pipe is None:
+        pipe = pipes[connection.connection_pool] = connection.pipeline(transaction=False)
+    yield pipe
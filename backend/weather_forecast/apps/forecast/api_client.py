@@ -1,18 +1,50 @@
 import abc
+import asyncio
+import functools
+import json
 import logging
+import sys
+import time
 import typing as t
-from datetime import datetime
+from datetime import date
+from urllib.parse import urlsplit
 
+import httpx
 import requests
-import requests_cache
-from geopy.geocoders import Nominatim
-from retry_requests import retry
+from requests.adapters import HTTPAdapter
 
+from forecast import geoindex, http_cache, metrics, profiling, resilience
+from forecast.local_cache import LocalCache
+from forecast.singleflight import AsyncSingleFlight, SingleFlight
 from forecast.domain import models as dm
 
+if t.TYPE_CHECKING:
+    # imported where first used, together they add a tenth of a second to every worker's boot
+    import requests_cache
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+OPEN_METEO_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+OPEN_METEO_GEODATA_URL = "https://geocoding-api.open-meteo.com/v1/search"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+
+RETRY_STATUSES = (500, 502, 504)
+RETRY_BACKOFF_FACTOR = 0.2
+
+# seconds to establish a connection and to wait for response data, and the total time an
+# upstream call may take with its retries
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+DEADLINE = 15.0
+
+# coordinates of a city practically never change, forecasts are updated hourly
+FORECAST_EXPIRE_AFTER = 3600
+GEODATA_EXPIRE_AFTER = 7 * 24 * 3600
+
+# days of hourly forecast fetched per location at once, the most Open-Meteo provides
+HOURLY_HORIZON_DAYS = 16
+
 ### EXCEPTIONS ###  # noqa: E266
 
 
@@ -41,10 +73,184 @@ class GeoData(t.NamedTuple):
     longitude: float
     timezone: str = "UTC"
 
-    def get_location(self) -> str:
-        geolocator = Nominatim(user_agent="weatherApp")
-        location = geolocator.reverse(f"{self.latitude},{self.longitude}", language="en")
-        return location.raw["address"]
+
+class ReverseGeocoder:
+    """Resolves coordinates to the name of the nearest city.
+
+    The local city index is asked first, Nominatim (rate limited to about one request per
+    second) only when the index is missing or has no city close enough. Names are memoized
+    on coordinates rounded to `precision` decimals, 2 decimals being roughly a kilometer.
+    """
+
+    # most specific first, Nominatim only fills in the levels that exist at the point
+    ADDRESS_KEYS = ("city", "town", "village", "municipality", "county", "state")
+
+    def __init__(
+        self,
+        city_index: geoindex.CityIndex | None = None,
+        nominatim_fallback: bool = True,
+        max_distance_km: float = 30.0,
+        precision: int = 2,
+        cache_size: int = 10_000,
+        user_agent: str = "weatherApp",
+        timeout: float = READ_TIMEOUT,
+        breaker: resilience.CircuitBreaker | None = None,
+        nominatim_url: str = NOMINATIM_URL,
+    ) -> None:
+        self.city_index = city_index
+        self.max_distance_km = max_distance_km
+        self.precision = precision
+        url = urlsplit(nominatim_url)
+        self.geolocator = None
+        if nominatim_fallback:
+            from geopy.geocoders import Nominatim
+
+            self.geolocator = Nominatim(
+                user_agent=user_agent, timeout=timeout, domain=url.netloc, scheme=url.scheme
+            )
+        self.breaker = breaker or resilience.CircuitBreaker("nominatim")
+        self._resolve_cached = functools.lru_cache(maxsize=cache_size)(self._resolve)
+        self._nearest_local_cached = functools.lru_cache(maxsize=cache_size)(self._nearest_local)
+
+    def _rounded(self, geo_data: GeoData) -> tuple[float, float]:
+        return round(geo_data.latitude, self.precision), round(geo_data.longitude, self.precision)
+
+    def get_city_name(self, geo_data: GeoData) -> str:
+        return self.get_city(geo_data)[0]
+
+    def get_city(self, geo_data: GeoData) -> tuple[str, str]:
+        """Name and timezone of the nearest city, the timezone is UTC when it isn't known."""
+        return self._resolve_cached(*self._rounded(geo_data))
+
+    def get_local_city(self, geo_data: GeoData) -> tuple[str, str] | None:
+        """Name and timezone of the nearest city in the local index, None when it has none close enough."""
+        return self._nearest_local_cached(*self._rounded(geo_data))
+
+    @property
+    def asks_upstream(self) -> bool:
+        """Whether cities missing from the local index are looked up in Nominatim."""
+        return self.geolocator is not None
+
+    def _nearest_local(self, latitude: float, longitude: float) -> tuple[str, str] | None:
+        if self.city_index is None:
+            return None
+        city = self.city_index.nearest(latitude, longitude, self.max_distance_km)
+        return (city.name, city.timezone) if city is not None else None
+
+    @profiling.traced
+    def _resolve(self, latitude: float, longitude: float) -> tuple[str, str]:
+        city = self._nearest_local_cached(latitude, longitude)
+        if city is not None:
+            return city
+        if self.geolocator is None:
+            raise CoordinatesNotFoundError(f"No known city near {latitude},{longitude}")
+        if not self.breaker.allow():
+            raise GettingCoordinatesError(f"circuit of {self.breaker.name} is open")
+        from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeopyError
+
+        start = time.perf_counter()
+        try:
+            location = self.geolocator.reverse(f"{latitude},{longitude}", language="en")
+        except GeopyError as e:
+            if isinstance(e, (GeocoderTimedOut, GeocoderUnavailable)):
+                _observe_upstream(self.breaker.name, start, _error_status(e))
+                self.breaker.record_failure()
+            else:
+                # other geopy errors are answers of the service, like 4xx statuses
+                _observe_upstream(self.breaker.name, start, metrics.CLIENT_ERROR)
+                self.breaker.record_success()
+            logger.exception("reverse geocoding failed: %s", e)
+            raise GettingCoordinatesError from e
+        _observe_upstream(self.breaker.name, start, 200)
+        self.breaker.record_success()
+        address = location.raw.get("address", {}) if location is not None else {}
+        for key in self.ADDRESS_KEYS:
+            if key in address:
+                return address[key], GeoData._field_defaults["timezone"]
+        raise CoordinatesNotFoundError(f"No city found at {latitude},{longitude}")
+
+
+def _record_status(breaker: resilience.CircuitBreaker, status_code: int) -> None:
+    # any server error counts against the host, even the ones that aren't retried
+    if status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _error_status(error: Exception) -> str:
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        return metrics.TIMEOUT
+    # geopy is only imported once a reverse geocoder asks Nominatim
+    geopy_exc = sys.modules.get("geopy.exc")
+    if geopy_exc is not None and isinstance(error, geopy_exc.GeocoderTimedOut):
+        return metrics.TIMEOUT
+    return metrics.CONNECTION_ERROR
+
+
+def _observe_upstream(host: str, start: float, status: int | str) -> None:
+    metrics.UPSTREAM_DURATION.labels(host, str(status)).observe(time.perf_counter() - start)
+
+
+def _flight_key(url: str, params: dict, force_refresh: bool) -> str:
+    key = http_cache.make_key(url, params)
+    # a forced refresh must not get the answer of a concurrent call that read the cache
+    return f"{key}:refresh" if force_refresh else key
+
+
+class ResilientAdapter(HTTPAdapter):
+    """Pooled adapter that retries within a deadline and fails fast while a host's circuit is open.
+
+    requests_cache only reaches the adapter on a cache miss, so cached responses are served
+    whatever the state of the circuit. Connection errors, timeouts and RETRY_STATUSES are
+    retried with exponential backoff, as long as the next attempt starts before the deadline.
+    """
+
+    def __init__(
+        self,
+        breakers: resilience.CircuitBreakers,
+        retries: int = 5,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        deadline: float = DEADLINE,
+        **kwargs,
+    ) -> None:
+        super().__init__(max_retries=0, **kwargs)
+        self.breakers = breakers
+        self.retries = retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+
+    def send(self, request: requests.PreparedRequest, timeout=None, **kwargs) -> requests.Response:
+        breaker = self.breakers.for_url(request.url)
+        deadline = resilience.Deadline(self.deadline)
+        for attempt in range(self.retries + 1):
+            delay = RETRY_BACKOFF_FACTOR * 2**attempt
+            can_retry = attempt < self.retries and deadline.fits(delay)
+            breaker.check()
+            timeout = (deadline.timeout(self.connect_timeout), deadline.timeout(self.read_timeout))
+            start = time.perf_counter()
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                _observe_upstream(breaker.name, start, _error_status(e))
+                breaker.record_failure()
+                if not can_retry:
+                    raise
+            else:
+                _observe_upstream(breaker.name, start, response.status_code)
+                _record_status(breaker, response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if not can_retry:
+                    raise requests.exceptions.RetryError(
+                        f"{request.url} answered {response.status_code}", response=response, request=request
+                    )
+                response.close()
+            metrics.UPSTREAM_RETRIES.labels(breaker.name).inc()
+            time.sleep(delay)
+        raise AssertionError("unreachable")
 
 
 class AbstractApiClient(abc.ABC):
@@ -52,158 +258,699 @@ class AbstractApiClient(abc.ABC):
         self,
         forecast_url: str,
         geodata_url: str,
-        session_expire_after: int = 3600,
+        session_expire_after: int = FORECAST_EXPIRE_AFTER,
         retries: int = 5,
         logger: logging.Logger | None = None,
+        pool_connections: int = 4,
+        pool_maxsize: int = 10,
+        geodata_expire_after: int = GEODATA_EXPIRE_AFTER,
+        cache_backend: "str | requests_cache.BaseCache" = "sqlite",
+        single_flight: SingleFlight | None = None,
+        city_index: geoindex.CityIndex | None = None,
+        horizon_days: int = HOURLY_HORIZON_DAYS,
+        time_series_cache_size: int = 1024,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        deadline: float = DEADLINE,
+        breakers: resilience.CircuitBreakers | None = None,
     ) -> None:
         self.FORECAST_URL = forecast_url
         self.GEODATA_URL = geodata_url
-        self.session = requests_cache.CachedSession(".cache", expire_after=session_expire_after)
-        self.retry_session = retry(self.session, retries=retries, backoff_factor=0.2)
+        self.breakers = breakers or resilience.CircuitBreakers()
+        self.single_flight = single_flight or SingleFlight()
+        self.city_index = city_index
+        self.horizon_days = horizon_days
+        # parsed hourly forecasts of the whole horizon per location, as long as the response is cached
+        self.time_series = LocalCache(time_series_cache_size, session_expire_after)
+        import requests_cache
+
+        self.session = requests_cache.CachedSession(
+            ".cache",
+            backend=cache_backend,
+            expire_after=session_expire_after,
+            urls_expire_after={
+                geodata_url: geodata_expire_after,
+                forecast_url: session_expire_after,
+            },
+        )
+        self.retry_session = self._mount_pooled_adapter(
+            self.session,
+            ResilientAdapter(
+                self.breakers,
+                retries,
+                connect_timeout,
+                read_timeout,
+                deadline,
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=True,
+            ),
+        )
         if logger is None:
             logger = logging.getLogger(__name__)
         self.logger = logger
 
+    @staticmethod
+    def _mount_pooled_adapter(session: requests.Session, adapter: HTTPAdapter) -> requests.Session:
+        # pool_connections bounds the number of cached per-host pools, pool_maxsize the number of
+        # keep-alive connections in each of them. pool_block makes the bound hard: callers wait
+        # for a free connection instead of opening throwaway ones.
+        for prefix in ("http://", "https://"):
+            session.mount(prefix, adapter)
+        return session
+
+    def pool_stats(self) -> dict[str, dict[str, int]]:
+        """Connection pool usage per upstream host since the client was created."""
+        stats = {}
+        adapters = {id(adapter): adapter for adapter in self.session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "reused": max(pool.num_requests - pool.num_connections, 0),
+                    "idle": sum(conn is not None for conn in pool.pool.queue) if pool.pool else 0,
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                }
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _coalesced(
+        self, url: str, params: dict, fn: t.Callable[[], t.Any], force_refresh: bool = False
+    ) -> t.Any:
+        """Runs `fn` once for all concurrent callers requesting the same url and params."""
+        return self.single_flight.do(_flight_key(url, params, force_refresh), fn)
+
     @abc.abstractmethod
-    def get_daily_forecast(self, geo_data: GeoData, **kwargs) -> dict[str, dm.WeatherDataPerDay]: ...
+    def get_daily_forecast(
+        self, geo_data: GeoData, *, force_refresh: bool = False, **kwargs
+    ) -> dm.ColumnarForecast: ...
 
     @abc.abstractmethod
-    def get_hourly_forecast_for_date(
-        self, geo_data: GeoData, date: datetime, **kwargs
-    ) -> dict[str, dict[str, dm.WeatherDataPerHour] | dm.amount]: ...
+    def get_daily_forecasts(
+        self, geo_datas: t.Sequence[GeoData], **kwargs
+    ) -> list[dm.ColumnarForecast | ForecastApiError]: ...
+
+    @abc.abstractmethod
+    def get_hourly_forecast_for_dates(
+        self, geo_data: GeoData, start_date: date, end_date: date, *, force_refresh: bool = False
+    ) -> dm.HourlyForecast: ...
+
+    def get_hourly_forecast_for_date(self, geo_data: GeoData, date: date) -> dm.HourlyForecast:
+        return self.get_hourly_forecast_for_dates(geo_data, date, date)
 
     @abc.abstractmethod
     def get_geodata_by_city(self, query: str) -> GeoData: ...
 
 
-class OpenMeteoApiClient(AbstractApiClient):
+class AbstractAsyncApiClient(abc.ABC):
+    """Same interface as `AbstractApiClient`, but every upstream call is awaited.
+
+    The underlying `httpx.AsyncClient` is bound to the event loop it was first used on,
+    so an instance must not be shared between event loops.
+    """
+
     def __init__(
-        self, session_expire_after: int = 3600, retries: int = 5, logger: logging.Logger = None
+        self,
+        forecast_url: str,
+        geodata_url: str,
+        retries: int = 5,
+        logger: logging.Logger | None = None,
+        max_connections: int = 10,
+        timeout: float = READ_TIMEOUT,
+        cache: http_cache.AsyncResponseCache | None = None,
+        expire_after: int = FORECAST_EXPIRE_AFTER,
+        geodata_expire_after: int = GEODATA_EXPIRE_AFTER,
+        single_flight: AsyncSingleFlight | None = None,
+        city_index: geoindex.CityIndex | None = None,
+        horizon_days: int = HOURLY_HORIZON_DAYS,
+        time_series_cache_size: int = 1024,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        deadline: float = DEADLINE,
+        breakers: resilience.CircuitBreakers | None = None,
     ) -> None:
-        super().__init__(
-            "https://api.open-meteo.com/v1/forecast",
-            "https://geocoding-api.open-meteo.com/v1/search",
-            session_expire_after,
-            retries,
-            logger,
+        self.FORECAST_URL = forecast_url
+        self.GEODATA_URL = geodata_url
+        self.breakers = breakers or resilience.CircuitBreakers()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = timeout
+        self.deadline = deadline
+        self.single_flight = single_flight or AsyncSingleFlight()
+        self.city_index = city_index
+        self.horizon_days = horizon_days
+        self.time_series = LocalCache(time_series_cache_size, expire_after)
+        self.retries = retries
+        self.cache = cache
+        self.expire_after = {forecast_url: expire_after, geodata_url: geodata_expire_after}
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
         )
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
 
-    def _try_get_geodata_by_city(self, city_name: str) -> GeoData:
-        try:
-            response = self.retry_session.get(
-                self.GEODATA_URL, {"format": "json", "name": city_name, "count": 1}
-            ).json()
+    async def _get(self, url: str, params: dict) -> httpx.Response:
+        # mirrors ResilientAdapter of the sync client: connection errors, timeouts and
+        # RETRY_STATUSES are retried with exponential backoff within the deadline, and the
+        # host's circuit breaker is asked before every attempt
+        breaker = self.breakers.for_url(url)
+        deadline = resilience.Deadline(self.deadline)
+        for attempt in range(self.retries + 1):
+            delay = RETRY_BACKOFF_FACTOR * 2**attempt
+            can_retry = attempt < self.retries and deadline.fits(delay)
+            breaker.check()
+            timeout = httpx.Timeout(
+                deadline.timeout(self.read_timeout), connect=deadline.timeout(self.connect_timeout)
+            )
+            start = time.perf_counter()
             try:
-                data = response["results"][0]
-            except (KeyError, IndexError) as e:
-                logger.error("get_geodata_by_city - invalid response: %s", response)
-                raise CoordinatesNotFoundError from e
-        except requests.exceptions.RequestException as e:
-            logger.exception("get_geodata_by_city Unexpected error: %s", e)
-            raise GettingCoordinatesError from e
+                response = await self.http.get(url, params=params, timeout=timeout)
+            except httpx.TransportError as e:
+                _observe_upstream(breaker.name, start, _error_status(e))
+                breaker.record_failure()
+                if not can_retry:
+                    raise
+            else:
+                _observe_upstream(breaker.name, start, response.status_code)
+                _record_status(breaker, response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if not can_retry:
+                    response.raise_for_status()
+            metrics.UPSTREAM_RETRIES.labels(breaker.name).inc()
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def _get_json(self, url: str, params: dict, force_refresh: bool = False) -> t.Any:
+        """GET through the response cache. Only successful responses are cached.
+
+        With `force_refresh` the cache isn't read, the response overwrites the cached one.
+        """
+        with profiling.span("upstream", url=url):
+            return await self._get_cached_json(url, params, force_refresh)
+
+    async def _get_cached_json(self, url: str, params: dict, force_refresh: bool = False) -> t.Any:
+        if self.cache is None:
+            return (await self._get(url, params)).json()
+        key = http_cache.make_key(url, params)
+        if not force_refresh:
+            cached = await self.cache.get(key)
+            metrics.cache_lookup("http", cached is not None)
+            if cached is not None:
+                return json.loads(cached)
+        response = await self._get(url, params)
+        data = response.json()
+        expire_after = self.expire_after.get(url, FORECAST_EXPIRE_AFTER)
+        if response.status_code == 200 and expire_after > 0:
+            await self.cache.set(key, response.content, expire_after)
         return data
 
-    def get_geodata_by_city(self, city_name: str) -> GeoData:
-        city_name = city_name.strip()
-        logger.debug("get_geodata_by_city: %s", city_name)
-        data = self._try_get_geodata_by_city(city_name)
+    async def close(self) -> None:
+        await self.http.aclose()
+
+    async def _coalesced(
+        self,
+        url: str,
+        params: dict,
+        fn: t.Callable[[], t.Awaitable[t.Any]],
+        force_refresh: bool = False,
+    ) -> t.Any:
+        """Awaits `fn` once for all concurrent callers requesting the same url and params."""
+        return await self.single_flight.do(_flight_key(url, params, force_refresh), fn)
+
+    @abc.abstractmethod
+    async def get_daily_forecast(
+        self, geo_data: GeoData, *, force_refresh: bool = False, **kwargs
+    ) -> dm.ColumnarForecast: ...
+
+    @abc.abstractmethod
+    async def get_daily_forecasts(
+        self, geo_datas: t.Sequence[GeoData], **kwargs
+    ) -> list[dm.ColumnarForecast | ForecastApiError]: ...
+
+    @abc.abstractmethod
+    async def get_hourly_forecast_for_dates(
+        self, geo_data: GeoData, start_date: date, end_date: date, *, force_refresh: bool = False
+    ) -> dm.HourlyForecast: ...
+
+    async def get_hourly_forecast_for_date(self, geo_data: GeoData, date: date) -> dm.HourlyForecast:
+        return await self.get_hourly_forecast_for_dates(geo_data, date, date)
+
+    @abc.abstractmethod
+    async def get_geodata_by_city(self, query: str) -> GeoData: ...
+
+
+class OpenMeteoMixin:
+    """Request parameters and response parsing shared by the sync and async Open-Meteo clients."""
+
+    # forecast field -> Open-Meteo variable it is read from
+    HOURLY_VARIABLES = {
+        "temp": "temperature_2m",
+        "temp_feels_like": "apparent_temperature",
+        "rain": "rain",
+        "precipitation_probability": "precipitation_probability",
+    }
+    DAILY_VARIABLES = {
+        "temp_min": "temperature_2m_min",
+        "temp_max": "temperature_2m_max",
+        "rain_sum": "rain_sum",
+        "precipitation_probability": "precipitation_probability_max",
+    }
+    # locations requested in one upstream call, keeps the url well below common length limits
+    BATCH_SIZE = 100
+    # daily variables fetched along with the hourly ones
+    TEMPERATURE_RANGE_VARIABLES = {
+        "temp_min": "temperature_2m_min",
+        "temp_max": "temperature_2m_max",
+    }
+
+    def _lookup_local_geodata(self, city_name: str) -> GeoData | None:
+        """Coordinates from the local city index, None when it has to be asked upstream."""
+        if self.city_index is None:
+            return None
+        city = self.city_index.lookup(city_name)
+        metrics.cache_lookup("city_index", city is not None)
+        if city is None:
+            return None
+        logger.debug("get_geodata_by_city, found in city index: %s", city)
+        return GeoData(latitude=city.latitude, longitude=city.longitude, timezone=city.timezone)
+
+    def _geodata_params(self, city_name: str) -> dict:
+        return {"format": "json", "name": city_name, "count": 1}
+
+    def _hourly_forecast_params(
+        self, geo_data: GeoData, start_date: date | None = None, end_date: date | None = None
+    ) -> dict:
+        """Parameters for the given days, or for the whole horizon without them."""
+        if start_date is None:
+            days = {"forecast_days": self.horizon_days}
+        else:
+            days = {"start_date": start_date.strftime("%Y-%m-%d"), "end_date": end_date.strftime("%Y-%m-%d")}
+        return {
+            **geo_data._asdict(),
+            **days,
+            "hourly": [
+                "temperature_2m",
+                "rain",
+                "precipitation_probability",
+                "apparent_temperature",
+            ],
+            "daily": ["temperature_2m_max", "temperature_2m_min"],
+        }
+
+    def _daily_forecast_params(self, geo_data: GeoData, **kwargs) -> dict:
+        return {
+            **geo_data._asdict(),
+            "daily": [
+                "temperature_2m_max",
+                "temperature_2m_min",
+                "rain_sum",
+                "precipitation_probability_max",
+                "apparent_temperature_max",
+                "apparent_temperature_min",
+            ],
+            **kwargs,
+        }
+
+    def _daily_forecasts_params(self, geo_datas: t.Sequence[GeoData], **kwargs) -> dict:
+        """Parameters of a single request for all of `geo_datas`, given as comma separated lists."""
+        params = self._daily_forecast_params(geo_datas[0], **kwargs)
+        for field in GeoData._fields:
+            params[field] = ",".join(str(getattr(geo_data, field)) for geo_data in geo_datas)
+        return params
+
+    def _batches(self, geo_datas: t.Sequence[GeoData]) -> list[t.Sequence[GeoData]]:
+        return [geo_datas[i : i + self.BATCH_SIZE] for i in range(0, len(geo_datas), self.BATCH_SIZE)]
+
+    def _extract_geodata(self, response: dict) -> dict:
+        try:
+            return response["results"][0]
+        except (KeyError, IndexError) as e:
+            logger.error("get_geodata_by_city - invalid response: %s", response)
+            raise CoordinatesNotFoundError from e
+
+    def _process_geodata(self, data: dict) -> GeoData:
         logger.debug("get_geodata_by_city, received data: %s", data)
         return GeoData(latitude=data["latitude"], longitude=data["longitude"], timezone=data["timezone"])
 
-    def _process_hourly_forecast(
-        self, raw_forecast: dict
-    ) -> dict[str, dict[str, dm.WeatherDataPerHour] | dm.amount]:
+    def _columns(
+        self, data: dict, units: dict, variables: dict[str, str], row_type: type
+    ) -> dm.ColumnarForecast:
+        time = data["time"]
+        columns = {}
+        for name, variable in variables.items():
+            values = data[variable]
+            if len(values) != len(time):
+                raise ValueError(f"{variable} has {len(values)} values for {len(time)} timesteps")
+            columns[name] = dm.Column(values, units[variable])
+        return dm.ColumnarForecast(time, columns, row_type)
+
+    @staticmethod
+    def _time_series_key(geo_data: GeoData) -> tuple:
+        return round(geo_data.latitude, 4), round(geo_data.longitude, 4), geo_data.timezone
+
+    @profiling.traced
+    def _process_hourly_forecast(self, raw_forecast: dict) -> dm.HourlyTimeSeries:
         try:
-            hourly = raw_forecast["hourly"]
-            units = raw_forecast["hourly_units"]
-            processed_forecast: dict[str, dm.WeatherDataPerHour] = {
-                "hourly": {},
-                "temp_min": dm.amount(
-                    raw_forecast["daily"]["temperature_2m_min"],
-                    raw_forecast["daily_units"]["temperature_2m_min"],
+            return dm.HourlyTimeSeries(
+                hourly=self._columns(
+                    raw_forecast["hourly"],
+                    raw_forecast["hourly_units"],
+                    self.HOURLY_VARIABLES,
+                    dm.WeatherDataPerHour,
                 ),
-                "temp_max": dm.amount(
-                    raw_forecast["daily"]["temperature_2m_max"],
-                    raw_forecast["daily_units"]["temperature_2m_max"],
+                daily=self._columns(
+                    raw_forecast["daily"],
+                    raw_forecast["daily_units"],
+                    self.TEMPERATURE_RANGE_VARIABLES,
+                    dm.TemperatureRange,
                 ),
-            }
-            for i in range(len(hourly["time"])):
-                processed_forecast["hourly"][hourly["time"][i]] = dm.WeatherDataPerHour(
-                    temp=dm.amount(hourly["temperature_2m"][i], units["temperature_2m"]),
-                    rain=dm.amount(hourly["rain"][i], units["rain"]),
-                    temp_feels_like=dm.amount(
-                        hourly["apparent_temperature"][i],
-                        units["apparent_temperature"],
-                    ),
-                    precipitation_probability=dm.amount(
-                        hourly["precipitation_probability"][i],
-                        units["precipitation_probability"],
-                    ),
-                )
-            return processed_forecast
+            )
         except Exception as e:
             logger.exception("error while processing hourly forecast: %s", e)
             raise ParsingForecastError from e
 
-    def _process_daily_forecast(self, raw_forecast: dict) -> dict[str, dm.WeatherDataPerDay]:
+    @profiling.traced
+    def _process_daily_forecast(self, raw_forecast: dict) -> dm.ColumnarForecast:
         try:
-            daily = raw_forecast["daily"]
-            units = raw_forecast["daily_units"]
-            processed_forecast: dict[str, dm.WeatherDataPerDay] = {}
-            for i in range(len(daily["time"])):
-                processed_forecast[daily["time"][i]] = dm.WeatherDataPerDay(
-                    temp_max=dm.amount(daily["temperature_2m_max"][i], units["temperature_2m_max"]),
-                    temp_min=dm.amount(daily["temperature_2m_min"][i], units["temperature_2m_min"]),
-                    rain_sum=dm.amount(daily["rain_sum"][i], units["rain_sum"]),
-                    precipitation_probability=dm.amount(
-                        daily["precipitation_probability_max"][i],
-                        units["precipitation_probability_max"],
-                    ),
-                )
-            return processed_forecast
+            return self._columns(
+                raw_forecast["daily"],
+                raw_forecast["daily_units"],
+                self.DAILY_VARIABLES,
+                dm.WeatherDataPerDay,
+            )
         except Exception as e:
             logger.exception("error while processing daily forecast: %s", e)
             raise ParsingForecastError from e
 
-    def get_hourly_forecast_for_date(
-        self, geo_data: GeoData, date: datetime, **kwargs
-    ) -> dict[str, dict[str, dm.WeatherDataPerHour] | dm.amount]:
-        response = self.retry_session.get(
+    def _process_daily_forecasts(
+        self, raw_forecasts: t.Any, count: int
+    ) -> list[dm.ColumnarForecast | ForecastApiError]:
+        # one location is answered with a forecast object, several with a list of them
+        if count == 1 and isinstance(raw_forecasts, dict):
+            raw_forecasts = [raw_forecasts]
+        if not isinstance(raw_forecasts, list) or len(raw_forecasts) != count:
+            logger.error("invalid response for %d locations: %s", count, raw_forecasts)
+            return [ParsingForecastError(f"expected forecasts for {count} locations")] * count
+        results: list[dm.ColumnarForecast | ForecastApiError] = []
+        for raw_forecast in raw_forecasts:
+            try:
+                results.append(self._process_daily_forecast(raw_forecast))
+            except ParsingForecastError as e:
+                results.append(e)
+        return results
+
+
+class OpenMeteoApiClient(OpenMeteoMixin, AbstractApiClient):
+    def __init__(
+        self,
+        session_expire_after: int = FORECAST_EXPIRE_AFTER,
+        retries: int = 5,
+        logger: logging.Logger = None,
+        pool_connections: int = 4,
+        pool_maxsize: int = 10,
+        forecast_url: str = OPEN_METEO_FORECAST_URL,
+        geodata_url: str = OPEN_METEO_GEODATA_URL,
+        geodata_expire_after: int = GEODATA_EXPIRE_AFTER,
+        cache_backend: "str | requests_cache.BaseCache" = "sqlite",
+        single_flight: SingleFlight | None = None,
+        city_index: geoindex.CityIndex | None = None,
+        horizon_days: int = HOURLY_HORIZON_DAYS,
+        time_series_cache_size: int = 1024,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        deadline: float = DEADLINE,
+        breakers: resilience.CircuitBreakers | None = None,
+    ) -> None:
+        super().__init__(
+            forecast_url,
+            geodata_url,
+            session_expire_after,
+            retries,
+            logger,
+            pool_connections,
+            pool_maxsize,
+            geodata_expire_after,
+            cache_backend,
+            single_flight,
+            city_index,
+            horizon_days,
+            time_series_cache_size,
+            connect_timeout,
+            read_timeout,
+            deadline,
+            breakers,
+        )
+
+    def _get_json(self, url: str, params: dict, **kwargs) -> t.Any:
+        """GET through the requests_cache session."""
+        with profiling.span("upstream", url=url):
+            response = self.retry_session.get(url, params, **kwargs)
+            if not kwargs.get("force_refresh"):
+                # forced refreshes don't look up the cache
+                metrics.cache_lookup("http", response.from_cache)
+            return response.json()
+
+    def _try_get_geodata_by_city(self, city_name: str) -> dict:
+        try:
+            response = self._get_json(self.GEODATA_URL, self._geodata_params(city_name))
+            data = self._extract_geodata(response)
+        except (requests.exceptions.RequestException, resilience.CircuitOpenError) as e:
+            logger.exception("get_geodata_by_city Unexpected error: %s", e)
+            raise GettingCoordinatesError from e
+        return data
+
+    @profiling.traced
+    def get_geodata_by_city(self, city_name: str) -> GeoData:
+        city_name = city_name.strip()
+        logger.debug("get_geodata_by_city: %s", city_name)
+        geo_data = self._lookup_local_geodata(city_name)
+        if geo_data is not None:
+            return geo_data
+        return self._coalesced(
+            self.GEODATA_URL,
+            self._geodata_params(city_name),
+            lambda: self._process_geodata(self._try_get_geodata_by_city(city_name)),
+        )
+
+    def _try_get_forecast(self, params: dict, force_refresh: bool = False) -> dict:
+        try:
+            return self._get_json(self.FORECAST_URL, params, force_refresh=force_refresh)
+        except (requests.exceptions.RequestException, resilience.CircuitOpenError) as e:
+            logger.exception("error while getting forecast: %s", e)
+            raise GettingForecastError from e
+
+    def _get_hourly_time_series(
+        self,
+        geo_data: GeoData,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        force_refresh: bool = False,
+    ) -> dm.HourlyTimeSeries:
+        params = self._hourly_forecast_params(geo_data, start_date, end_date)
+        return self._coalesced(
             self.FORECAST_URL,
-            {
-                **geo_data._asdict(),
-                "start_date": date.strftime("%Y-%m-%d"),
-                "end_date": date.strftime("%Y-%m-%d"),
-                "hourly": [
-                    "temperature_2m",
-                    "rain",
-                    "precipitation_probability",
-                    "apparent_temperature",
-                ],
-                "daily": ["temperature_2m_max", "temperature_2m_min"],
-                **kwargs,
-            },
+            params,
+            lambda: self._process_hourly_forecast(self._try_get_forecast(params, force_refresh)),
+            force_refresh,
         )
-        resp_data = response.json()
-        processed_forecast = self._process_hourly_forecast(resp_data)
-        return processed_forecast
 
-    def get_daily_forecast(self, geo_data: GeoData, **kwargs) -> dict[str, dm.WeatherDataPerDay]:
-        response = self.retry_session.get(
+    def get_hourly_forecast_for_dates(
+        self, geo_data: GeoData, start_date: date, end_date: date, *, force_refresh: bool = False
+    ) -> dm.HourlyForecast:
+        """Hourly forecast sliced from the cached time series of `geo_data`.
+
+        With `force_refresh` neither the time series nor the HTTP cache is read, the upstream
+        answers and both are overwritten.
+        """
+        key = self._time_series_key(geo_data)
+        series = None if force_refresh else self.time_series.get(key)
+        if not force_refresh:
+            metrics.cache_lookup("time_series", series is not None)
+        if series is None:
+            series = self._get_hourly_time_series(geo_data, force_refresh=force_refresh)
+            self.time_series.set(key, series)
+        if not series.covers(start_date, end_date):
+            # past days or days beyond the horizon are requested on their own
+            series = self._get_hourly_time_series(geo_data, start_date, end_date, force_refresh)
+        return series.for_dates(start_date, end_date)
+
+    def get_daily_forecast(
+        self, geo_data: GeoData, *, force_refresh: bool = False, **kwargs
+    ) -> dm.ColumnarForecast:
+        """Daily forecast of `geo_data`, with `force_refresh` the HTTP cache isn't read."""
+        params = self._daily_forecast_params(geo_data, **kwargs)
+        return self._coalesced(
             self.FORECAST_URL,
-            {
-                **geo_data._asdict(),
-                "daily": [
-                    "temperature_2m_max",
-                    "temperature_2m_min",
-                    "rain_sum",
-                    "precipitation_probability_max",
-                    "apparent_temperature_max",
-                    "apparent_temperature_min",
-                ],
-                **kwargs,
-            },
+            params,
+            lambda: self._process_daily_forecast(self._try_get_forecast(params, force_refresh)),
+            force_refresh,
+        )
+
+    def refresh_forecasts(self, geo_data: GeoData, **kwargs) -> dm.ColumnarForecast:
+        """Fetches the hourly time series and the daily forecast of `geo_data` again.
+
+        The cached responses are overwritten rather than read, so they start over with a full
+        lifetime. Returns the daily forecast.
+        """
+        series = self._process_hourly_forecast(
+            self._try_get_forecast(self._hourly_forecast_params(geo_data), force_refresh=True)
+        )
+        self.time_series.set(self._time_series_key(geo_data), series)
+        params = self._daily_forecast_params(geo_data, **kwargs)
+        return self._process_daily_forecast(self._try_get_forecast(params, force_refresh=True))
+
+    def get_daily_forecasts(
+        self, geo_datas: t.Sequence[GeoData], **kwargs
+    ) -> list[dm.ColumnarForecast | ForecastApiError]:
+        """Forecasts for several locations, one upstream call per `BATCH_SIZE` of them.
+
+        Results are in the order of `geo_datas`, a location that failed gets the exception.
+        """
+        results: list[dm.ColumnarForecast | ForecastApiError] = []
+        for batch in self._batches(geo_datas):
+            params = self._daily_forecasts_params(batch, **kwargs)
+            try:
+                raw_forecasts = self._coalesced(
+                    self.FORECAST_URL, params, lambda: self._try_get_forecast(params)
+                )
+            except GettingForecastError as e:
+                results.extend([e] * len(batch))
+                continue
+            results.extend(self._process_daily_forecasts(raw_forecasts, len(batch)))
+        return results
+
+
+class AsyncOpenMeteoApiClient(OpenMeteoMixin, AbstractAsyncApiClient):
+    def __init__(
+        self,
+        retries: int = 5,
+        logger: logging.Logger = None,
+        max_connections: int = 10,
+        timeout: float = READ_TIMEOUT,
+        forecast_url: str = OPEN_METEO_FORECAST_URL,
+        geodata_url: str = OPEN_METEO_GEODATA_URL,
+        cache: http_cache.AsyncResponseCache | None = None,
+        expire_after: int = FORECAST_EXPIRE_AFTER,
+        geodata_expire_after: int = GEODATA_EXPIRE_AFTER,
+        single_flight: AsyncSingleFlight | None = None,
+        city_index: geoindex.CityIndex | None = None,
+        horizon_days: int = HOURLY_HORIZON_DAYS,
+        time_series_cache_size: int = 1024,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        deadline: float = DEADLINE,
+        breakers: resilience.CircuitBreakers | None = None,
+    ) -> None:
+        super().__init__(
+            forecast_url,
+            geodata_url,
+            retries,
+            logger,
+            max_connections,
+            timeout,
+            cache,
+            expire_after,
+            geodata_expire_after,
+            single_flight,
+            city_index,
+            horizon_days,
+            time_series_cache_size,
+            connect_timeout,
+            deadline,
+            breakers,
         )
-        resp_data = response.json()
-        processed_forecast = self._process_daily_forecast(resp_data)
-        return processed_forecast
+
+    async def _try_get_geodata_by_city(self, city_name: str) -> dict:
+        try:
+            response = await self._get_json(self.GEODATA_URL, self._geodata_params(city_name))
+            data = self._extract_geodata(response)
+        except (httpx.HTTPError, ValueError, resilience.CircuitOpenError) as e:
+            logger.exception("get_geodata_by_city Unexpected error: %s", e)
+            raise GettingCoordinatesError from e
+        return data
+
+    @profiling.traced
+    async def get_geodata_by_city(self, city_name: str) -> GeoData:
+        city_name = city_name.strip()
+        logger.debug("get_geodata_by_city: %s", city_name)
+        geo_data = self._lookup_local_geodata(city_name)
+        if geo_data is not None:
+            return geo_data
+
+        async def fetch() -> GeoData:
+            return self._process_geodata(await self._try_get_geodata_by_city(city_name))
+
+        return await self._coalesced(self.GEODATA_URL, self._geodata_params(city_name), fetch)
+
+    async def _try_get_forecast(self, params: dict, force_refresh: bool = False) -> dict:
+        try:
+            return await self._get_json(self.FORECAST_URL, params, force_refresh)
+        except (httpx.HTTPError, ValueError, resilience.CircuitOpenError) as e:
+            logger.exception("error while getting forecast: %s", e)
+            raise GettingForecastError from e
+
+    async def _get_hourly_time_series(
+        self,
+        geo_data: GeoData,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        force_refresh: bool = False,
+    ) -> dm.HourlyTimeSeries:
+        params = self._hourly_forecast_params(geo_data, start_date, end_date)
+
+        async def fetch() -> dm.HourlyTimeSeries:
+            return self._process_hourly_forecast(await self._try_get_forecast(params, force_refresh))
+
+        return await self._coalesced(self.FORECAST_URL, params, fetch, force_refresh)
+
+    async def get_hourly_forecast_for_dates(
+        self, geo_data: GeoData, start_date: date, end_date: date, *, force_refresh: bool = False
+    ) -> dm.HourlyForecast:
+        key = self._time_series_key(geo_data)
+        series = None if force_refresh else self.time_series.get(key)
+        if not force_refresh:
+            metrics.cache_lookup("time_series", series is not None)
+        if series is None:
+            series = await self._get_hourly_time_series(geo_data, force_refresh=force_refresh)
+            self.time_series.set(key, series)
+        if not series.covers(start_date, end_date):
+            # past days or days beyond the horizon are requested on their own
+            series = await self._get_hourly_time_series(geo_data, start_date, end_date, force_refresh)
+        return series.for_dates(start_date, end_date)
+
+    async def get_daily_forecast(
+        self, geo_data: GeoData, *, force_refresh: bool = False, **kwargs
+    ) -> dm.ColumnarForecast:
+        params = self._daily_forecast_params(geo_data, **kwargs)
+
+        async def fetch() -> dm.ColumnarForecast:
+            return self._process_daily_forecast(await self._try_get_forecast(params, force_refresh))
+
+        return await self._coalesced(self.FORECAST_URL, params, fetch, force_refresh)
+
+    async def get_daily_forecasts(
+        self, geo_datas: t.Sequence[GeoData], **kwargs
+    ) -> list[dm.ColumnarForecast | ForecastApiError]:
+        """Forecasts for several locations, the batches of `BATCH_SIZE` are requested concurrently."""
+
+        async def fetch_batch(batch: t.Sequence[GeoData]) -> list[dm.ColumnarForecast | ForecastApiError]:
+            params = self._daily_forecasts_params(batch, **kwargs)
+            try:
+                raw_forecasts = await self._coalesced(
+                    self.FORECAST_URL, params, lambda: self._try_get_forecast(params)
+                )
+            except GettingForecastError as e:
+                return [e] * len(batch)
+            return self._process_daily_forecasts(raw_forecasts, len(batch))
+
+        batches = await asyncio.gather(*(fetch_batch(batch) for batch in self._batches(geo_datas)))
+        return [result for batch in batches for result in batch]
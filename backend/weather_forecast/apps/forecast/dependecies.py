@@ -1,8 +1,18 @@
+import asyncio
 import logging
+import os
+import threading
+import typing as t
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
+from core import redis as core_redis
 from django.conf import settings
 
-from forecast import api_client
+from forecast import api_client, geoindex, http_cache, resilience, singleflight
+from forecast import payload_cache as pc
+from forecast import search_history as sh
+from forecast import stale_cache as sc
 from forecast import repositories as repos
 from forecast.domain import service
 
@@ -14,8 +24,316 @@ def get_logger(name) -> logging.Logger:
     return logger
 
 
-def get_forecast_service(logger_name: str = "forecast_service") -> service.ForecastService:
+def _uses_shared_cache() -> bool:
+    # locking across workers only pays off when they can read each other's responses
+    return settings.FORECAST_API_CACHE_BACKEND == "redis"
+
+
+def _build_cities_count_repo() -> service.CitiesCountRepoI:
+    if settings.FORECAST_POPULARITY_SKETCH:
+        return repos.SketchCitiesCountRepository(
+            repos.CitiesCountSketchRedis(
+                settings.FORECAST_POPULARITY_SKETCH_EPSILON,
+                settings.FORECAST_POPULARITY_SKETCH_DELTA,
+                settings.FORECAST_POPULARITY_SKETCH_TOP_K,
+            ),
+            epsilon=settings.FORECAST_POPULARITY_SKETCH_EPSILON,
+            delta=settings.FORECAST_POPULARITY_SKETCH_DELTA,
+            top_k=settings.FORECAST_POPULARITY_SKETCH_TOP_K,
+            flush_interval=settings.FORECAST_POPULARITY_FLUSH_INTERVAL,
+            flush_size=settings.FORECAST_POPULARITY_FLUSH_SIZE,
+        )
     repo = repos.CitiesCountRepositoryRedis()
-    client = api_client.OpenMeteoApiClient()
-    logger = get_logger(logger_name)
-    return service.ForecastService(repo=repo, logger=logger, api_client=client)
+    if not settings.FORECAST_POPULARITY_WRITE_BEHIND:
+        return repo
+    return repos.BufferedCitiesCountRepository(
+        repo,
+        flush_interval=settings.FORECAST_POPULARITY_FLUSH_INTERVAL,
+        flush_size=settings.FORECAST_POPULARITY_FLUSH_SIZE,
+        max_pending=settings.FORECAST_POPULARITY_MAX_PENDING,
+    )
+
+
+class ServiceContainer:
+    """Per-process holder of the long-lived forecast dependencies.
+
+    Everything is built lazily on first use and dropped in forked children, so each
+    gunicorn worker opens its own connection pool and cache handle instead of
+    inheriting the sockets of the process it was forked from.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.breakers = self._new_breakers()
+        self._city_index: geoindex.CityIndex | None = None
+        self._city_index_loaded = False
+        self._api_client: api_client.OpenMeteoApiClient | None = None
+        self._reverse_geocoder: api_client.ReverseGeocoder | None = None
+        self._forecast_service: service.ForecastService | None = None
+        self._payload_cache: pc.PayloadCache | None = None
+        self._stale_cache: sc.StaleCache | None = None
+        self._history_store: sh.HistoryStore | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._cities_count_repo: service.CitiesCountRepoI | None = None
+        # async clients are bound to an event loop: one service per loop, dropped with the loop
+        self._async_forecast_services: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, service.AsyncForecastService
+        ] = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _new_breakers() -> resilience.CircuitBreakers:
+        """Circuit breakers per upstream host, shared by the sync and every async client."""
+        return resilience.CircuitBreakers(
+            settings.FORECAST_API_BREAKER_FAILURE_THRESHOLD, settings.FORECAST_API_BREAKER_RECOVERY_TIMEOUT
+        )
+
+    @property
+    def city_index(self) -> geoindex.CityIndex | None:
+        """Local city index, None when it hasn't been built (see the build_geoindex command)."""
+        if not self._city_index_loaded:
+            with self._lock:
+                if not self._city_index_loaded:
+                    self._city_index = geoindex.CityIndex.open(settings.FORECAST_CITY_INDEX_PATH)
+                    if self._city_index is None:
+                        get_logger(__name__).warning(
+                            "city index %s not found, geocoding through the upstream api",
+                            settings.FORECAST_CITY_INDEX_PATH,
+                        )
+                    self._city_index_loaded = True
+        return self._city_index
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Threads shared by the services for blocking calls made in parallel."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        settings.FORECAST_EXECUTOR_MAX_WORKERS, thread_name_prefix="forecast"
+                    )
+        return self._executor
+
+    @property
+    def cities_count_repo(self) -> service.CitiesCountRepoI:
+        """Popularity counters, shared by all services of the process so they share one buffer."""
+        if self._cities_count_repo is None:
+            with self._lock:
+                if self._cities_count_repo is None:
+                    self._cities_count_repo = _build_cities_count_repo()
+        return self._cities_count_repo
+
+    @property
+    def reverse_geocoder(self) -> api_client.ReverseGeocoder:
+        if self._reverse_geocoder is None:
+            city_index = self.city_index
+            with self._lock:
+                if self._reverse_geocoder is None:
+                    self._reverse_geocoder = api_client.ReverseGeocoder(
+                        city_index,
+                        nominatim_fallback=settings.FORECAST_REVERSE_GEOCODING_NOMINATIM_FALLBACK,
+                        max_distance_km=settings.FORECAST_REVERSE_GEOCODING_MAX_DISTANCE_KM,
+                        timeout=settings.FORECAST_API_READ_TIMEOUT,
+                        breaker=self.breakers.get("nominatim"),
+                        nominatim_url=settings.FORECAST_NOMINATIM_URL,
+                    )
+        return self._reverse_geocoder
+
+    @property
+    def api_client(self) -> api_client.OpenMeteoApiClient:
+        if self._api_client is None:
+            city_index = self.city_index
+            with self._lock:
+                if self._api_client is None:
+                    self._api_client = api_client.OpenMeteoApiClient(
+                        session_expire_after=settings.FORECAST_API_CACHE_EXPIRE_AFTER["forecast"],
+                        pool_connections=settings.FORECAST_API_POOL_CONNECTIONS,
+                        pool_maxsize=settings.FORECAST_API_POOL_MAXSIZE,
+                        forecast_url=settings.FORECAST_API_URL,
+                        geodata_url=settings.FORECAST_GEODATA_API_URL,
+                        geodata_expire_after=settings.FORECAST_API_CACHE_EXPIRE_AFTER["geodata"],
+                        cache_backend=http_cache.get_sync_backend(
+                            settings.FORECAST_API_CACHE_BACKEND, settings.FORECAST_API_CACHE_REDIS_DB
+                        ),
+                        single_flight=singleflight.SingleFlight(
+                            core_redis.get_connection(settings.FORECAST_API_CACHE_REDIS_DB)
+                            if _uses_shared_cache()
+                            else None,
+                            settings.FORECAST_API_SINGLE_FLIGHT_LOCK_TIMEOUT,
+                        ),
+                        city_index=city_index,
+                        horizon_days=settings.FORECAST_HOURLY_HORIZON_DAYS,
+                        time_series_cache_size=settings.FORECAST_TIME_SERIES_CACHE_SIZE,
+                        connect_timeout=settings.FORECAST_API_CONNECT_TIMEOUT,
+                        read_timeout=settings.FORECAST_API_READ_TIMEOUT,
+                        deadline=settings.FORECAST_API_DEADLINE,
+                        breakers=self.breakers,
+                    )
+        return self._api_client
+
+    @property
+    def forecast_service(self) -> service.ForecastService:
+        if self._forecast_service is None:
+            client = self.api_client
+            reverse_geocoder = self.reverse_geocoder
+            executor = self.executor
+            repo = self.cities_count_repo
+            stale_cache = self.stale_cache
+            with self._lock:
+                if self._forecast_service is None:
+                    self._forecast_service = service.ForecastService(
+                        repo=repo,
+                        logger=get_logger("forecast_service"),
+                        api_client=client,
+                        reverse_geocoder=reverse_geocoder,
+                        executor=executor,
+                        stale_cache=stale_cache,
+                        grid_precision=settings.FORECAST_GRID_PRECISION,
+                    )
+        return self._forecast_service
+
+    @property
+    def async_forecast_service(self) -> service.AsyncForecastService:
+        """Service for the running event loop. Must be accessed from a coroutine."""
+        loop = asyncio.get_running_loop()
+        forecast_service = self._async_forecast_services.get(loop)
+        if forecast_service is None:
+            client = api_client.AsyncOpenMeteoApiClient(
+                max_connections=settings.FORECAST_API_POOL_MAXSIZE,
+                timeout=settings.FORECAST_API_READ_TIMEOUT,
+                forecast_url=settings.FORECAST_API_URL,
+                geodata_url=settings.FORECAST_GEODATA_API_URL,
+                cache=http_cache.get_async_backend(
+                    settings.FORECAST_API_CACHE_BACKEND, settings.FORECAST_API_CACHE_REDIS_DB
+                ),
+                expire_after=settings.FORECAST_API_CACHE_EXPIRE_AFTER["forecast"],
+                geodata_expire_after=settings.FORECAST_API_CACHE_EXPIRE_AFTER["geodata"],
+                single_flight=singleflight.AsyncSingleFlight(
+                    core_redis.get_async_connection(settings.FORECAST_API_CACHE_REDIS_DB)
+                    if _uses_shared_cache()
+                    else None,
+                    settings.FORECAST_API_SINGLE_FLIGHT_LOCK_TIMEOUT,
+                ),
+                city_index=self.city_index,
+                horizon_days=settings.FORECAST_HOURLY_HORIZON_DAYS,
+                time_series_cache_size=settings.FORECAST_TIME_SERIES_CACHE_SIZE,
+                connect_timeout=settings.FORECAST_API_CONNECT_TIMEOUT,
+                deadline=settings.FORECAST_API_DEADLINE,
+                breakers=self.breakers,
+            )
+            forecast_service = self._async_forecast_services[loop] = service.AsyncForecastService(
+                repo=self.cities_count_repo,
+                logger=get_logger("forecast_service"),
+                api_client=client,
+                reverse_geocoder=self.reverse_geocoder,
+                stale_cache=self.stale_cache,
+                grid_precision=settings.FORECAST_GRID_PRECISION,
+                executor=self.executor,
+            )
+        return forecast_service
+
+    @property
+    def payload_cache(self) -> pc.PayloadCache | None:
+        """Cache of rendered forecast responses, None when it is disabled."""
+        if not settings.FORECAST_PAYLOAD_CACHE_ENABLED:
+            return None
+        if self._payload_cache is None:
+            with self._lock:
+                if self._payload_cache is None:
+                    self._payload_cache = pc.PayloadCache(
+                        settings.FORECAST_PAYLOAD_CACHE,
+                        settings.FORECAST_PAYLOAD_CACHE_UPDATE_INTERVAL,
+                        settings.FORECAST_PAYLOAD_CACHE_UPDATE_OFFSET,
+                        settings.FORECAST_GRID_PRECISION,
+                        fresh_for=(
+                            settings.FORECAST_STALE_CACHE_FRESH_FOR
+                            if settings.FORECAST_STALE_CACHE_ENABLED
+                            else None
+                        ),
+                    )
+        return self._payload_cache
+
+    @property
+    def history_store(self) -> sh.HistoryStore:
+        if self._history_store is None:
+            with self._lock:
+                if self._history_store is None:
+                    self._history_store = sh.get_store(
+                        settings.FORECAST_HISTORY_BACKEND,
+                        settings.FORECAST_HISTORY_REDIS_DB,
+                        settings.FORECAST_HISTORY_MAX_LENGTH,
+                        settings.FORECAST_HISTORY_TTL,
+                    )
+        return self._history_store
+
+    @property
+    def stale_cache(self) -> sc.StaleCache | None:
+        """Cache of parsed forecasts served while stale, None when it is disabled."""
+        if not settings.FORECAST_STALE_CACHE_ENABLED:
+            return None
+        if self._stale_cache is None:
+            executor = self.executor
+            with self._lock:
+                if self._stale_cache is None:
+                    self._stale_cache = sc.StaleCache(
+                        settings.FORECAST_STALE_CACHE,
+                        fresh_for=settings.FORECAST_STALE_CACHE_FRESH_FOR,
+                        stale_while_revalidate=settings.FORECAST_STALE_CACHE_STALE_WHILE_REVALIDATE,
+                        stale_if_error=settings.FORECAST_STALE_CACHE_STALE_IF_ERROR,
+                        executor=executor,
+                    )
+        return self._stale_cache
+
+    def reset(self) -> None:
+        # called in a freshly forked child: the parent keeps using the old objects, so they
+        # are only forgotten here, never closed. The lock is replaced as well because it might
+        # have been held by another thread at the moment of the fork. The city index is a
+        # read-only mmap and is kept, so its pages stay shared with the parent. Threads don't
+        # survive the fork: the executor and the popularity buffer are started again, the
+        # increments pending in the parent are left for the parent to write. Circuit breakers
+        # start closed, every worker finds out about a failing upstream on its own.
+        self._lock = threading.Lock()
+        self.breakers = self._new_breakers()
+        self._executor = None
+        self._payload_cache = None
+        self._stale_cache = None
+        self._history_store = None
+        self._cities_count_repo = None
+        self._api_client = None
+        self._reverse_geocoder = None
+        self._forecast_service = None
+        self._async_forecast_services = weakref.WeakKeyDictionary()
+
+    def pool_stats(self) -> dict[str, dict[str, int]]:
+        if self._api_client is None:
+            return {}
+        return self._api_client.pool_stats()
+
+    def popularity_stats(self) -> dict[str, int | float]:
+        """Flush counters of the write-behind popularity buffer, empty when it isn't used."""
+        if not isinstance(self._cities_count_repo, repos.BufferedCitiesCountRepository):
+            return {}
+        return self._cities_count_repo.stats.as_dict()
+
+    def breaker_stats(self) -> dict[str, dict[str, t.Any]]:
+        """State and counters of the circuit breaker of every upstream host called so far."""
+        return self.breakers.stats()
+
+    def single_flight_stats(self) -> dict[str, int]:
+        """Coalescing counters summed over the sync client and every async one."""
+        clients = [svc.client for svc in list(self._async_forecast_services.values())]
+        if self._api_client is not None:
+            clients.append(self._api_client)
+        total = sum((client.single_flight.stats for client in clients), singleflight.SingleFlightStats())
+        return total.as_dict()
+
+
+container = ServiceContainer()
+os.register_at_fork(after_in_child=container.reset)
+
+
+def get_forecast_service() -> service.ForecastService:
+    return container.forecast_service
+
+
+def get_async_forecast_service() -> service.AsyncForecastService:
+    return container.async_forecast_service
@@ -1,19 +1,24 @@
+import bisect
+import typing as t
 from dataclasses import dataclass
+from datetime import date, timedelta
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CitiesCountDTO:
     name: str
     count: int
+    # position in the popularity ranking, starting from 1
+    rank: int | None = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class amount:  # noqa: N801
     value: int
     unit: str | None = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WeatherDataPerHour:
     temp: amount
     temp_feels_like: amount
@@ -21,9 +26,109 @@ class WeatherDataPerHour:
     precipitation_probability: amount
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WeatherDataPerDay:
     temp_min: amount
     temp_max: amount
     rain_sum: amount
     precipitation_probability: amount
+
+
+@dataclass(frozen=True, slots=True)
+class TemperatureRange:
+    temp_min: amount
+    temp_max: amount
+
+
+@dataclass(frozen=True, slots=True)
+class Column:
+    """Values of one variable for every timestep, sharing a single unit."""
+
+    values: t.Sequence[t.Any]
+    unit: str | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class ColumnarForecast:
+    """Forecast kept the way Open-Meteo sends it: a time axis and parallel value columns.
+
+    Rows are only materialized on access, serialization goes straight from the columns
+    (see `forecast.encoding`).
+    """
+
+    time: t.Sequence[str]
+    columns: dict[str, Column]
+    row_type: type
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, index: int) -> t.Any:
+        return self.row_type(
+            **{name: amount(column.values[index], column.unit) for name, column in self.columns.items()}
+        )
+
+    def between(self, start: str | None = None, stop: str | None = None) -> "ColumnarForecast":
+        """Rows with ``start <= time < stop``, ISO timestamps sort the way the times they denote do."""
+        lo = 0 if start is None else bisect.bisect_left(self.time, start)
+        hi = len(self.time) if stop is None else bisect.bisect_left(self.time, stop)
+        if lo == 0 and hi == len(self.time):
+            return self
+        return ColumnarForecast(
+            self.time[lo:hi],
+            {name: Column(column.values[lo:hi], column.unit) for name, column in self.columns.items()},
+            self.row_type,
+        )
+
+    def items(self) -> t.Iterator[tuple[str, t.Any]]:
+        for i, time in enumerate(self.time):
+            yield time, self[i]
+
+    def as_dict(self) -> dict[str, dict[str, dict[str, t.Any]]]:
+        """``{time: {field: {"value": ..., "unit": ...}}}``, the same shape `asdict` gives for rows."""
+        names = list(self.columns)
+        units = [column.unit for column in self.columns.values()]
+        rows = zip(*(column.values for column in self.columns.values()))
+        return {
+            time: {name: {"value": value, "unit": unit} for name, value, unit in zip(names, row, units)}
+            for time, row in zip(self.time, rows)
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class HourlyForecast:
+    hourly: ColumnarForecast
+    temp_min: amount
+    temp_max: amount
+
+    def as_dict(self) -> dict[str, t.Any]:
+        return {
+            "hourly": self.hourly.as_dict(),
+            "temp_min": {"value": self.temp_min.value, "unit": self.temp_min.unit},
+            "temp_max": {"value": self.temp_max.value, "unit": self.temp_max.unit},
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class HourlyTimeSeries:
+    """Hourly forecast of a location over a range of days, sliced into `HourlyForecast`s by date."""
+
+    hourly: ColumnarForecast
+    # temperature range of every day
+    daily: ColumnarForecast
+
+    def covers(self, start: date, end: date) -> bool:
+        days = self.daily.time
+        return bool(days) and days[0] <= start.strftime("%Y-%m-%d") and end.strftime("%Y-%m-%d") <= days[-1]
+
+    def for_dates(self, start: date | None = None, end: date | None = None) -> HourlyForecast:
+        """Forecast from the first hour of `start` to the last hour of `end`, both optional."""
+        first = start.strftime("%Y-%m-%d") if start is not None else None
+        stop = (end + timedelta(days=1)).strftime("%Y-%m-%d") if end is not None else None
+        daily = self.daily.between(first, stop)
+        temp_min, temp_max = daily.columns["temp_min"], daily.columns["temp_max"]
+        return HourlyForecast(
+            hourly=self.hourly.between(first, stop),
+            temp_min=amount(temp_min.values, temp_min.unit),
+            temp_max=amount(temp_max.values, temp_max.unit),
+        )
@@ -1,19 +1,74 @@
+import asyncio
+import functools
 import logging
 import typing as t
-from dataclasses import asdict
-from datetime import datetime
+from concurrent.futures import FIRST_EXCEPTION, Executor, wait
+from datetime import date, datetime
+
+from asgiref.sync import sync_to_async
+from core import redis as core_redis
 
 from forecast import api_client as client
+from forecast import geogrid, metrics, profiling
+from forecast import stale_cache as sc
 from forecast.domain import models as dm
 from forecast.search_history import SearchHistory
 
+T = t.TypeVar("T")
+
 
 class CitiesCountRepoI(t.Protocol):
     def create_or_incr(self, city_name: str) -> None: ...
 
+    def count(self, window: str | None = None) -> int: ...
+
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]: ...
+
     def get_all(self) -> list[dm.CitiesCountDTO]: ...
 
 
+class CitiesRanking(t.Sequence[dm.CitiesCountDTO]):
+    """Cities by popularity, read from the repository one slice at a time.
+
+    Behaves like a queryset for pagination: `count()` and slicing only fetch what is asked for.
+    """
+
+    def __init__(self, repo: CitiesCountRepoI, window: str | None = None) -> None:
+        self.repo = repo
+        self.window = window
+        self._count: int | None = None
+
+    def count(self) -> int:
+        if self._count is None:
+            self._count = self.repo.count(self.window)
+        return self._count
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __iter__(self) -> t.Iterator[dm.CitiesCountDTO]:
+        return iter(self[:])
+
+    @t.overload
+    def __getitem__(self, index: int) -> dm.CitiesCountDTO: ...
+
+    @t.overload
+    def __getitem__(self, index: slice) -> list[dm.CitiesCountDTO]: ...
+
+    def __getitem__(self, index: int | slice) -> dm.CitiesCountDTO | list[dm.CitiesCountDTO]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count())
+            if step != 1:
+                raise ValueError("CitiesRanking doesn't support slicing with a step")
+            return self.repo.get_ranked(start, stop - start, self.window)
+        if index < 0:
+            index += self.count()
+        ranked = self.repo.get_ranked(index, 1, self.window) if index >= 0 else []
+        if not ranked:
+            raise IndexError("CitiesRanking index out of range")
+        return ranked[0]
+
+
 class ForecastServiceError(Exception): ...
 
 
@@ -25,6 +80,16 @@ class Coords(t.NamedTuple):
     lon: str
 
 
+class BatchItem(t.NamedTuple):
+    """Result for one location of a batch lookup, either `forecast` or `error` is set."""
+
+    index: int
+    query: str | Coords
+    city_name: str | None = None
+    forecast: dm.ColumnarForecast | None = None
+    error: Exception | None = None
+
+
 class ForecastServiceI(t.Protocol):
     def get_daily_forecast(
         self,
@@ -32,7 +97,20 @@ class ForecastServiceI(t.Protocol):
         history: SearchHistory,
         city_name: str | None = None,
         coords: Coords | None = None,
-    ) -> tuple[dict[str, dm.WeatherDataPerDay], str]: ...
+    ) -> tuple[dm.ColumnarForecast, str, sc.Freshness]: ...
+
+    def get_daily_and_hourly_forecast(
+        self,
+        duration_days: int,
+        hourly_date: date,
+        history: SearchHistory,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.ColumnarForecast, dm.HourlyForecast, str, sc.Freshness]: ...
+
+    def get_daily_forecasts(
+        self, duration_days: int, locations: t.Sequence[str | Coords]
+    ) -> t.Iterator[BatchItem]: ...
 
     def get_hourly_forecast_for_date(
         self,
@@ -40,10 +118,20 @@ class ForecastServiceI(t.Protocol):
         history: SearchHistory,
         city_name: str | None = None,
         coords: Coords | None = None,
-    ) -> tuple[dict[str, dm.WeatherDataPerHour], str]: ...
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]: ...
+
+    def get_hourly_forecast_for_dates(
+        self,
+        start_date: date,
+        end_date: date,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]: ...
 
     def get_cities_count(self) -> list[dm.CitiesCountDTO]: ...
 
+    def get_cities_ranking(self, window: str | None = None) -> CitiesRanking: ...
+
     def get_last_viewed_city(self, history: SearchHistory) -> str: ...
 
 
@@ -55,14 +143,39 @@ class HistoryList(t.Protocol):
 
 class ForecastService:
     def __init__(
-        self, repo: CitiesCountRepoI, logger: logging.Logger | None, api_client: client.AbstractApiClient
+        self,
+        repo: CitiesCountRepoI,
+        logger: logging.Logger | None,
+        api_client: client.AbstractApiClient,
+        reverse_geocoder: client.ReverseGeocoder | None = None,
+        executor: Executor | None = None,
+        stale_cache: sc.StaleCache | None = None,
+        grid_precision: int = 0,
     ) -> None:
         self.repo = repo
         if logger is None:
             logger = logging.getLogger(__name__)
         self.logger = logger
         self.client = api_client
+        if reverse_geocoder is None:
+            reverse_geocoder = client.ReverseGeocoder()
+        self.reverse_geocoder = reverse_geocoder
+        # runs independent blocking calls in parallel, they are made one after another without it.
+        # Shared with the stale cache refreshes, so it bounds the threads of the whole service
+        self.executor = executor
+        # serves stale forecasts while they are refreshed or while the upstream fails
+        self.stale_cache = stale_cache
+        # geohash precision locations are snapped to, see forecast.geogrid. 0 keeps them as is
+        self.grid_precision = grid_precision
 
+    def snap_to_grid(self, geo_data: client.GeoData) -> client.GeoData:
+        latitude, longitude = geogrid.snap(geo_data.latitude, geo_data.longitude, self.grid_precision)
+        return geo_data._replace(latitude=latitude, longitude=longitude)
+
+    def _geodata_from_coords(self, coords: Coords) -> client.GeoData:
+        return self.snap_to_grid(client.GeoData(latitude=float(coords.lat), longitude=float(coords.lon)))
+
+    @profiling.traced
     def _get_geodata_by_coords_or_city(
         self, city_name: str | None = None, coords: Coords | None = None
     ) -> tuple[client.GeoData, str]:
@@ -70,12 +183,12 @@ class ForecastService:
             raise ForecastServiceError("Either city_name or coords must be provided")
         try:
             if coords is not None:
-                geo_data = client.GeoData(**coords)
-                city_name = geo_data.get_location()[
-                    "city"
-                ]  # WARNING: removed "city_name or", might cause an issue
+                geo_data = self._geodata_from_coords(coords)
+                # the city's timezone, so coordinates share the forecasts of the city's name
+                city_name, timezone = self.reverse_geocoder.get_city(geo_data)
+                geo_data = geo_data._replace(timezone=timezone)
             else:
-                geo_data = self.client.get_geodata_by_city(city_name)
+                geo_data = self.snap_to_grid(self.client.get_geodata_by_city(city_name))
         except client.CoordinatesNotFoundError:
             self.logger.warning("get_forecast_view.CoordinatesNotFound")
             raise
@@ -84,58 +197,226 @@ class ForecastService:
             raise
         return geo_data, city_name
 
-    def _try_get_daily_forecast(self, geo_data: client.GeoData, duration_days: int):
+    def _parallel(self, *calls: t.Callable[[], t.Any]) -> list[t.Any]:
+        """Results of `calls`, made concurrently on the executor.
+
+        The first failure is raised as soon as it happens: calls that haven't started are
+        cancelled and the results of the running ones are dropped. Must not be called from a
+        thread of the executor, which would wait on itself once all its threads are busy.
+        """
+        if self.executor is None or len(calls) < 2:
+            return [call() for call in calls]
+        futures = [self.executor.submit(profiling.bind(call)) for call in calls]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception() is not None:
+                for other in pending:
+                    other.cancel()
+                raise future.exception()
+        return [future.result() for future in futures]
+
+    def _with_location(
+        self,
+        city_name: str | None,
+        coords: Coords | None,
+        *fetches: t.Callable[[client.GeoData], t.Any],
+    ) -> tuple[str, list[t.Any]]:
+        """City name of the location and the results of `fetches`, called with its geodata.
+
+        Forecasts only need coordinates and a timezone. The name of a city missing from the
+        local index comes from Nominatim, which tells no timezone, so the forecasts of such
+        coordinates are fetched in UTC while Nominatim is being asked: the request takes as
+        long as the slower of the two calls instead of both of them.
+        """
+        if coords is not None and self.reverse_geocoder.asks_upstream:
+            geo_data = self._geodata_from_coords(coords)
+            if self.reverse_geocoder.get_local_city(geo_data) is None:
+                city_name, *results = self._parallel(
+                    lambda: self._get_geodata_by_coords_or_city(coords=coords)[1],
+                    *(functools.partial(fetch, geo_data) for fetch in fetches),
+                )
+                return city_name, results
+        geo_data, city_name = self._get_geodata_by_coords_or_city(city_name, coords)
+        return city_name, self._parallel(*(functools.partial(fetch, geo_data) for fetch in fetches))
+
+    def _cached(self, key: str, fetch: t.Callable[..., T]) -> tuple[T, sc.Freshness]:
+        """Calls `fetch` through the stale cache, when there is one.
+
+        The stale cache dates its entries by when they were fetched, so its fetches go around
+        the HTTP and time series caches: a response they kept for up to an hour would be served
+        as fresh as it was just fetched.
+        """
+        if self.stale_cache is None:
+            return fetch(), sc.Freshness()
+        return self.stale_cache.get(key, functools.partial(fetch, force_refresh=True))
+
+    @profiling.traced
+    def _try_get_daily_forecast(
+        self, geo_data: client.GeoData, duration_days: int
+    ) -> tuple[dm.ColumnarForecast, sc.Freshness]:
         try:
-            forecast = self.client.get_daily_forecast(geo_data, forecast_days=duration_days)
+            return self._cached(
+                sc.StaleCache.key("daily", geo_data, duration_days),
+                lambda **kwargs: self.client.get_daily_forecast(
+                    geo_data, forecast_days=duration_days, **kwargs
+                ),
+            )
         except client.ForecastApiError as e:
             self.logger.exception("error getting daily forecast: %s", e)
             raise
-        return forecast
 
-    def _try_get_hourly_forecast_for_date(
-        self, geo_data: client.GeoData, date: datetime
-    ) -> dict[str, dict[str, dm.WeatherDataPerHour] | dm.amount]:
+    def _try_resolve(self, location: str | Coords) -> tuple[client.GeoData, str] | Exception:
+        """Geodata and city name of a batch location, or the error that prevented resolving it."""
         try:
-            forecast = self.client.get_hourly_forecast_for_date(geo_data, date)
+            if isinstance(location, Coords):
+                return self._get_geodata_by_coords_or_city(coords=location)
+            return self._get_geodata_by_coords_or_city(city_name=location)
+        except (client.ForecastApiError, ForecastServiceError, ValueError) as e:
+            return e
+
+    def _batch_items(
+        self,
+        locations: t.Sequence[str | Coords],
+        resolved: list[tuple[int, client.GeoData, str]],
+        forecasts: list[dm.ColumnarForecast | client.ForecastApiError],
+    ) -> t.Iterator[BatchItem]:
+        for (i, _, city_name), forecast in zip(resolved, forecasts):
+            if isinstance(forecast, client.ForecastApiError):
+                self.logger.error("error getting daily forecast for %s: %s", city_name, forecast)
+                yield BatchItem(i, locations[i], city_name, error=forecast)
+            else:
+                yield BatchItem(i, locations[i], city_name, forecast=forecast)
+
+    @profiling.traced
+    def _try_get_hourly_forecast_for_dates(
+        self, geo_data: client.GeoData, start_date: date, end_date: date
+    ) -> tuple[dm.HourlyForecast, sc.Freshness]:
+        try:
+            return self._cached(
+                sc.StaleCache.key("hourly", geo_data, start_date, end_date),
+                lambda **kwargs: self.client.get_hourly_forecast_for_dates(
+                    geo_data, start_date, end_date, **kwargs
+                ),
+            )
         except client.ForecastApiError as e:
-            self.logger.exception("error getting hourly forecast for date %s: %s", date, e)
+            self.logger.exception(
+                "error getting hourly forecast for dates %s - %s: %s", start_date, end_date, e
+            )
             raise
-        return forecast
 
+    @profiling.traced
     def get_daily_forecast(
         self,
         duration_days: int,
         history: HistoryList,
         city_name: str | None = None,
         coords: Coords | None = None,
-    ) -> tuple[dict[str, dm.WeatherDataPerDay], str]:
-        geo_data, city_name = self._get_geodata_by_coords_or_city(city_name, coords)
-        forecast = self._try_get_daily_forecast(geo_data, duration_days)
-        for day in forecast:
-            forecast[day] = asdict(forecast[day])
-        history.push(city_name)
-        self.repo.create_or_incr(city_name)
-        return forecast, city_name
+    ) -> tuple[dm.ColumnarForecast, str, sc.Freshness]:
+        city_name, [(forecast, freshness)] = self._with_location(
+            city_name, coords, lambda geo_data: self._try_get_daily_forecast(geo_data, duration_days)
+        )
+        self.register_search(history, city_name)
+        return forecast, city_name, freshness
+
+    @profiling.traced
+    def get_daily_and_hourly_forecast(
+        self,
+        duration_days: int,
+        hourly_date: date,
+        history: HistoryList,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.ColumnarForecast, dm.HourlyForecast, str, sc.Freshness]:
+        """Daily forecast along with the hourly one of `hourly_date`, both fetched at once."""
+        city_name, [(daily, daily_freshness), (hourly, hourly_freshness)] = self._with_location(
+            city_name,
+            coords,
+            lambda geo_data: self._try_get_daily_forecast(geo_data, duration_days),
+            lambda geo_data: self._try_get_hourly_forecast_for_dates(geo_data, hourly_date, hourly_date),
+        )
+        self.register_search(history, city_name)
+        return daily, hourly, city_name, sc.least_fresh(daily_freshness, hourly_freshness)
+
+    def get_daily_forecasts(
+        self, duration_days: int, locations: t.Sequence[str | Coords]
+    ) -> t.Iterator[BatchItem]:
+        """Daily forecasts for several locations, yielded a batch at a time.
+
+        Locations are geocoded in parallel on the executor. As soon as `BATCH_SIZE` of them are
+        resolved, their forecasts are fetched with one upstream call and yielded while the next
+        ones are still being geocoded. A location that fails doesn't fail the others, it is
+        yielded with its error. Bulk lookups aren't recorded as searches.
+        """
+        map_locations = self.executor.map if self.executor is not None else map
+        resolved = []
+        for i, result in enumerate(map_locations(self._try_resolve, locations)):
+            if isinstance(result, Exception):
+                yield BatchItem(i, locations[i], error=result)
+                continue
+            resolved.append((i, *result))
+            if len(resolved) == self.client.BATCH_SIZE:
+                yield from self._fetch_batch(duration_days, locations, resolved)
+                resolved = []
+        if resolved:
+            yield from self._fetch_batch(duration_days, locations, resolved)
+
+    def _fetch_batch(
+        self,
+        duration_days: int,
+        locations: t.Sequence[str | Coords],
+        resolved: list[tuple[int, client.GeoData, str]],
+    ) -> t.Iterator[BatchItem]:
+        forecasts = self.client.get_daily_forecasts(
+            [geo_data for _, geo_data, _ in resolved], forecast_days=duration_days
+        )
+        return self._batch_items(locations, resolved, forecasts)
+
+    @profiling.traced
+    def register_search(self, history: HistoryList, city_name: str) -> None:
+        """Records a forecast lookup, also when it is answered from a cache.
+
+        The Redis writes of both go out in one pipeline when they share a database.
+        """
+        with core_redis.batched():
+            history.push(city_name)
+            self._incr_city_count(city_name)
+
+    def _incr_city_count(self, city_name: str) -> None:
+        with metrics.timed(metrics.POPULARITY_WRITE_DURATION, type(self.repo).__name__, "incr"):
+            self.repo.create_or_incr(city_name)
 
     def get_hourly_forecast_for_date(
         self,
         date: datetime,
         city_name: str | None = None,
         coords: Coords | None = None,
-    ) -> tuple[dict[str, dm.WeatherDataPerHour], str]:
-        geo_data, city_name = self._get_geodata_by_coords_or_city(city_name, coords)
-        forecast = self._try_get_hourly_forecast_for_date(geo_data, date)
-        forecast["temp_min"] = asdict(forecast["temp_min"])
-        forecast["temp_max"] = asdict(forecast["temp_max"])
-        for hour in forecast["hourly"]:
-            forecast["hourly"][hour] = asdict(forecast["hourly"][hour])
-        # history.push(city_name)
-        # self.repo.create_or_incr(city_name)
-        return forecast, city_name
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]:
+        return self.get_hourly_forecast_for_dates(date.date(), date.date(), city_name, coords)
+
+    @profiling.traced
+    def get_hourly_forecast_for_dates(
+        self,
+        start_date: date,
+        end_date: date,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]:
+        if end_date < start_date:
+            raise ForecastServiceError("end_date must not be before start_date")
+        city_name, [(forecast, freshness)] = self._with_location(
+            city_name,
+            coords,
+            lambda geo_data: self._try_get_hourly_forecast_for_dates(geo_data, start_date, end_date),
+        )
+        return forecast, city_name, freshness
 
     def get_cities_count(self) -> list[dm.CitiesCountDTO]:
         return self.repo.get_all()
 
+    def get_cities_ranking(self, window: str | None = None) -> CitiesRanking:
+        """Most searched cities, of all time or of the last `window` ("hour" or "day")."""
+        return CitiesRanking(self.repo, window)
+
     def get_last_viewed_city(self, history: HistoryList) -> str:
         try:
             res = history[-1]
@@ -143,3 +424,240 @@ class ForecastService:
             self.logger.info("Attempt to get last viewed city, but history is empty")
             raise NotFoundError from e
         return res
+
+
+class AsyncForecastService(ForecastService):
+    """`ForecastService` on top of an `AbstractAsyncApiClient`.
+
+    Upstream calls are awaited on the running event loop; the remaining blocking work
+    (Nominatim reverse lookup, search history, popularity counter) runs in worker threads,
+    the ones of `executor` when it is given.
+    """
+
+    def __init__(
+        self,
+        repo: CitiesCountRepoI,
+        logger: logging.Logger | None,
+        api_client: client.AbstractAsyncApiClient,
+        reverse_geocoder: client.ReverseGeocoder | None = None,
+        stale_cache: sc.StaleCache | None = None,
+        grid_precision: int = 0,
+        executor: Executor | None = None,
+    ) -> None:
+        super().__init__(
+            repo,
+            logger,
+            api_client,
+            reverse_geocoder,
+            executor=executor,
+            stale_cache=stale_cache,
+            grid_precision=grid_precision,
+        )
+
+    def _in_thread(self, fn: t.Callable[..., T]) -> t.Callable[..., t.Awaitable[T]]:
+        return sync_to_async(fn, thread_sensitive=False, executor=self.executor)
+
+    async def _parallel(self, *calls: t.Awaitable[t.Any]) -> list[t.Any]:
+        """Results of `calls`, awaited concurrently.
+
+        The first failure is raised as soon as it happens and the other calls are cancelled,
+        as they are when the caller itself is cancelled.
+        """
+        tasks = [asyncio.ensure_future(call) for call in calls]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task in done and task.exception() is not None:
+                    raise task.exception()
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _with_location(
+        self,
+        city_name: str | None,
+        coords: Coords | None,
+        *fetches: t.Callable[[client.GeoData], t.Awaitable[t.Any]],
+    ) -> tuple[str, list[t.Any]]:
+        if coords is not None and self.reverse_geocoder.asks_upstream:
+            geo_data = self._geodata_from_coords(coords)
+            if self.reverse_geocoder.get_local_city(geo_data) is None:
+
+                async def reverse_geocode() -> str:
+                    return (await self._get_geodata_by_coords_or_city(coords=coords))[1]
+
+                city_name, *results = await self._parallel(
+                    reverse_geocode(), *(fetch(geo_data) for fetch in fetches)
+                )
+                return city_name, results
+        geo_data, city_name = await self._get_geodata_by_coords_or_city(city_name, coords)
+        return city_name, await self._parallel(*(fetch(geo_data) for fetch in fetches))
+
+    @profiling.traced
+    async def _get_geodata_by_coords_or_city(
+        self, city_name: str | None = None, coords: Coords | None = None
+    ) -> tuple[client.GeoData, str]:
+        if not city_name and not coords:
+            raise ForecastServiceError("Either city_name or coords must be provided")
+        try:
+            if coords is not None:
+                geo_data = self._geodata_from_coords(coords)
+                city_name, timezone = await self._in_thread(self.reverse_geocoder.get_city)(geo_data)
+                geo_data = geo_data._replace(timezone=timezone)
+            else:
+                geo_data = self.snap_to_grid(await self.client.get_geodata_by_city(city_name))
+        except client.CoordinatesNotFoundError:
+            self.logger.warning("get_forecast_view.CoordinatesNotFound")
+            raise
+        except client.GettingCoordinatesError as e:
+            self.logger.exception("get_forecast_view.GettingCoordinatesError: %s", e)
+            raise
+        return geo_data, city_name
+
+    async def _cached(
+        self, key: str, fetch: t.Callable[..., t.Awaitable[T]]
+    ) -> tuple[T, sc.Freshness]:
+        if self.stale_cache is None:
+            return await fetch(), sc.Freshness()
+        return await self.stale_cache.aget(key, functools.partial(fetch, force_refresh=True))
+
+    @profiling.traced
+    async def _try_get_daily_forecast(
+        self, geo_data: client.GeoData, duration_days: int
+    ) -> tuple[dm.ColumnarForecast, sc.Freshness]:
+        try:
+            return await self._cached(
+                sc.StaleCache.key("daily", geo_data, duration_days),
+                lambda **kwargs: self.client.get_daily_forecast(
+                    geo_data, forecast_days=duration_days, **kwargs
+                ),
+            )
+        except client.ForecastApiError as e:
+            self.logger.exception("error getting daily forecast: %s", e)
+            raise
+
+    async def _try_resolve(self, location: str | Coords) -> tuple[client.GeoData, str] | Exception:
+        try:
+            if isinstance(location, Coords):
+                return await self._get_geodata_by_coords_or_city(coords=location)
+            return await self._get_geodata_by_coords_or_city(city_name=location)
+        except (client.ForecastApiError, ForecastServiceError, ValueError) as e:
+            return e
+
+    @profiling.traced
+    async def _try_get_hourly_forecast_for_dates(
+        self, geo_data: client.GeoData, start_date: date, end_date: date
+    ) -> tuple[dm.HourlyForecast, sc.Freshness]:
+        try:
+            return await self._cached(
+                sc.StaleCache.key("hourly", geo_data, start_date, end_date),
+                lambda **kwargs: self.client.get_hourly_forecast_for_dates(
+                    geo_data, start_date, end_date, **kwargs
+                ),
+            )
+        except client.ForecastApiError as e:
+            self.logger.exception(
+                "error getting hourly forecast for dates %s - %s: %s", start_date, end_date, e
+            )
+            raise
+
+    @profiling.traced
+    async def get_daily_forecast(
+        self,
+        duration_days: int,
+        history: HistoryList,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.ColumnarForecast, str, sc.Freshness]:
+        city_name, [(forecast, freshness)] = await self._with_location(
+            city_name, coords, lambda geo_data: self._try_get_daily_forecast(geo_data, duration_days)
+        )
+        await self.register_search(history, city_name)
+        return forecast, city_name, freshness
+
+    @profiling.traced
+    async def get_daily_and_hourly_forecast(
+        self,
+        duration_days: int,
+        hourly_date: date,
+        history: HistoryList,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.ColumnarForecast, dm.HourlyForecast, str, sc.Freshness]:
+        city_name, [(daily, daily_freshness), (hourly, hourly_freshness)] = await self._with_location(
+            city_name,
+            coords,
+            lambda geo_data: self._try_get_daily_forecast(geo_data, duration_days),
+            lambda geo_data: self._try_get_hourly_forecast_for_dates(geo_data, hourly_date, hourly_date),
+        )
+        await self.register_search(history, city_name)
+        return daily, hourly, city_name, sc.least_fresh(daily_freshness, hourly_freshness)
+
+    async def get_daily_forecasts(
+        self, duration_days: int, locations: t.Sequence[str | Coords]
+    ) -> t.AsyncIterator[BatchItem]:
+        async def resolve(i: int, location: str | Coords):
+            return i, await self._try_resolve(location)
+
+        tasks = [asyncio.ensure_future(resolve(i, location)) for i, location in enumerate(locations)]
+        resolved = []
+        try:
+            # geocoded in the order they complete, each batch is fetched once it is full
+            for next_done in asyncio.as_completed(tasks):
+                i, result = await next_done
+                if isinstance(result, Exception):
+                    yield BatchItem(i, locations[i], error=result)
+                    continue
+                resolved.append((i, *result))
+                if len(resolved) == self.client.BATCH_SIZE:
+                    for item in await self._fetch_batch(duration_days, locations, resolved):
+                        yield item
+                    resolved = []
+            if resolved:
+                for item in await self._fetch_batch(duration_days, locations, resolved):
+                    yield item
+        finally:
+            # only still running when the response was closed before its end
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_batch(
+        self,
+        duration_days: int,
+        locations: t.Sequence[str | Coords],
+        resolved: list[tuple[int, client.GeoData, str]],
+    ) -> t.Iterator[BatchItem]:
+        forecasts = await self.client.get_daily_forecasts(
+            [geo_data for _, geo_data, _ in resolved], forecast_days=duration_days
+        )
+        return self._batch_items(locations, resolved, forecasts)
+
+    @profiling.traced
+    async def register_search(self, history: HistoryList, city_name: str) -> None:
+        await self._in_thread(super().register_search)(history, city_name)
+
+    async def get_hourly_forecast_for_date(
+        self,
+        date: datetime,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]:
+        return await self.get_hourly_forecast_for_dates(date.date(), date.date(), city_name, coords)
+
+    @profiling.traced
+    async def get_hourly_forecast_for_dates(
+        self,
+        start_date: date,
+        end_date: date,
+        city_name: str | None = None,
+        coords: Coords | None = None,
+    ) -> tuple[dm.HourlyForecast, str, sc.Freshness]:
+        if end_date < start_date:
+            raise ForecastServiceError("end_date must not be before start_date")
+        city_name, [(forecast, freshness)] = await self._with_location(
+            city_name,
+            coords,
+            lambda geo_data: self._try_get_hourly_forecast_for_dates(geo_data, start_date, end_date),
+        )
+        return forecast, city_name, freshness
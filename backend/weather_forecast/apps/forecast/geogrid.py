@@ -0,0 +1,62 @@
+"""Snapping coordinates to geohash cells.
+
+Open-Meteo interpolates its forecasts from model grids several kilometers wide, so points
+a few hundred meters apart get practically the same forecast. Coordinates are replaced by
+the center of their geohash cell before they are geocoded or used in cache keys and
+upstream requests, and every request falling in a cell shares one cached forecast.
+
+Cell size by precision, at the equator: 4 ~ 39 x 19.5 km, 5 ~ 4.9 x 4.9 km,
+6 ~ 1.2 x 0.6 km, 7 ~ 153 x 153 m.
+"""
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# decimals of snapped coordinates, keeps the upstream parameters and cache keys short
+SNAP_DECIMALS = 5
+
+
+def encode(latitude: float, longitude: float, precision: int) -> str:
+    """Geohash of the cell containing the point."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits << 1 | 1
+            bounds[0] = mid
+        else:
+            bits <<= 1
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def bounds(geohash: str) -> tuple[float, float, float, float]:
+    """(south, north, west, east) edges of the cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if even else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if bits >> shift & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def snap(latitude: float, longitude: float, precision: int) -> tuple[float, float]:
+    """Center of the cell containing the point, the point itself when `precision` is 0."""
+    if precision <= 0:
+        return latitude, longitude
+    south, north, west, east = bounds(encode(latitude, longitude, precision))
+    return round((south + north) / 2, SNAP_DECIMALS), round((west + east) / 2, SNAP_DECIMALS)
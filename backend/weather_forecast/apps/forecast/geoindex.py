@@ -0,0 +1,333 @@
+"""Local, memory-mapped index of cities for geocoding without a network round trip.
+
+The index is built once from a GeoNames dump (``cities15000.txt`` or similar, see
+https://download.geonames.org/export/dump/) by ``manage.py build_geoindex`` and opened
+read-only with mmap, so forked workers share its pages.
+
+File layout, little-endian::
+
+    header    magic, version, timezone count, record count, city count
+    records   fixed size, sorted by (normalized key, -population)
+    timezones (offset, length) into the string blob
+    cells     start of every 1x1 degree grid cell in the city list, plus an end marker
+    cities    one record number per city, ordered by grid cell
+    strings   utf-8 blob with keys, city names and timezone names
+
+Every name of a city (its name, ascii name and optionally alternate names) gets its own
+record, so lookups are a binary search over the keys. Reverse lookups only scan the grid
+cells around the requested point.
+"""
+
+import contextlib
+import dataclasses
+import io
+import math
+import mmap
+import os
+import struct
+import typing as t
+import unicodedata
+import zipfile
+from pathlib import Path
+
+MAGIC = b"WFGI"
+VERSION = 2
+
+_HEADER = struct.Struct("<4sHHII")
+# key offset, key length, name offset, name length, country code, timezone index, lat, lon, population
+_RECORD = struct.Struct("<IHIH2sHffI")
+_TIMEZONE = struct.Struct("<IH")
+_U32 = struct.Struct("<I")
+
+GRID_ROWS, GRID_COLS = 180, 360
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# how many prefix matches are ranked before the most populous ones are returned
+PREFIX_SCAN_LIMIT = 5000
+
+
+class GeoIndexError(Exception): ...
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class City:
+    name: str
+    country_code: str
+    latitude: float
+    longitude: float
+    timezone: str
+    population: int
+
+
+class GeoNamesRow(t.NamedTuple):
+    name: str
+    ascii_name: str
+    alternate_names: list[str]
+    latitude: float
+    longitude: float
+    country_code: str
+    population: int
+    timezone: str
+
+
+def grid_cell(latitude: float, longitude: float) -> tuple[int, int]:
+    row = min(max(math.floor(latitude) + 90, 0), GRID_ROWS - 1)
+    col = (math.floor(longitude) + 180) % GRID_COLS
+    return row, col
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def normalize(name: str) -> str:
+    """Case, accent and separator insensitive form of a place name."""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().replace("-", " ").split())
+
+
+class CityIndex:
+    def __init__(self, path: str | os.PathLike) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, tz_count, count, city_count = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self._buf.close()
+            raise GeoIndexError(f"{self.path} is not a city index (version {VERSION})")
+        self._count = count
+        self._records_offset = _HEADER.size
+        tz_offset = self._records_offset + count * _RECORD.size
+        self._cells_offset = tz_offset + tz_count * _TIMEZONE.size
+        self._cities_offset = self._cells_offset + (GRID_ROWS * GRID_COLS + 1) * _U32.size
+        self._strings_offset = self._cities_offset + city_count * _U32.size
+        self._timezones = [
+            self._string(*_TIMEZONE.unpack_from(self._buf, tz_offset + i * _TIMEZONE.size))
+            for i in range(tz_count)
+        ]
+
+    @classmethod
+    def open(cls, path: str | os.PathLike) -> "CityIndex | None":
+        """The index at `path`, or None when it hasn't been built."""
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        self._buf.close()
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._buf[start : start + length].decode()
+
+    def _record(self, i: int) -> tuple:
+        return _RECORD.unpack_from(self._buf, self._records_offset + i * _RECORD.size)
+
+    def _key(self, i: int) -> bytes:
+        key_offset, key_len = _RECORD.unpack_from(self._buf, self._records_offset + i * _RECORD.size)[:2]
+        start = self._strings_offset + key_offset
+        return self._buf[start : start + key_len]
+
+    def _city(self, i: int) -> City:
+        _, _, name_offset, name_len, country, tz, lat, lon, population = self._record(i)
+        return City(
+            name=self._string(name_offset, name_len),
+            country_code=country.decode(),
+            latitude=round(lat, 5),
+            longitude=round(lon, 5),
+            timezone=self._timezones[tz],
+            population=population,
+        )
+
+    def _cell_records(self, row: int, col: int) -> t.Iterator[int]:
+        cell = row * GRID_COLS + col
+        start, end = struct.unpack_from("<II", self._buf, self._cells_offset + cell * _U32.size)
+        for i in range(start, end):
+            yield _U32.unpack_from(self._buf, self._cities_offset + i * _U32.size)[0]
+
+    def _bisect_left(self, key: bytes) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, query: str) -> City | None:
+        """The most populous city with exactly this (normalized) name."""
+        key = normalize(query).encode()
+        if not key:
+            return None
+        i = self._bisect_left(key)
+        if i < self._count and self._key(i) == key:
+            return self._city(i)
+        return None
+
+    def search_prefix(self, prefix: str, limit: int = 10) -> list[City]:
+        """Most populous cities with a name starting with `prefix`."""
+        key = normalize(prefix).encode()
+        if not key:
+            return []
+        matches = []
+        i = self._bisect_left(key)
+        end = min(self._count, i + PREFIX_SCAN_LIMIT)
+        while i < end and self._key(i).startswith(key):
+            matches.append(i)
+            i += 1
+        matches.sort(key=lambda i: self._record(i)[-1], reverse=True)
+        result, seen = [], set()
+        for i in matches:
+            city = self._city(i)
+            # alternate names point at the same city several times
+            identity = (city.name, city.country_code, city.latitude, city.longitude)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            result.append(city)
+            if len(result) == limit:
+                break
+        return result
+
+    def nearest(self, latitude: float, longitude: float, max_distance_km: float = 30.0) -> City | None:
+        """Closest city within `max_distance_km` of the point."""
+        row, col = grid_cell(latitude, longitude)
+        # a degree of longitude shrinks towards the poles, widen the searched ring accordingly
+        cos_lat = max(math.cos(math.radians(min(abs(latitude) + 1, 90))), 0.01)
+        lat_rings = math.ceil(max_distance_km / KM_PER_DEGREE)
+        lon_rings = min(math.ceil(max_distance_km / (KM_PER_DEGREE * cos_lat)), GRID_COLS // 2)
+        best, best_distance = None, max_distance_km
+        for r in range(max(row - lat_rings, 0), min(row + lat_rings, GRID_ROWS - 1) + 1):
+            for c in {(col + d) % GRID_COLS for d in range(-lon_rings, lon_rings + 1)}:
+                for i in self._cell_records(r, c):
+                    lat, lon = self._record(i)[6:8]
+                    distance = haversine_km(latitude, longitude, lat, lon)
+                    if distance <= best_distance:
+                        best, best_distance = i, distance
+        return self._city(best) if best is not None else None
+
+
+def read_geonames(path: str | os.PathLike) -> t.Iterator[GeoNamesRow]:
+    """Rows of a GeoNames ``geoname`` table dump, plain or zipped."""
+    path = Path(path)
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            member = next(name for name in archive.namelist() if name.endswith(".txt"))
+            with archive.open(member) as f:
+                yield from _parse_geonames(io.TextIOWrapper(f, encoding="utf-8"))
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield from _parse_geonames(f)
+
+
+def _parse_geonames(lines: t.Iterable[str]) -> t.Iterator[GeoNamesRow]:
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 18:
+            continue
+        yield GeoNamesRow(
+            name=fields[1],
+            ascii_name=fields[2],
+            alternate_names=[name for name in fields[3].split(",") if name],
+            latitude=float(fields[4]),
+            longitude=float(fields[5]),
+            country_code=fields[8],
+            population=int(fields[14] or 0),
+            timezone=fields[17],
+        )
+
+
+def build_index(
+    rows: t.Iterable[GeoNamesRow],
+    path: str | os.PathLike,
+    alternate_names: bool = True,
+    min_population: int = 0,
+) -> int:
+    """Writes the index for `rows` to `path` and returns the number of records.
+
+    The index is written next to `path` and moved onto it once complete, so processes that
+    have the previous index mapped keep reading it unchanged.
+    """
+    strings = bytearray()
+    string_offsets: dict[str, tuple[int, int]] = {}
+
+    def intern(value: str) -> tuple[int, int]:
+        if value not in string_offsets:
+            encoded = value.encode()
+            string_offsets[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    timezones: dict[str, int] = {}
+    records = []
+    for row in rows:
+        if row.population < min_population:
+            continue
+        names = {row.name, row.ascii_name}
+        if alternate_names:
+            names.update(row.alternate_names)
+        keys = {normalize(name) for name in names} - {""}
+        tz = timezones.setdefault(row.timezone, len(timezones))
+        country = row.country_code.encode()[:2].ljust(2)
+        for key in keys:
+            records.append((key.encode(), row, tz, country))
+
+    records.sort(key=lambda record: (record[0], -record[1].population))
+    # the first record of every city represents it in the spatial grid
+    city_records: dict[int, int] = {}
+    for i, (_, row, _, _) in enumerate(records):
+        city_records.setdefault(id(row), i)
+    cities = sorted(
+        (grid_cell(records[i][1].latitude, records[i][1].longitude), i) for i in city_records.values()
+    )
+    cell_starts = [0] * (GRID_ROWS * GRID_COLS + 1)
+    for (row, col), _ in cities:
+        cell_starts[row * GRID_COLS + col + 1] += 1
+    for cell in range(1, len(cell_starts)):
+        cell_starts[cell] += cell_starts[cell - 1]
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "xb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(timezones), len(records), len(cities)))
+            for key, row, tz, country in records:
+                key_offset, key_len = intern(key.decode())
+                name_offset, name_len = intern(row.name)
+                f.write(
+                    _RECORD.pack(
+                        key_offset,
+                        key_len,
+                        name_offset,
+                        name_len,
+                        country,
+                        tz,
+                        row.latitude,
+                        row.longitude,
+                        min(row.population, 2**32 - 1),
+                    )
+                )
+            for timezone in sorted(timezones, key=timezones.get):
+                f.write(_TIMEZONE.pack(*intern(timezone)))
+            f.write(struct.pack(f"<{len(cell_starts)}I", *cell_starts))
+            f.write(struct.pack(f"<{len(cities)}I", *(i for _, i in cities)))
+            f.write(strings)
+            f.flush()
+            os.fsync(f.fileno())
+        # workers map the index: it is replaced, never truncated under them
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    return len(records)
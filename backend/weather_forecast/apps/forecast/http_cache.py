@@ -0,0 +1,93 @@
+"""Cache backends for the upstream HTTP responses of the forecast API clients.
+
+The sync client caches through requests_cache, so any of its backends can be plugged in.
+The async client can't use requests_cache and stores raw response bodies in an
+`AsyncResponseCache` instead.
+"""
+
+import hashlib
+import json
+import logging
+import time
+import typing as t
+
+import redis
+import redis.asyncio
+from core import redis as core_redis
+
+if t.TYPE_CHECKING:
+    import requests_cache
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("redis", "sqlite", "memory")
+
+
+class AsyncResponseCache(t.Protocol):
+    async def get(self, key: str) -> bytes | None: ...
+
+    async def set(self, key: str, value: bytes, expire_after: int) -> None: ...
+
+
+def make_key(url: str, params: dict) -> str:
+    encoded = json.dumps([url, sorted(params.items())], sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class AsyncRedisResponseCache:
+    def __init__(self, connection: redis.asyncio.Redis, namespace: str = "forecast_http_async") -> None:
+        self.db = connection
+        self.namespace = namespace
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await self.db.get(f"{self.namespace}:{key}")
+        except redis.RedisError as e:
+            logger.warning("response cache get failed: %s", e)
+            return None
+
+    async def set(self, key: str, value: bytes, expire_after: int) -> None:
+        try:
+            await self.db.set(f"{self.namespace}:{key}", value, ex=expire_after)
+        except redis.RedisError as e:
+            logger.warning("response cache set failed: %s", e)
+
+
+class AsyncMemoryResponseCache:
+    """Process local cache, for development and tests."""
+
+    def __init__(self) -> None:
+        self._data: dict[str, tuple[float, bytes]] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        expires_at, value = self._data.get(key, (0.0, None))
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, expire_after: int) -> None:
+        self._data[key] = (time.monotonic() + expire_after, value)
+
+
+def get_sync_backend(name: str, redis_db: int) -> "str | requests_cache.BaseCache":
+    """requests_cache backend for one of the `BACKENDS` names."""
+    if name == "redis":
+        import requests_cache
+
+        # requests_cache stores pickled responses, so the connection must not decode them
+        return requests_cache.RedisCache(
+            namespace="forecast_http", connection=core_redis.get_connection(redis_db)
+        )
+    if name in BACKENDS:
+        return name
+    raise ValueError(f"Unknown forecast api cache backend {name!r}, expected one of {BACKENDS}")
+
+
+def get_async_backend(name: str, redis_db: int) -> AsyncResponseCache:
+    if name == "redis":
+        return AsyncRedisResponseCache(core_redis.get_async_connection(redis_db))
+    if name in BACKENDS:
+        # there is no shared async sqlite store, fall back to a per-process cache
+        return AsyncMemoryResponseCache()
+    raise ValueError(f"Unknown forecast api cache backend {name!r}, expected one of {BACKENDS}")
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from forecast import geoindex
+
+
+class Command(BaseCommand):
+    help = "Builds the local city index used for geocoding from a GeoNames dump (.txt or .zip)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="GeoNames dump, e.g. cities15000.zip")
+        parser.add_argument("--output", default=str(settings.FORECAST_CITY_INDEX_PATH))
+        parser.add_argument("--min-population", type=int, default=0)
+        parser.add_argument(
+            "--no-alternate-names",
+            action="store_true",
+            help="index only the primary and ascii names, which makes the index much smaller",
+        )
+
+    def handle(self, *args, **options):
+        Path(options["output"]).parent.mkdir(parents=True, exist_ok=True)
+        count = geoindex.build_index(
+            geoindex.read_geonames(options["source"]),
+            options["output"],
+            alternate_names=not options["no_alternate_names"],
+            min_population=options["min_population"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} names into {options['output']}"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from forecast import repositories as repos
+
+
+class Command(BaseCommand):
+    help = "Moves the city counters of the old redis hash into the popularity ranking sorted set"
+
+    def handle(self, *args, **options):
+        repo = repos.CitiesCountRepositoryRedis()
+        counts = {name: int(count) for name, count in repo.db.hgetall(repos.CITIES_COUNT_KEY).items()}
+        if not counts:
+            self.stdout.write("Nothing to import")
+            return
+        # straight into the totals: old searches don't belong to any of the current time windows
+        pipe = repo.db.pipeline()
+        for name, count in counts.items():
+            pipe.zincrby(repos.CITIES_RANK_KEY, count, name)
+        pipe.delete(repos.CITIES_COUNT_KEY)
+        pipe.execute()
+        self.stdout.write(self.style.SUCCESS(f"Imported the counters of {len(counts)} cities"))
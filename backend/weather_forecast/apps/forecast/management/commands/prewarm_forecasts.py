@@ -0,0 +1,55 @@
+import dataclasses
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from forecast import dependecies as deps
+from forecast import prewarm
+
+
+class Command(BaseCommand):
+    help = "Keeps the cached forecasts of the most searched cities fresh, see forecast.prewarm"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=settings.FORECAST_PREWARM_TOP_CITIES)
+        parser.add_argument("--concurrency", type=int, default=settings.FORECAST_PREWARM_CONCURRENCY)
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=settings.FORECAST_PREWARM_JITTER,
+            help="each city is refreshed after a random delay of up to this many seconds",
+        )
+        parser.add_argument(
+            "--lead",
+            type=float,
+            default=settings.FORECAST_PREWARM_LEAD,
+            help="seconds before the cached responses expire a pass has to be done by",
+        )
+        parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+
+    def handle(self, *args, **options):
+        if settings.FORECAST_API_CACHE_BACKEND != "redis":
+            self.stderr.write(
+                self.style.WARNING(
+                    f"The {settings.FORECAST_API_CACHE_BACKEND} HTTP cache isn't shared with the workers, "
+                    "only the payload cache is warmed"
+                )
+            )
+        prewarmer = prewarm.Prewarmer(
+            deps.get_forecast_service(),
+            deps.container.payload_cache,
+            concurrency=options["concurrency"],
+            jitter=options["jitter"],
+        )
+        if options["once"]:
+            stats = prewarmer.run_once(options["top"])
+            self.stdout.write(self.style.SUCCESS(f"Prewarmed forecasts: {dataclasses.asdict(stats)}"))
+            return
+        signal.signal(signal.SIGTERM, lambda *_: prewarmer.stop.set())
+        try:
+            prewarmer.run_forever(
+                options["top"], settings.FORECAST_API_CACHE_EXPIRE_AFTER["forecast"], options["lead"]
+            )
+        except KeyboardInterrupt:
+            prewarmer.stop.set()
@@ -0,0 +1,82 @@
+"""Prometheus metrics of the forecast app, exposed on /metrics to admins and scrape jobs
+sending FORECAST_METRICS_TOKEN.
+
+Under gunicorn every worker is its own process. When PROMETHEUS_MULTIPROC_DIR is set (see
+entrypoint.sh and config/gunicorn.py) prometheus_client writes the values of each process
+to files in that directory, and /metrics sums up the files of all workers, including the
+ones that have exited. The variable has to be set before prometheus_client is imported.
+"""
+
+import contextlib
+import os
+import time
+import typing as t
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+HIT, MISS, STALE = "hit", "miss", "stale"
+# outcomes of upstream calls that got no status code, or whose status isn't known
+TIMEOUT, CONNECTION_ERROR, CLIENT_ERROR = "timeout", "connection_error", "client_error"
+
+REQUEST_DURATION = Histogram(
+    "forecast_http_request_duration_seconds",
+    "Time to produce a response, by url name",
+    ["endpoint", "method", "status"],
+)
+UPSTREAM_DURATION = Histogram(
+    "forecast_upstream_request_duration_seconds",
+    "Duration of single upstream HTTP calls, retries are observed separately",
+    ["host", "status"],
+)
+UPSTREAM_RETRIES = Counter(
+    "forecast_upstream_retries_total", "Upstream calls repeated after a failed attempt", ["host"]
+)
+BREAKER_TRIPS = Counter(
+    "forecast_circuit_breaker_trips_total", "Times the circuit of an upstream opened", ["host"]
+)
+BREAKER_REJECTED = Counter(
+    "forecast_circuit_breaker_rejected_total", "Calls rejected while the circuit was open", ["host"]
+)
+CACHE_REQUESTS = Counter(
+    "forecast_cache_requests_total", "Lookups in every cache layer, by result", ["layer", "result"]
+)
+POPULARITY_WRITE_DURATION = Histogram(
+    "forecast_popularity_write_duration_seconds",
+    "Time to record a search in the popularity counters, or to flush buffered ones",
+    ["repository", "operation"],
+)
+
+
+def cache_lookup(layer: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(layer, HIT if hit else MISS).inc()
+
+
+@contextlib.contextmanager
+def timed(histogram: Histogram, *labels: str) -> t.Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def registry() -> CollectorRegistry:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    # a fresh registry per scrape, the collector reads the files of all processes
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render() -> tuple[bytes, str]:
+    """Body and content type of a scrape."""
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,179 @@
+import contextlib
+import cProfile
+import hmac
+import logging
+import random
+import threading
+import time
+import typing as t
+import uuid
+
+import orjson
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from forecast import metrics, profiling, search_history
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHistoryMiddleware(MiddlewareMixin):
+    """Sets the search history cookie of visitors whose history changed during the request."""
+
+    def process_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        visitor_id = getattr(request, search_history.REQUEST_ATTR, None)
+        if visitor_id is not None:
+            response.set_cookie(
+                settings.FORECAST_HISTORY_COOKIE_NAME,
+                visitor_id,
+                max_age=settings.FORECAST_HISTORY_TTL,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """Observes the time to produce each response, labeled with the name of the matched url.
+
+    Runs natively in both the sync and the async handler, so it adds no thread switch to
+    the async views. Requests that match no url share one label, keeping the number of
+    series bounded. Streaming responses are timed until the response object is returned.
+    """
+
+    sync_capable = True
+    async_capable = True
+    UNMATCHED = "unmatched"
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    def _observe(self, request: HttpRequest, response: HttpResponse, start: float) -> None:
+        match = request.resolver_match
+        endpoint = match.view_name if match is not None else self.UNMATCHED
+        metrics.REQUEST_DURATION.labels(endpoint, request.method, str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+
+
+class ProfilingMiddleware:
+    """Traces a sample of the requests and profiles the ones asking for it.
+
+    A sampled request is traced as a tree of spans over the service, the api client and the
+    repositories (see `forecast.profiling`), and its tree is logged as one JSON line when it
+    took FORECAST_PROFILING_SLOW_THRESHOLD seconds or more. A request whose PROFILE_HEADER
+    matches FORECAST_PROFILING_TOKEN is traced as well and run under cProfile, the stats are
+    written to FORECAST_PROFILING_DIR (for pstats, or snakeviz and flameprof to see a flame
+    graph) and their file name returned in DUMP_HEADER.
+
+    cProfile only sees the thread it runs in, which under asyncio includes the other requests
+    awaited meanwhile, and doesn't nest: one request is profiled at a time per process, the
+    others asking for it are only traced. Removed from the stack when neither is enabled.
+    """
+
+    sync_capable = True
+    async_capable = True
+    PROFILE_HEADER = "X-Forecast-Profile"
+    DUMP_HEADER = "X-Forecast-Profile-Dump"
+
+    def __init__(self, get_response) -> None:
+        self.sample_rate = settings.FORECAST_PROFILING_SAMPLE_RATE
+        self.token = settings.FORECAST_PROFILING_TOKEN
+        if self.sample_rate <= 0 and not self.token:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_threshold = settings.FORECAST_PROFILING_SLOW_THRESHOLD
+        self.profile_dir = settings.FORECAST_PROFILING_DIR
+        self._profiler_lock = threading.Lock()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = self._asks_profile(request)
+        if not profile and random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with self._profiler(profile) as profiler, profiling.collect(request.path) as root:
+            response = self.get_response(request)
+        self._report(request, response, root, profiler)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        profile = self._asks_profile(request)
+        if not profile and random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        with self._profiler(profile) as profiler, profiling.collect(request.path) as root:
+            response = await self.get_response(request)
+        self._report(request, response, root, profiler)
+        return response
+
+    def _asks_profile(self, request: HttpRequest) -> bool:
+        given = request.headers.get(self.PROFILE_HEADER)
+        return bool(self.token) and given is not None and hmac.compare_digest(given, self.token)
+
+    @contextlib.contextmanager
+    def _profiler(self, profile: bool) -> t.Iterator[cProfile.Profile | None]:
+        if not profile or not self._profiler_lock.acquire(blocking=False):
+            yield None
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield profiler
+            finally:
+                profiler.disable()
+        finally:
+            self._profiler_lock.release()
+
+    def _report(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        root: profiling.Span,
+        profiler: cProfile.Profile | None,
+    ) -> None:
+        match = request.resolver_match
+        root.name = match.view_name if match is not None else MetricsMiddleware.UNMATCHED
+        dump = None
+        if profiler is not None:
+            dump = self._dump(profiler, root.name)
+            response[self.DUMP_HEADER] = dump
+        if root.duration < self.slow_threshold:
+            return
+        trace = {
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "duration_ms": round(root.duration * 1000, 3),
+            "profile": dump,
+            "spans": root.as_dict(),
+        }
+        logger.warning("slow request: %s", orjson.dumps(trace).decode())
+
+    def _dump(self, profiler: cProfile.Profile, view_name: str) -> str:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{view_name.replace(':', '.')}-{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(self.profile_dir / name)
+        return name
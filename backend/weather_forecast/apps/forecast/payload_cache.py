@@ -0,0 +1,162 @@
+"""Cache of fully rendered forecast responses.
+
+Repeated requests for the same forecast are answered with the bytes rendered the first
+time, skipping the upstream client, parsing and encoding. Open-Meteo refreshes its models
+on a fixed cadence, so an entry lives until the next update instead of for a fixed time:
+everything rendered within one update interval expires together. An entry also keeps the
+time its forecast was fetched and never outlives the `fresh_for` window of the stale cache,
+so it is always served as a fresh forecast of its actual age. Every entry carries an ETag,
+so clients revalidating with If-None-Match get a 304 without a body.
+"""
+
+import hashlib
+import logging
+import time
+import typing as t
+
+from django.core.cache import BaseCache, caches
+
+from forecast import geogrid, geoindex, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "forecast_payload"
+# decimals coordinates are rounded to in cache keys, about 10 meters
+COORDS_PRECISION = 4
+
+
+class CachedPayload(t.NamedTuple):
+    body: bytes
+    etag: str
+    city: str
+    expires_at: float
+    # when the rendered forecast was fetched from the upstream
+    fetched_at: float
+
+    @property
+    def max_age(self) -> int:
+        return max(int(self.expires_at - time.time()), 0)
+
+    @property
+    def age(self) -> int:
+        return max(int(time.time() - self.fetched_at), 0)
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, a proxy may have marked the tag as weak
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class PayloadCache:
+    def __init__(
+        self,
+        alias: str = "default",
+        update_interval: int = 3600,
+        update_offset: int = 0,
+        grid_precision: int = 0,
+        fresh_for: int | None = None,
+    ) -> None:
+        self.alias = alias
+        self.update_interval = update_interval
+        self.update_offset = update_offset
+        # seconds a forecast is served as fresh, entries expire with their forecast's freshness
+        self.fresh_for = fresh_for
+        # coordinates in one geohash cell of this precision share an entry, see forecast.geogrid
+        self.grid_precision = grid_precision
+
+    @property
+    def cache(self) -> BaseCache:
+        # django hands out a cache connection per thread and per async task
+        return caches[self.alias]
+
+    def ttl(self, now: float | None = None) -> int:
+        """Seconds until the next upstream model update."""
+        if now is None:
+            now = time.time()
+        return self.update_interval - int(now - self.update_offset) % self.update_interval
+
+    def key(
+        self, endpoint: str, location: str | None, coords: t.Any = None, **params: t.Any
+    ) -> str | None:
+        """Cache key of a request, None when it can't be cached."""
+        if coords is not None:
+            try:
+                latitude, longitude = float(coords.lat), float(coords.lon)
+            except ValueError:
+                return None
+            if self.grid_precision > 0:
+                place = "cell:" + geogrid.encode(latitude, longitude, self.grid_precision)
+            else:
+                place = "coords:%.*f,%.*f" % (COORDS_PRECISION, latitude, COORDS_PRECISION, longitude)
+        elif location:
+            place = "city:" + geoindex.normalize(location)
+        else:
+            return None
+        args = ":".join(f"{name}={value}" for name, value in sorted(params.items()))
+        digest = hashlib.sha256(f"{place}:{args}".encode()).hexdigest()
+        return f"{KEY_PREFIX}:{endpoint}:{digest}"
+
+    def _entry(self, body: bytes, city: str, age: int) -> CachedPayload:
+        now = time.time()
+        fetched_at = now - age
+        expires_at = now + self.ttl(now)
+        if self.fresh_for is not None:
+            expires_at = min(expires_at, fetched_at + self.fresh_for)
+        return CachedPayload(body, make_etag(body), city, expires_at, fetched_at)
+
+    @staticmethod
+    def _load(entry: tuple | None) -> CachedPayload | None:
+        try:
+            return CachedPayload(*entry) if entry is not None else None
+        except TypeError:
+            # written by a version with other fields
+            return None
+
+    @profiling.traced
+    def get(self, key: str) -> CachedPayload | None:
+        try:
+            entry = self.cache.get(key)
+        except Exception as e:
+            logger.warning("failed to read cached payload %s: %s", key, e)
+            entry = None
+        payload = self._load(entry)
+        metrics.cache_lookup("payload", payload is not None)
+        return payload
+
+    @profiling.traced
+    def set(self, key: str, body: bytes, city: str, age: int = 0) -> CachedPayload:
+        """Caches the response rendered from a fresh forecast fetched `age` seconds ago."""
+        entry = self._entry(body, city, age)
+        try:
+            self.cache.set(key, tuple(entry), entry.max_age or 1)
+        except Exception as e:
+            logger.warning("failed to cache payload %s: %s", key, e)
+        return entry
+
+    @profiling.traced
+    async def aget(self, key: str) -> CachedPayload | None:
+        try:
+            entry = await self.cache.aget(key)
+        except Exception as e:
+            logger.warning("failed to read cached payload %s: %s", key, e)
+            entry = None
+        payload = self._load(entry)
+        metrics.cache_lookup("payload", payload is not None)
+        return payload
+
+    @profiling.traced
+    async def aset(self, key: str, body: bytes, city: str, age: int = 0) -> CachedPayload:
+        entry = self._entry(body, city, age)
+        try:
+            await self.cache.aset(key, tuple(entry), entry.max_age or 1)
+        except Exception as e:
+            logger.warning("failed to cache payload %s: %s", key, e)
+        return entry
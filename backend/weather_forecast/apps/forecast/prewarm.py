@@ -0,0 +1,103 @@
+"""Refreshing the forecasts of the most searched cities before their cache entries expire.
+
+Every pass reads the top cities from the popularity repository and fetches their hourly
+time series and daily forecast again, overwriting the shared HTTP cache, and stores the
+daily forecast in the stale cache and its rendered default response in the payload cache.
+Passes are scheduled `lead` seconds before what the previous one cached stops being fresh:
+when the HTTP cache entries expire or, sooner with the defaults, when the stale cache starts
+serving them as stale. A hot city is then always answered fresh, and the workers never have
+to refresh it in the background themselves.
+
+Cities are refreshed by a bounded number of threads and each one starts after a random
+delay of up to `jitter` seconds, which spreads the upstream requests of a pass instead of
+sending them in one burst.
+"""
+
+import dataclasses
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from forecast import api_client, encoding
+from forecast import payload_cache as pc
+from forecast import stale_cache as sc
+from forecast.domain import service as sv
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PrewarmStats:
+    cities: int = 0
+    refreshed: int = 0
+    failed: int = 0
+    elapsed_s: float = 0.0
+
+
+class Prewarmer:
+    def __init__(
+        self,
+        forecast_service: sv.ForecastService,
+        payload_cache: pc.PayloadCache | None = None,
+        concurrency: int = 4,
+        jitter: float = 30.0,
+        duration_days: int = 7,
+        stop: threading.Event | None = None,
+    ) -> None:
+        self.service = forecast_service
+        self.client: api_client.OpenMeteoApiClient = forecast_service.client
+        self.payload_cache = payload_cache
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.duration_days = duration_days
+        self.stop = stop or threading.Event()
+
+    def top_cities(self, count: int) -> list[str]:
+        return [city.name for city in self.service.get_cities_ranking()[:count]]
+
+    def warm(self, city_name: str) -> bool:
+        """Refreshes the cached forecasts of one city, False when it failed."""
+        if self.stop.wait(random.uniform(0, self.jitter)):
+            return False
+        try:
+            geo_data = self.service.snap_to_grid(self.client.get_geodata_by_city(city_name))
+            forecast = self.client.refresh_forecasts(geo_data, forecast_days=self.duration_days)
+        except api_client.ForecastApiError as e:
+            logger.warning("failed to prewarm the forecasts of %s: %s", city_name, e)
+            return False
+        if self.service.stale_cache is not None:
+            key = sc.StaleCache.key("daily", geo_data, self.duration_days)
+            self.service.stale_cache.put(key, forecast)
+        if self.payload_cache is not None:
+            # the same key and body daily_forecast_view uses for a request with default params
+            key = self.payload_cache.key("daily", city_name, duration_days=self.duration_days)
+            body = encoding.dumps({"forecast": forecast, "location": city_name})
+            self.payload_cache.set(key, body, city_name)
+        return True
+
+    def run_once(self, count: int) -> PrewarmStats:
+        started = time.perf_counter()
+        cities = self.top_cities(count)
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="prewarm") as executor:
+            results = list(executor.map(self.warm, cities))
+        refreshed = sum(results)
+        return PrewarmStats(
+            cities=len(cities),
+            refreshed=refreshed,
+            failed=len(cities) - refreshed,
+            elapsed_s=round(time.perf_counter() - started, 3),
+        )
+
+    def run_forever(self, count: int, expire_after: float, lead: float) -> None:
+        """Runs a pass `lead` seconds before the forecasts cached by the previous one stop being fresh."""
+        if self.service.stale_cache is not None:
+            expire_after = min(expire_after, self.service.stale_cache.fresh_for)
+        while not self.stop.is_set():
+            pass_started = time.monotonic()
+            stats = self.run_once(count)
+            logger.info("prewarmed forecasts: %s", dataclasses.asdict(stats))
+            # the first responses of a pass were cached when it started
+            next_pass = pass_started + max(expire_after - lead - self.jitter, 0)
+            self.stop.wait(max(next_pass - time.monotonic(), 0))
@@ -0,0 +1,116 @@
+"""Span trees of sampled requests, see `forecast.middleware.ProfilingMiddleware`.
+
+A trace is a tree of timed spans rooted at the request. The span being run is kept in a
+context variable: `span` and `traced` add a child to it and do nothing, beyond reading the
+variable, when the request isn't traced. asyncio tasks and asgiref's `sync_to_async` copy
+the context, so the spans of the async views land in the right place; work handed to a
+thread pool has to be wrapped with `bind` to keep its parent.
+
+Spans opened after the root is closed, like the ones of streamed response bodies or of
+calls still running when a parallel sibling failed, are attached but not logged.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import time
+import typing as t
+
+T = t.TypeVar("T")
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("forecast_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, **attrs: t.Any) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        # appended to from the threads of parallel calls, list.append is atomic
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def as_dict(self, origin: float | None = None) -> dict[str, t.Any]:
+        """The tree in milliseconds, offsets relative to the start of the root."""
+        if origin is None:
+            origin = self.start
+        node: dict[str, t.Any] = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.as_dict(origin) for child in self.children]
+        return node
+
+
+def current() -> Span | None:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def collect(name: str, **attrs: t.Any) -> t.Iterator[Span]:
+    """Traces the block, the spans opened inside it become children of the yielded root."""
+    root = Span(name, **attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: t.Any) -> t.Iterator[Span | None]:
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, **attrs)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+
+def traced(fn: t.Callable[..., T]) -> t.Callable[..., T]:
+    """Runs every call of `fn` in a span named after its qualified name."""
+    name = fn.__qualname__
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return await fn(*args, **kwargs)
+            with span(name):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return fn(*args, **kwargs)
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def bind(fn: t.Callable[[], T]) -> t.Callable[[], T]:
+    """`fn` run in a copy of the current context, for calls submitted to an executor."""
+    if _current.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
@@ -0,0 +1,16 @@
+import typing as t
+
+from rest_framework import renderers
+
+from forecast import encoding
+
+
+class ForecastJSONRenderer(renderers.JSONRenderer):
+    """`JSONRenderer` that writes forecast domain models directly, see `forecast.encoding`."""
+
+    def render(
+        self, data: t.Any, accepted_media_type: str | None = None, renderer_context: dict | None = None
+    ) -> bytes:
+        if data is None:
+            return b""
+        return encoding.dumps(data)
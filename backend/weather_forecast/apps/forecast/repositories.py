@@ -1,34 +1,450 @@
-from core.redis import conn as redis_conn
-from django.db import transaction
+import atexit
+import collections
+import dataclasses
+import logging
+import os
+import sys
+import threading
+import time
+import typing as t
 
-from forecast import models
+from core import redis as core_redis
+from django.db import connection, transaction
+
+from forecast import metrics, models, profiling, sketch
 from forecast.domain import models as dm
 
+logger = logging.getLogger(__name__)
+
+# counters were kept in a hash before the sorted set, see the import_cities_count command
+CITIES_COUNT_KEY = "cities_count"
+CITIES_RANK_KEY = "cities_rank"
+# time windows of the popularity ranking: bucket length in seconds and number of buckets
+WINDOWS = {"hour": (60, 60), "day": (3600, 24)}
+# seconds the summed buckets of a window are reused for
+WINDOW_CACHE_TTL = 10
+SKETCH_KEY = "cities_sketch"
+
+
+def _check_window(window: str | None) -> None:
+    if window is not None and window not in WINDOWS:
+        raise ValueError(f"Unknown window {window!r}, expected one of: {', '.join(WINDOWS)}")
+
+
+def _get_ranked(db, key: str, offset: int, limit: int) -> list[dm.CitiesCountDTO]:
+    if limit <= 0:
+        return []
+    ranked = db.zrevrange(key, offset, offset + limit - 1, withscores=True)
+    return [
+        dm.CitiesCountDTO(name, int(score), rank)
+        for rank, (name, score) in enumerate(ranked, start=offset + 1)
+    ]
+
 
 class CitiesCountRepositorySQL:
+    @profiling.traced
     def create_or_incr(self, city_name: str) -> None:
-        with transaction.atomic():
-            try:
-                city = models.CitiesCount.objects.select_for_update().get(name=city_name)
-            except models.CitiesCount.DoesNotExist:
-                city = models.CitiesCount(name=city_name)
-                city.count = 0
-            city.count += 1
-            city.save()
+        self.incr_many({city_name: 1})
+
+    def incr_many(self, counts: t.Mapping[str, int]) -> None:
+        """Adds `counts` in a single upsert statement, cities seen for the first time are created."""
+        if not counts:
+            return
+        table = connection.ops.quote_name(models.CitiesCount._meta.db_table)
+        values = ", ".join(["(%s, %s)"] * len(counts))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, count) VALUES {values} "
+                f"ON CONFLICT (name) DO UPDATE SET count = {table}.count + excluded.count",
+                [param for item in counts.items() for param in item],
+            )
 
+    @profiling.traced
+    def count(self, window: str | None = None) -> int:
+        self._reject_window(window)
+        return models.CitiesCount.objects.count()
+
+    @profiling.traced
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]:
+        self._reject_window(window)
+        data = models.CitiesCount.objects.order_by("-count", "name").values_list("name", "count")
+        return [
+            dm.CitiesCountDTO(name, count, rank)
+            for rank, (name, count) in enumerate(data[offset : offset + limit], start=offset + 1)
+        ]
+
+    @staticmethod
+    def _reject_window(window: str | None) -> None:
+        if window is not None:
+            raise ValueError("Time windowed counts are only kept by the exact redis repository")
+
+    @profiling.traced
     def get_all(self) -> list[dm.CitiesCountDTO]:
-        data = models.CitiesCount.objects.all().values_list("name", "count", flat=True)
+        data = models.CitiesCount.objects.all().values_list("name", "count")
         return [dm.CitiesCountDTO(name, count) for name, count in data]
 
 
 class CitiesCountRepositoryRedis:
+    """Counters kept in a sorted set, so rankings are read a page at a time.
+
+    Every increment also goes to the current bucket of each time window; buckets expire
+    once they fall out of their window, and the ranking of a window is the union of its
+    buckets, recomputed at most every `WINDOW_CACHE_TTL` seconds.
+    """
+
     def __init__(self) -> None:
-        self.db = redis_conn
+        self.db = core_redis.get_default_connection()
 
+    @staticmethod
+    def _bucket_key(window: str, bucket: int) -> str:
+        return f"{CITIES_RANK_KEY}:{window}:{bucket}"
+
+    @profiling.traced
     def create_or_incr(self, city_name: str) -> None:
-        self.db.hincrby("cities_count", city_name, 1)
+        self.incr_many({city_name: 1})
+
+    def incr_many(self, counts: t.Mapping[str, int], now: float | None = None) -> None:
+        """Adds `counts` to the totals and the current time window buckets in one round trip.
+
+        Within `core.redis.batched` the increments go out with the other writes of the batch.
+        """
+        if not counts:
+            return
+        if now is None:
+            now = time.time()
+        with core_redis.write(self.db) as pipe:
+            for city_name, count in counts.items():
+                pipe.zincrby(CITIES_RANK_KEY, count, city_name)
+            for window, (bucket_seconds, buckets) in WINDOWS.items():
+                key = self._bucket_key(window, int(now // bucket_seconds))
+                for city_name, count in counts.items():
+                    pipe.zincrby(key, count, city_name)
+                pipe.expire(key, bucket_seconds * (buckets + 1))
+
+    def _ranking_key(self, window: str | None) -> str:
+        if window is None:
+            return CITIES_RANK_KEY
+        _check_window(window)
+        key = f"{CITIES_RANK_KEY}:{window}:sum"
+        if not self.db.exists(key):
+            bucket_seconds, buckets = WINDOWS[window]
+            current = int(time.time() // bucket_seconds)
+            pipe = self.db.pipeline(transaction=False)
+            bucket_keys = [self._bucket_key(window, b) for b in range(current - buckets + 1, current + 1)]
+            pipe.zunionstore(key, bucket_keys)
+            pipe.expire(key, WINDOW_CACHE_TTL)
+            pipe.execute()
+        return key
+
+    @profiling.traced
+    def count(self, window: str | None = None) -> int:
+        return self.db.zcard(self._ranking_key(window))
 
+    @profiling.traced
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]:
+        """`limit` most searched cities starting from the `offset`-th one."""
+        return _get_ranked(self.db, self._ranking_key(window), offset, limit)
+
+    @profiling.traced
     def get_all(self) -> list[dm.CitiesCountDTO]:
-        return [
-            dm.CitiesCountDTO(name, count) for name, count in self.db.hgetall("cities_count").items()
+        return self.get_ranked(0, self.count())
+
+
+class CitiesCountSketchRedis:
+    """Count-Min sketch and top-K candidates of all workers, kept in redis.
+
+    The sketch is a string of saturating unsigned 32 bit cells updated with BITFIELD, so
+    merging a worker's summary is one command whatever the number of cities. The top-K is
+    a sorted set of candidate cities scored with their sketch estimate, trimmed to `top_k`.
+    """
+
+    def __init__(self, epsilon: float, delta: float, top_k: int) -> None:
+        self.db = core_redis.get_default_connection()
+        self.width, self.depth = sketch.CountMinSketch.dimensions(epsilon, delta)
+        self.top_k = top_k
+        # sketches of different dimensions can't be merged, each gets its own keys
+        self.key = f"{SKETCH_KEY}:{self.width}x{self.depth}"
+        self.top_key = f"{self.key}:top"
+        self.total_key = f"{self.key}:total"
+
+    def merge(self, summary: sketch.HeavyHitters) -> None:
+        """Adds a worker's summary to the shared sketch and rescores the top-K candidates."""
+        if (summary.sketch.width, summary.sketch.depth) != (self.width, self.depth):
+            raise ValueError("The summary has different dimensions than the shared sketch")
+        deltas = dict(summary.sketch.nonzero())
+        candidates = {name: summary.sketch.indexes(name) for name in summary.candidates.counts}
+        # cities ranked by earlier merges are rescored too, the summary may not name them
+        for name in self.db.zrange(self.top_key, 0, -1):
+            candidates.setdefault(name, summary.sketch.indexes(name))
+        for indexes in candidates.values():
+            for i in indexes:
+                deltas.setdefault(i, 0)
+        if not deltas:
+            return
+        cells = list(deltas)
+        bitfield = self.db.bitfield(self.key, default_overflow="SAT")
+        for i in cells:
+            bitfield.incrby("u32", f"#{i}", deltas[i])
+        # BITFIELD INCRBY answers with the new values: the global estimates come for free
+        values = dict(zip(cells, bitfield.execute()))
+        pipe = self.db.pipeline(transaction=False)
+        pipe.incrby(self.total_key, summary.total)
+        if candidates:
+            pipe.zadd(
+                self.top_key,
+                {name: min(values[i] for i in indexes) for name, indexes in candidates.items()},
+            )
+            pipe.zremrangebyrank(self.top_key, 0, -self.top_k - 1)
+        pipe.execute()
+
+    def estimate(self, city_name: str) -> int:
+        bitfield = self.db.bitfield(self.key)
+        for i in sketch.cell_indexes(city_name, self.width, self.depth):
+            bitfield.get("u32", f"#{i}")
+        return min(bitfield.execute())
+
+    def total(self) -> int:
+        return int(self.db.get(self.total_key) or 0)
+
+    @profiling.traced
+    def count(self, window: str | None = None) -> int:
+        CitiesCountRepositorySQL._reject_window(window)
+        return self.db.zcard(self.top_key)
+
+    @profiling.traced
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]:
+        CitiesCountRepositorySQL._reject_window(window)
+        return _get_ranked(self.db, self.top_key, offset, limit)
+
+    @profiling.traced
+    def get_all(self) -> list[dm.CitiesCountDTO]:
+        return self.get_ranked(0, self.top_k)
+
+
+class CitiesCountWriter(t.Protocol):
+    def incr_many(self, counts: t.Mapping[str, int]) -> None: ...
+
+    def count(self, window: str | None = None) -> int: ...
+
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]: ...
+
+    def get_all(self) -> list[dm.CitiesCountDTO]: ...
+
+
+@dataclasses.dataclass
+class FlushStats:
+    flushes: int = 0
+    failed_flushes: int = 0
+    # increments written and increments dropped because the buffer was full
+    flushed: int = 0
+    dropped: int = 0
+    last_flush_size: int = 0
+    last_flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+    total_flush_seconds: float = 0.0
+
+    def as_dict(self) -> dict[str, int | float]:
+        return dataclasses.asdict(self)
+
+
+class BufferedCitiesCountRepository:
+    """Write-behind buffer in front of another cities count repository.
+
+    Increments are summed in memory and written to `repo` with one `incr_many` call by a
+    background thread every `flush_interval` seconds, or as soon as `flush_size` increments
+    are pending. A failed flush puts its counts back to be retried with the next one.
+
+    The loss is bounded: `close()` writes whatever is pending and runs at interpreter exit,
+    so a process killed without running its exit handlers loses only what was counted since
+    the last flush. While the underlying store is down at most `max_pending` increments are
+    kept, newer ones are dropped and counted in `stats.dropped`.
+    """
+
+    def __init__(
+        self,
+        repo: CitiesCountWriter,
+        flush_interval: float = 1.0,
+        flush_size: int = 1000,
+        max_pending: int = 100_000,
+    ) -> None:
+        self.repo = repo
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.stats = FlushStats()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = self._new_pending()
+        self._pending_total = 0
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
+    @profiling.traced
+    def create_or_incr(self, city_name: str) -> None:
+        with self._lock:
+            if self._pending_total >= self.max_pending:
+                self.stats.dropped += 1
+                return
+            self._record(city_name)
+            self._pending_total += 1
+            if self._thread is None and not self._closed:
+                self._start()
+            if self._pending_total >= self.flush_size:
+                self._wakeup.set()
+
+    @profiling.traced
+    def get_all(self) -> list[dm.CitiesCountDTO]:
+        """Stored counts with the pending increments added, a read never waits for a flush."""
+        with self._lock:
+            pending = self._pending.copy()
+        counts = [
+            dm.CitiesCountDTO(dto.name, int(dto.count) + pending.pop(dto.name, 0))
+            for dto in self.repo.get_all()
         ]
+        counts.extend(dm.CitiesCountDTO(name, count) for name, count in pending.items())
+        return counts
+
+    def count(self, window: str | None = None) -> int:
+        return self.repo.count(window)
+
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]:
+        """Ranking of the underlying store, it lags behind by the pending increments."""
+        return self.repo.get_ranked(offset, limit, window)
+
+    def flush(self) -> int:
+        """Writes the pending increments and returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, self._new_pending()
+                size, self._pending_total = self._pending_total, 0
+            if not size:
+                return 0
+            start = time.perf_counter()
+            try:
+                self._write(pending)
+            except Exception as e:
+                logger.warning("failed to flush %d cities count increments: %s", size, e)
+                with self._lock:
+                    self.stats.failed_flushes += 1
+                    self._restore(pending)
+                    self._pending_total += size
+                return 0
+            elapsed = time.perf_counter() - start
+            metrics.POPULARITY_WRITE_DURATION.labels(type(self).__name__, "flush").observe(elapsed)
+            with self._lock:
+                self.stats.flushes += 1
+                self.stats.flushed += size
+                self.stats.last_flush_size = size
+                self.stats.last_flush_seconds = elapsed
+                self.stats.max_flush_seconds = max(self.stats.max_flush_seconds, elapsed)
+                self.stats.total_flush_seconds += elapsed
+            logger.debug("flushed %d cities count increments in %.4fs", size, elapsed)
+            return size
+
+    def close(self, timeout: float | None = 5.0) -> None:
+        """Stops the flushing thread and writes the pending increments."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    # what is pending and how it is written; all but _write are called with self._lock held
+
+    def _new_pending(self) -> collections.Counter[str]:
+        return collections.Counter()
+
+    def _record(self, city_name: str) -> None:
+        self._pending[city_name] += 1
+
+    def _restore(self, pending: collections.Counter[str]) -> None:
+        self._pending.update(pending)
+
+    def _write(self, pending: collections.Counter[str]) -> None:
+        self.repo.incr_many(pending)
+
+    def _start(self) -> None:
+        # called with self._lock held, on the first increment
+        self._thread = threading.Thread(target=self._run, name="cities-count-flush", daemon=True)
+        self._thread.start()
+        _register_for_exit(self)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._closed:
+                self.flush()
+
+
+class SketchCitiesCountRepository(BufferedCitiesCountRepository):
+    """Approximate popularity in constant memory, merged into a sketch shared in redis.
+
+    Searches are summarized in a `sketch.HeavyHitters` instead of a counter per query, so
+    typos and junk queries don't grow memory, and the summary is merged into `store` the
+    way the buffered repository flushes its counters. Counts are overestimated by less than
+    `epsilon` * total searches with probability 1 - `delta`; only the `top_k` most searched
+    cities are ranked.
+    """
+
+    def __init__(
+        self,
+        store: CitiesCountSketchRedis,
+        epsilon: float = 0.001,
+        delta: float = 0.01,
+        top_k: int = 1000,
+        flush_interval: float = 1.0,
+        flush_size: int = 1000,
+    ) -> None:
+        self.epsilon = epsilon
+        self.delta = delta
+        self.top_k = top_k
+        # a summary never grows, nothing has to be dropped while the store is unreachable
+        super().__init__(store, flush_interval, flush_size, max_pending=sys.maxsize)
+
+    def get_all(self) -> list[dm.CitiesCountDTO]:
+        return self.repo.get_all()
+
+    def _new_pending(self) -> sketch.HeavyHitters:
+        return sketch.HeavyHitters(self.epsilon, self.delta, self.top_k)
+
+    def _record(self, city_name: str) -> None:
+        self._pending.add(city_name)
+
+    def _restore(self, pending: sketch.HeavyHitters) -> None:
+        self._pending.merge(pending)
+
+    def _write(self, pending: sketch.HeavyHitters) -> None:
+        self.repo.merge(pending)
+
+
+_buffers: list[BufferedCitiesCountRepository] = []
+_buffers_lock = threading.Lock()
+
+
+def _register_for_exit(buffer: BufferedCitiesCountRepository) -> None:
+    with _buffers_lock:
+        _buffers.append(buffer)
+
+
+def close_buffers() -> None:
+    """Flushes every buffer of this process, a worker should call it before exiting."""
+    with _buffers_lock:
+        buffers = _buffers[:]
+        _buffers.clear()
+    for buffer in buffers:
+        buffer.close()
+
+
+def _forget_buffers() -> None:
+    # a forked child starts its own buffers, it must not write the parent's increments again
+    global _buffers_lock
+    _buffers_lock = threading.Lock()
+    _buffers.clear()
+
+
+atexit.register(close_buffers)
+os.register_at_fork(after_in_child=_forget_buffers)
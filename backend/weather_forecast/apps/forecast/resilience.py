@@ -0,0 +1,164 @@
+"""Circuit breakers and time budgets for upstream calls.
+
+A `CircuitBreaker` per upstream host counts consecutive failures: connection errors,
+timeouts and 5xx responses. After `failure_threshold` of them it opens and calls are
+rejected right away with `CircuitOpenError`, instead of tying up a worker thread on a host
+that is down. Once `recovery_timeout` seconds have passed it lets `half_open_calls` trial
+calls through. A successful one closes it again, a failed one opens it for another period.
+
+A `Deadline` is the time a call may take including its retries. Every attempt gets at most
+the remaining budget as its timeout, and a retry that wouldn't fit in it isn't made.
+"""
+
+import dataclasses
+import logging
+import threading
+import time
+import typing as t
+from urllib.parse import urlsplit
+
+from forecast import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class BreakerStats:
+    # calls let through that succeeded or failed
+    successes: int = 0
+    failures: int = 0
+    # calls rejected while the circuit was open
+    rejected: int = 0
+    # times the circuit opened
+    trips: int = 0
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_calls: int = 1,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.stats = BreakerStats()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        # when the circuit opened, or when the current round of trial calls started
+        self._changed_at = 0.0
+        self._trial_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state != CLOSED and self._clock() - self._changed_at >= self.recovery_timeout:
+            # also starts a new round when the trial calls of the previous one never reported back
+            self._state = HALF_OPEN
+            self._changed_at = self._clock()
+            self._trial_calls = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now, every allowed call must report its outcome."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._trial_calls < self.half_open_calls:
+                self._trial_calls += 1
+                return True
+            self.stats.rejected += 1
+            metrics.BREAKER_REJECTED.labels(self.name).inc()
+            return False
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpenError(f"circuit of {self.name} is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.stats.successes += 1
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info("circuit of %s closed", self.name)
+                self._state = CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.stats.failures += 1
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or (
+                self._state == CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    "circuit of %s opened after %d failures", self.name, self._consecutive_failures
+                )
+                self._state = OPEN
+                self._changed_at = self._clock()
+                self.stats.trips += 1
+                metrics.BREAKER_TRIPS.labels(self.name).inc()
+
+    def as_dict(self) -> dict[str, t.Any]:
+        return {"state": self.state, **dataclasses.asdict(self.stats)}
+
+
+class CircuitBreakers:
+    """One breaker per upstream host, created on first use."""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    name, CircuitBreaker(name, self.failure_threshold, self.recovery_timeout)
+                )
+        return breaker
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        return self.get(urlsplit(url).netloc)
+
+    def stats(self) -> dict[str, dict[str, t.Any]]:
+        return {name: breaker.as_dict() for name, breaker in list(self._breakers.items())}
+
+
+class Deadline:
+    def __init__(self, budget: float, clock: t.Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self.expires_at = clock() + budget
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self._clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, limit: float) -> float:
+        """`limit` cut down to the remaining budget."""
+        return min(limit, self.remaining())
+
+    def fits(self, delay: float) -> bool:
+        """Whether there is time left for an attempt after waiting `delay` seconds."""
+        return self.remaining() > delay
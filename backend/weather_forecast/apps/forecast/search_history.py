@@ -1,33 +1,129 @@
+"""Per-visitor history of searched cities, kept out of the Django session.
+
+A visitor is identified by a random id in its own cookie, set by
+`forecast.middleware.SearchHistoryMiddleware` whenever a search is recorded. Histories
+live in a `HistoryStore`. With Redis each one is a sorted set of city names scored with the
+time of their last search. Moving a city to the front is then a single ZADD, O(log n), and
+the set is trimmed to `max_length` and expires after `ttl` seconds without searches. The
+session is never read or saved, so a search costs no session table query.
+"""
+
+import logging
+import re
+import secrets
+import threading
+import time
 import typing as t
+from collections import OrderedDict
 
-from django.conf import settings
+import redis
+from core import redis as core_redis
 from django.http import HttpRequest
 
+from forecast import profiling
+from forecast.local_cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "search_history"
+BACKENDS = ("redis", "memory")
+# attribute of the request the middleware reads the id of a visitor whose history changed from
+REQUEST_ATTR = "search_history_id"
+# ids are generated with secrets.token_urlsafe, anything else in the cookie is ignored
+VISITOR_ID_RE = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+
+class HistoryStore(t.Protocol):
+    def push(self, visitor_id: str, city_name: str) -> None: ...
+
+    def get(self, visitor_id: str) -> list[str]:
+        """City names from the least to the most recently searched."""
+        ...
+
+
+class RedisHistoryStore:
+    def __init__(self, connection: redis.Redis, max_length: int = 50, ttl: int = 30 * 24 * 3600) -> None:
+        self.db = connection
+        self.max_length = max_length
+        self.ttl = ttl
+
+    @staticmethod
+    def key(visitor_id: str) -> str:
+        return f"{KEY_PREFIX}:{visitor_id}"
+
+    @profiling.traced
+    def push(self, visitor_id: str, city_name: str) -> None:
+        key = self.key(visitor_id)
+        with core_redis.write(self.db) as pipe:
+            pipe.zadd(key, {city_name: time.time()})
+            # the oldest searches beyond the limit are dropped
+            pipe.zremrangebyrank(key, 0, -self.max_length - 1)
+            pipe.expire(key, self.ttl)
+
+    @profiling.traced
+    def get(self, visitor_id: str) -> list[str]:
+        return self.db.zrange(self.key(visitor_id), 0, -1)
+
+
+class MemoryHistoryStore:
+    """Per-process store, for development and tests: histories don't survive a restart."""
+
+    def __init__(self, max_length: int = 50, ttl: int = 30 * 24 * 3600, max_visitors: int = 10_000) -> None:
+        self.max_length = max_length
+        self._histories: LocalCache[str, OrderedDict[str, None]] = LocalCache(max_visitors, ttl)
+        self._lock = threading.Lock()
+
+    @profiling.traced
+    def push(self, visitor_id: str, city_name: str) -> None:
+        with self._lock:
+            history = self._histories.get(visitor_id) or OrderedDict()
+            history[city_name] = None
+            history.move_to_end(city_name)
+            while len(history) > self.max_length:
+                history.popitem(last=False)
+            self._histories.set(visitor_id, history)
+
+    @profiling.traced
+    def get(self, visitor_id: str) -> list[str]:
+        with self._lock:
+            return list(self._histories.get(visitor_id) or ())
+
+
+def get_store(name: str, redis_db: int, max_length: int, ttl: int) -> HistoryStore:
+    """History store for one of the `BACKENDS` names."""
+    if name == "redis":
+        return RedisHistoryStore(core_redis.get_connection(redis_db, decode_responses=True), max_length, ttl)
+    if name == "memory":
+        return MemoryHistoryStore(max_length, ttl)
+    raise ValueError(f"Unknown search history backend {name!r}, expected one of {BACKENDS}")
+
 
 class SearchHistory:
-    def __init__(self, request: HttpRequest) -> None:
-        self.session = request.session
-        history: list | None = self.session.get(settings.FORECAST_HISTORY_SESSION_KEY)
-        if history is None:
-            history = self.session[settings.FORECAST_HISTORY_SESSION_KEY] = []
-        self._history = history
+    def __init__(self, request: HttpRequest, store: HistoryStore, cookie_name: str) -> None:
+        # a DRF request wraps the django one, the middleware only sees the latter
+        self.request = getattr(request, "_request", request)
+        visitor_id = request.COOKIES.get(cookie_name, "")
+        self.visitor_id = visitor_id if VISITOR_ID_RE.fullmatch(visitor_id) else None
+        self.store = store
+        self._history: list[str] | None = None
 
     def push(self, city_name: str) -> None:
-        if city_name not in self._history:
-            print(f"adding {city_name} to history")
-            self._history.append(city_name)
-        else:
-            print(f"{city_name} already in history, changing position")
-            # change position to move to the end of the list
-            self._history.remove(city_name)
-            self._history.append(city_name)
-        self.save()
+        if self.visitor_id is None:
+            self.visitor_id = secrets.token_urlsafe(16)
+        logger.debug("pushing %s to the search history of %s", city_name, self.visitor_id)
+        self.store.push(self.visitor_id, city_name)
+        self._history = None
+        # the cookie is set again on every search, it expires along with the history
+        setattr(self.request, REQUEST_ATTR, self.visitor_id)
 
-    def __getitem__(self, index: int | slice) -> str:
-        return self._history[index]
+    @property
+    def history(self) -> list[str]:
+        if self._history is None:
+            self._history = self.store.get(self.visitor_id) if self.visitor_id is not None else []
+        return self._history
 
-    def save(self):
-        self.session.modified = True
+    def __getitem__(self, index: int | slice) -> str:
+        return self.history[index]
 
     def __iter__(self) -> t.Iterator:
-        return iter([{"city_name": city} for city in self._history])
+        return iter([{"city_name": city} for city in self.history])
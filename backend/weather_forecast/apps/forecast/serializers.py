@@ -4,15 +4,24 @@ from forecast import models
 
 
 class CitiesCountSerializer(serializers.ModelSerializer):
+    rank = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = models.CitiesCount
-        fields = ("name", "count")
+        fields = ("rank", "name", "count")
 
 
 class HistorySerializer(serializers.Serializer):
     city_name = serializers.CharField()
 
 
+class CitySerializer(serializers.Serializer):
+    name = serializers.CharField()
+    country_code = serializers.CharField()
+    latitude = serializers.FloatField()
+    longitude = serializers.FloatField()
+
+
 # class AmountSerializer(serializers.Serializer):
 #     value = serializers.FloatField()
 #     unit = serializers.CharField(allow_blank=True, required=False)
@@ -0,0 +1,178 @@
+"""Coalescing of identical in-flight upstream calls.
+
+Within a process, concurrent calls with the same key wait for the first one (the leader) and
+share its result. Across processes a short Redis lock marks a key as being fetched: callers in
+other workers wait for it to be released and then run the call themselves, which is answered
+from the shared response cache the leader has just filled.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import threading
+import time
+import typing as t
+
+import redis
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
+
+T = t.TypeVar("T")
+
+LOCK_PREFIX = "singleflight"
+POLL_INTERVAL = 0.02
+
+
+@dataclasses.dataclass
+class SingleFlightStats:
+    leaders: int = 0
+    coalesced_local: int = 0
+    coalesced_remote: int = 0
+
+    @property
+    def coalesced(self) -> int:
+        return self.coalesced_local + self.coalesced_remote
+
+    def __add__(self, other: "SingleFlightStats") -> "SingleFlightStats":
+        return SingleFlightStats(
+            *(getattr(self, f.name) + getattr(other, f.name) for f in dataclasses.fields(self))
+        )
+
+    def as_dict(self) -> dict[str, int]:
+        return {**dataclasses.asdict(self), "coalesced": self.coalesced}
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: t.Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self, connection: redis.Redis | None = None, lock_timeout: float = 5.0) -> None:
+        self.db = connection
+        self.lock_timeout = lock_timeout
+        self.stats = SingleFlightStats()
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+
+    def do(self, key: str, fn: t.Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self.stats.leaders += 1
+            else:
+                self.stats.coalesced_local += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._run_exclusive(key, fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _run_exclusive(self, key: str, fn: t.Callable[[], T]) -> T:
+        if self.db is None:
+            return fn()
+        name = f"{LOCK_PREFIX}:{key}"
+        lock = self.db.lock(name, timeout=self.lock_timeout)
+        try:
+            acquired = lock.acquire(blocking=False)
+        except redis.RedisError as e:
+            logger.warning("single flight lock unavailable, fetching without it: %s", e)
+            return fn()
+        if acquired:
+            try:
+                return fn()
+            finally:
+                try:
+                    lock.release()
+                except redis.RedisError as e:
+                    logger.warning("failed to release single flight lock %s: %s", name, e)
+        with self._lock:
+            self.stats.coalesced_remote += 1
+        self._wait_released(name)
+        return fn()
+
+    def _wait_released(self, name: str) -> None:
+        deadline = time.monotonic() + self.lock_timeout
+        try:
+            while self.db.exists(name) and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+        except redis.RedisError as e:
+            logger.warning("failed to wait for single flight lock %s: %s", name, e)
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines, scoped to one event loop."""
+
+    def __init__(
+        self, connection: redis.asyncio.Redis | None = None, lock_timeout: float = 5.0
+    ) -> None:
+        self.db = connection
+        self.lock_timeout = lock_timeout
+        self.stats = SingleFlightStats()
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: t.Callable[[], t.Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is not None:
+            self.stats.coalesced_local += 1
+            # shielded, so a cancelled follower doesn't cancel the shared call
+            return await asyncio.shield(call)
+        self.stats.leaders += 1
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._run_exclusive(key, fn)
+        except BaseException as e:
+            call.set_exception(e)
+            # followers get the error, don't report it as never retrieved when there were none
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            del self._calls[key]
+        return result
+
+    async def _run_exclusive(self, key: str, fn: t.Callable[[], t.Awaitable[T]]) -> T:
+        if self.db is None:
+            return await fn()
+        name = f"{LOCK_PREFIX}:{key}"
+        lock = self.db.lock(name, timeout=self.lock_timeout)
+        try:
+            acquired = await lock.acquire(blocking=False)
+        except redis.RedisError as e:
+            logger.warning("single flight lock unavailable, fetching without it: %s", e)
+            return await fn()
+        if acquired:
+            try:
+                return await fn()
+            finally:
+                try:
+                    await lock.release()
+                except redis.RedisError as e:
+                    logger.warning("failed to release single flight lock %s: %s", name, e)
+        self.stats.coalesced_remote += 1
+        await self._wait_released(name)
+        return await fn()
+
+    async def _wait_released(self, name: str) -> None:
+        deadline = time.monotonic() + self.lock_timeout
+        try:
+            while await self.db.exists(name) and time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+        except redis.RedisError as e:
+            logger.warning("failed to wait for single flight lock %s: %s", name, e)
@@ -0,0 +1,141 @@
+"""Bounded memory summaries of a stream of searched city names.
+
+`CountMinSketch` estimates the count of any key and never underestimates it: with
+probability ``1 - delta`` the overestimate is below ``epsilon * total``. `SpaceSaving`
+keeps the `capacity` most frequent keys with counts that are off by at most the recorded
+error. `HeavyHitters` combines both, the sketch answers point queries and the space
+saving summary names the candidates for the top-K.
+
+Keys are hashed with blake2b rather than `hash()`, so every process maps a key to the
+same cells and sketches of different workers can be merged cell by cell.
+"""
+
+import hashlib
+import heapq
+import math
+import typing as t
+from array import array
+
+
+def cell_indexes(key: str, width: int, depth: int) -> list[int]:
+    """Cell of `key` in every row of a `width` x `depth` sketch, as flat indexes."""
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+    return [row * width + (h1 + row * h2) % width for row in range(depth)]
+
+
+class CountMinSketch:
+    def __init__(self, width: int, depth: int) -> None:
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.cells = array("q", bytes(8 * width * depth))
+
+    @staticmethod
+    def dimensions(epsilon: float, delta: float) -> tuple[int, int]:
+        """Width and depth for overestimates below `epsilon` * total with probability 1 - `delta`."""
+        return math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta))
+
+    @classmethod
+    def from_error(cls, epsilon: float, delta: float) -> "CountMinSketch":
+        return cls(*cls.dimensions(epsilon, delta))
+
+    def indexes(self, key: str) -> list[int]:
+        return cell_indexes(key, self.width, self.depth)
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Adds `count` to `key` and returns its new estimate."""
+        self.total += count
+        estimate = None
+        for i in self.indexes(key):
+            self.cells[i] += count
+            if estimate is None or self.cells[i] < estimate:
+                estimate = self.cells[i]
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return min(self.cells[i] for i in self.indexes(key))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only sketches of the same dimensions can be merged")
+        for i, value in enumerate(other.cells):
+            if value:
+                self.cells[i] += value
+        self.total += other.total
+
+    def nonzero(self) -> t.Iterator[tuple[int, int]]:
+        """(index, value) of every cell that has been added to."""
+        return ((i, value) for i, value in enumerate(self.cells) if value)
+
+
+class SpaceSaving:
+    """The `capacity` most frequent keys of a stream (Metwally et al., Space-Saving)."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        # one (count, key) entry per key, counts only grow so an entry may lag behind its key
+        self._heap: list[tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, key: str, count: int = 1) -> None:
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (count, key))
+            return
+        # the smallest counter is taken over, its count becomes the newcomer's possible error
+        while True:
+            smallest, victim = self._heap[0]
+            if self.counts[victim] == smallest:
+                break
+            heapq.heapreplace(self._heap, (self.counts[victim], victim))
+        heapq.heapreplace(self._heap, (smallest + count, key))
+        del self.counts[victim], self.errors[victim]
+        self.counts[key] = smallest + count
+        self.errors[key] = smallest
+
+    def top(self, n: int | None = None) -> list[tuple[str, int, int]]:
+        """(key, count, error) of the `n` largest counters."""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+    def merge(self, other: "SpaceSaving") -> None:
+        for key, count in other.counts.items():
+            self.add(key, count)
+
+
+class HeavyHitters:
+    """Count-Min sketch for the counts plus Space-Saving for the top-K candidates."""
+
+    def __init__(self, epsilon: float, delta: float, capacity: int) -> None:
+        self.sketch = CountMinSketch.from_error(epsilon, delta)
+        self.candidates = SpaceSaving(capacity)
+
+    @property
+    def total(self) -> int:
+        return self.sketch.total
+
+    def add(self, key: str, count: int = 1) -> None:
+        self.sketch.add(key, count)
+        self.candidates.add(key, count)
+
+    def estimate(self, key: str) -> int:
+        return self.sketch.estimate(key)
+
+    def top(self, n: int | None = None) -> list[tuple[str, int]]:
+        """Most frequent candidates by their sketch estimate."""
+        estimates = [(key, self.sketch.estimate(key)) for key in self.candidates.counts]
+        estimates.sort(key=lambda item: item[1], reverse=True)
+        return estimates[:n]
+
+    def merge(self, other: "HeavyHitters") -> None:
+        self.sketch.merge(other.sketch)
+        self.candidates.merge(other.candidates)
@@ -0,0 +1,227 @@
+"""Stale-while-revalidate and stale-if-error caching of parsed forecasts.
+
+Forecasts are kept in a Django cache, shared by the workers, along with the time they were
+fetched. Depending on its age an entry is:
+
+- fresh, younger than `fresh_for`: served as is;
+- stale, up to `stale_while_revalidate` seconds past that: served right away while a
+  background refresh fetches a new one, so no request waits on the upstream;
+- older than that: fetched again before answering, but if the upstream fails and the
+  entry is no more than `stale_if_error` seconds past fresh, it is served instead of an
+  error.
+
+Every answer comes with its `Freshness`, which the views report in a response header.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import typing as t
+from concurrent.futures import Executor
+
+from django.core.cache import BaseCache, caches
+
+from forecast import api_client, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+T = t.TypeVar("T")
+
+KEY_PREFIX = "forecast_stale"
+FRESH, STALE, STALE_IF_ERROR = "fresh", "stale", "stale-if-error"
+# too old to be served without asking the upstream first
+EXPIRED = "expired"
+
+
+class Freshness(t.NamedTuple):
+    state: str = FRESH
+    # seconds since the forecast was fetched
+    age: int = 0
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.state == FRESH
+
+    def header(self) -> str:
+        return f"{self.state}; age={self.age}"
+
+
+def least_fresh(*freshnesses: Freshness) -> Freshness:
+    """Freshness of a response made of several forecasts, the one of the oldest stale forecast."""
+    return max(freshnesses, key=lambda freshness: (not freshness.is_fresh, freshness.age))
+
+
+def _record_lookup(state: str) -> None:
+    result = {FRESH: metrics.HIT, STALE: metrics.STALE}.get(state, metrics.MISS)
+    metrics.CACHE_REQUESTS.labels("stale", result).inc()
+
+
+class _Entry(t.NamedTuple):
+    value: t.Any
+    fetched_at: float
+
+
+class StaleCache:
+    def __init__(
+        self,
+        alias: str = "default",
+        fresh_for: int = 3600,
+        stale_while_revalidate: int = 600,
+        stale_if_error: int = 6 * 3600,
+        executor: Executor | None = None,
+        clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        self.alias = alias
+        self.fresh_for = fresh_for
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        # runs the background refreshes of the sync path, a thread per refresh without it
+        self.executor = executor
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refreshing: set[str] = set()
+        # references to the running refresh tasks, the event loop only keeps weak ones
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def cache(self) -> BaseCache:
+        return caches[self.alias]
+
+    @property
+    def timeout(self) -> int:
+        return self.fresh_for + max(self.stale_while_revalidate, self.stale_if_error)
+
+    @staticmethod
+    def key(kind: str, geo_data: api_client.GeoData, *params: t.Any) -> str:
+        # days start at midnight in the timezone of the request: the same place fetched in UTC
+        # and in its local timezone gets different daily forecasts
+        place = f"{geo_data.latitude:.4f},{geo_data.longitude:.4f},{geo_data.timezone}"
+        args = ":".join(map(str, params))
+        return f"{KEY_PREFIX}:{kind}:{place}:{args}"
+
+    def _freshness(self, entry: _Entry, now: float) -> tuple[str, int]:
+        age = max(int(now - entry.fetched_at), 0)
+        if age < self.fresh_for:
+            return FRESH, age
+        if age < self.fresh_for + self.stale_while_revalidate:
+            return STALE, age
+        return EXPIRED, age
+
+    def _usable_on_error(self, entry: _Entry | None, now: float) -> bool:
+        return entry is not None and now - entry.fetched_at < self.fresh_for + self.stale_if_error
+
+    def _begin_refresh(self, key: str) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _end_refresh(self, key: str) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    @profiling.traced
+    def _read(self, key: str) -> _Entry | None:
+        try:
+            entry = self.cache.get(key)
+        except Exception as e:
+            logger.warning("failed to read cached forecast %s: %s", key, e)
+            return None
+        return _Entry(*entry) if entry is not None else None
+
+    @profiling.traced
+    def _write(self, key: str, value: t.Any) -> None:
+        try:
+            self.cache.set(key, (value, self._clock()), self.timeout)
+        except Exception as e:
+            logger.warning("failed to cache forecast %s: %s", key, e)
+
+    def put(self, key: str, value: t.Any) -> None:
+        """Stores a forecast fetched elsewhere, fresh from now on."""
+        self._write(key, value)
+
+    def _refresh(self, key: str, fetch: t.Callable[[], T]) -> None:
+        try:
+            self._write(key, fetch())
+        except api_client.ForecastApiError as e:
+            logger.warning("background refresh of %s failed: %s", key, e)
+        except Exception:
+            # nobody awaits the refresh, an unexpected error would go unnoticed
+            logger.exception("background refresh of %s failed", key)
+        finally:
+            self._end_refresh(key)
+
+    def get(self, key: str, fetch: t.Callable[[], T]) -> tuple[T, Freshness]:
+        now = self._clock()
+        entry = self._read(key)
+        state, age = self._freshness(entry, now) if entry is not None else (EXPIRED, 0)
+        _record_lookup(state)
+        if state == FRESH:
+            return entry.value, Freshness(FRESH, age)
+        if state == STALE:
+            if self._begin_refresh(key):
+                if self.executor is not None:
+                    self.executor.submit(self._refresh, key, fetch)
+                else:
+                    threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+            return entry.value, Freshness(STALE, age)
+        try:
+            value = fetch()
+        except api_client.ForecastApiError as e:
+            if not self._usable_on_error(entry, now):
+                raise
+            logger.warning("serving a stale forecast for %s: %s", key, e)
+            return entry.value, Freshness(STALE_IF_ERROR, int(now - entry.fetched_at))
+        self._write(key, value)
+        return value, Freshness()
+
+    @profiling.traced
+    async def _aread(self, key: str) -> _Entry | None:
+        try:
+            entry = await self.cache.aget(key)
+        except Exception as e:
+            logger.warning("failed to read cached forecast %s: %s", key, e)
+            return None
+        return _Entry(*entry) if entry is not None else None
+
+    @profiling.traced
+    async def _awrite(self, key: str, value: t.Any) -> None:
+        try:
+            await self.cache.aset(key, (value, self._clock()), self.timeout)
+        except Exception as e:
+            logger.warning("failed to cache forecast %s: %s", key, e)
+
+    async def _arefresh(self, key: str, fetch: t.Callable[[], t.Awaitable[T]]) -> None:
+        try:
+            await self._awrite(key, await fetch())
+        except api_client.ForecastApiError as e:
+            logger.warning("background refresh of %s failed: %s", key, e)
+        except Exception:
+            logger.exception("background refresh of %s failed", key)
+        finally:
+            self._end_refresh(key)
+
+    async def aget(self, key: str, fetch: t.Callable[[], t.Awaitable[T]]) -> tuple[T, Freshness]:
+        now = self._clock()
+        entry = await self._aread(key)
+        state, age = self._freshness(entry, now) if entry is not None else (EXPIRED, 0)
+        _record_lookup(state)
+        if state == FRESH:
+            return entry.value, Freshness(FRESH, age)
+        if state == STALE:
+            if self._begin_refresh(key):
+                task = asyncio.get_running_loop().create_task(self._arefresh(key, fetch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return entry.value, Freshness(STALE, age)
+        try:
+            value = await fetch()
+        except api_client.ForecastApiError as e:
+            if not self._usable_on_error(entry, now):
+                raise
+            logger.warning("serving a stale forecast for %s: %s", key, e)
+            return entry.value, Freshness(STALE_IF_ERROR, int(now - entry.fetched_at))
+        await self._awrite(key, value)
+        return value, Freshness()
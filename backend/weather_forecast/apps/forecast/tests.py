@@ -1,3 +1,1670 @@
-from django.test import TestCase
+import asyncio
+import collections
+import io
+import json
+import os
+import pstats
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+import fakeredis
+import fakeredis.aioredis
+import httpx
+import redis
+from benchmarks.stub_upstream import Recordings, StubUpstream
+from core import redis as core_redis
+from django.conf import settings
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from prometheus_client import REGISTRY
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from forecast import api_client, geogrid, geoindex, profiling, resilience, singleflight
+from forecast import dependecies as deps
+from forecast import payload_cache as pc
+from forecast import prewarm
+from forecast import repositories
+from forecast import search_history as sh
+from forecast import sketch
+from forecast import stale_cache as sc
+from forecast import views
+from forecast.domain import models as dm
+from forecast.domain import service as sv
+from forecast.middleware import ProfilingMiddleware
+
+BERLIN = api_client.GeoData(52.52, 13.41)
+PARIS = api_client.GeoData(48.86, 2.35)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = resilience.CircuitBreaker("upstream", 3, 30, clock=self.clock)
+
+    def trip(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.breaker.check()
+        self.assertEqual(self.breaker.stats.trips, 1)
+        self.assertEqual(self.breaker.stats.rejected, 1)
+
+    def test_trial_call_closes_the_circuit(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, resilience.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        # a single trial call at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+
+    def test_failed_trial_call_opens_the_circuit_again(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        self.assertEqual(self.breaker.stats.trips, 2)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_deadline(self):
+        deadline = resilience.Deadline(1.0, clock=self.clock)
+        self.assertEqual(deadline.timeout(10), 1.0)
+        self.clock.now += 0.75
+        self.assertEqual(deadline.timeout(10), 0.25)
+        self.assertTrue(deadline.fits(0.2))
+        self.assertFalse(deadline.fits(0.25))
+        self.clock.now += 1
+        self.assertTrue(deadline.expired)
+
+
+def wait_until(predicate: t.Callable[[], bool], timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def blocking_call(self) -> int:
+        self.calls += 1
+        self.release.wait(2)
+        return self.calls
+
+    def run_concurrently(self, flight: singleflight.SingleFlight, fn, followers: int = 2) -> list:
+        leader = self.executor.submit(flight.do, "key", fn)
+        wait_until(lambda: flight.stats.leaders == 1)
+        others = [self.executor.submit(flight.do, "key", fn) for _ in range(followers)]
+        wait_until(lambda: flight.stats.coalesced_local == followers)
+        self.release.set()
+        return [leader, *others]
+
+    def test_concurrent_calls_share_the_leader_result(self):
+        flight = singleflight.SingleFlight()
+        futures = self.run_concurrently(flight, self.blocking_call)
+        self.assertEqual([future.result(2) for future in futures], [1, 1, 1])
+        self.assertEqual(self.calls, 1)
+        # once the leader is done, the next call runs again
+        self.assertEqual(flight.do("key", self.blocking_call), 2)
+        self.assertEqual(flight.stats.as_dict(), {
+            "leaders": 2, "coalesced_local": 2, "coalesced_remote": 0, "coalesced": 2
+        })
+
+    def test_followers_get_the_leader_error(self):
+        def failing_call():
+            self.release.wait(2)
+            raise api_client.ForecastApiError("upstream down")
+
+        flight = singleflight.SingleFlight()
+        for future in self.run_concurrently(flight, failing_call):
+            with self.assertRaisesMessage(api_client.ForecastApiError, "upstream down"):
+                future.result(2)
+        self.assertEqual(flight.do("key", lambda: "recovered"), "recovered")
+
+    def test_leader_holds_the_redis_lock_while_calling(self):
+        db = fakeredis.FakeRedis()
+        flight = singleflight.SingleFlight(db)
+        lock_name = f"{singleflight.LOCK_PREFIX}:key"
+        self.assertEqual(flight.do("key", lambda: db.exists(lock_name)), 1)
+        self.assertEqual(db.exists(lock_name), 0)
+
+    def test_waits_for_the_lock_of_another_process(self):
+        server = fakeredis.FakeServer()
+        other_process = fakeredis.FakeRedis(server=server).lock(f"{singleflight.LOCK_PREFIX}:key", timeout=5)
+        self.assertTrue(other_process.acquire(blocking=False))
+        flight = singleflight.SingleFlight(fakeredis.FakeRedis(server=server), lock_timeout=5)
+        future = self.executor.submit(flight.do, "key", lambda: "cached")
+        wait_until(lambda: flight.stats.coalesced_remote == 1)
+        self.assertFalse(future.done())
+        other_process.release()
+        self.assertEqual(future.result(2), "cached")
+
+    def test_lock_wait_is_bounded_by_the_lock_timeout(self):
+        db = fakeredis.FakeRedis()
+        # a lock left behind without an expiry by a crashed process
+        db.set(f"{singleflight.LOCK_PREFIX}:key", "token")
+        flight = singleflight.SingleFlight(db, lock_timeout=0.1)
+        started = time.monotonic()
+        self.assertEqual(flight.do("key", lambda: "fetched"), "fetched")
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_redis_errors_fall_back_to_an_unlocked_call(self):
+        db = mock.Mock()
+        db.lock.return_value.acquire.side_effect = redis.ConnectionError
+        flight = singleflight.SingleFlight(db)
+        with self.assertLogs(singleflight.logger, "WARNING"):
+            self.assertEqual(flight.do("key", lambda: "fetched"), "fetched")
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_the_leader_result(self):
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            flight = singleflight.AsyncSingleFlight()
+            results = await asyncio.gather(*(flight.do("key", call) for _ in range(3)))
+            return results, flight.stats
+
+        results, stats = asyncio.run(main())
+        self.assertEqual(results, [1, 1, 1])
+        self.assertEqual((stats.leaders, stats.coalesced_local), (1, 2))
+
+    def test_followers_get_the_leader_error(self):
+        async def call():
+            await asyncio.sleep(0.01)
+            raise api_client.ForecastApiError("upstream down")
+
+        async def main():
+            flight = singleflight.AsyncSingleFlight()
+            return await asyncio.gather(*(flight.do("key", call) for _ in range(3)), return_exceptions=True)
+
+        for result in asyncio.run(main()):
+            self.assertIsInstance(result, api_client.ForecastApiError)
+
+    def test_cancelled_follower_does_not_cancel_the_leader(self):
+        async def call():
+            await asyncio.sleep(0.02)
+            return "fetched"
+
+        async def main():
+            flight = singleflight.AsyncSingleFlight()
+            leader = asyncio.ensure_future(flight.do("key", call))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do("key", call))
+            await asyncio.sleep(0)
+            follower.cancel()
+            return await leader, follower.cancelled()
+
+        self.assertEqual(asyncio.run(main()), ("fetched", True))
+
+    def test_waits_for_the_lock_of_another_process(self):
+        lock_name = f"{singleflight.LOCK_PREFIX}:key"
+
+        async def main():
+            server = fakeredis.FakeServer()
+            other_process = fakeredis.aioredis.FakeRedis(server=server).lock(lock_name, timeout=5)
+            self.assertTrue(await other_process.acquire(blocking=False))
+            flight = singleflight.AsyncSingleFlight(fakeredis.aioredis.FakeRedis(server=server))
+            task = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0, "cached")))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            self.assertEqual(flight.stats.coalesced_remote, 1)
+            await other_process.release()
+            return await asyncio.wait_for(task, 2)
+
+        self.assertEqual(asyncio.run(main()), "cached")
+
+    def test_lock_wait_is_bounded_by_the_lock_timeout(self):
+        async def main():
+            db = fakeredis.aioredis.FakeRedis()
+            await db.set(f"{singleflight.LOCK_PREFIX}:key", "token")
+            flight = singleflight.AsyncSingleFlight(db, lock_timeout=0.1)
+            return await asyncio.wait_for(flight.do("key", lambda: asyncio.sleep(0, "fetched")), 2)
+
+        self.assertEqual(asyncio.run(main()), "fetched")
+
+
+class StubUpstreamTestCase(SimpleTestCase):
+    """Clients talking to a local stub of Open-Meteo that fails on demand."""
+
+    def setUp(self):
+        self.stub = StubUpstream().start()
+        self.addCleanup(self.stub.stop)
+        self.breakers = resilience.CircuitBreakers(failure_threshold=3, recovery_timeout=60)
+        patcher = mock.patch.object(api_client, "RETRY_BACKOFF_FACTOR", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @property
+    def breaker(self) -> resilience.CircuitBreaker:
+        return self.breakers.for_url(self.stub.forecast_url)
+
+
+class OpenMeteoApiClientFaultTests(StubUpstreamTestCase):
+    def make_client(self, **kwargs) -> api_client.OpenMeteoApiClient:
+        kwargs = {"retries": 3, "read_timeout": 1.0, "deadline": 5.0, **kwargs}
+        client = api_client.OpenMeteoApiClient(
+            forecast_url=self.stub.forecast_url,
+            geodata_url=self.stub.geodata_url,
+            cache_backend="memory",
+            breakers=self.breakers,
+            **kwargs,
+        )
+        self.addCleanup(client.close)
+        return client
+
+    def test_server_errors_are_retried(self):
+        client = self.make_client()
+        self.stub.fail_next = 2
+        forecast = client.get_daily_forecast(BERLIN, forecast_days=3)
+        self.assertEqual(len(forecast.time), 3)
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+
+    def test_circuit_opens_and_fails_fast(self):
+        client = self.make_client()
+        self.stub.error_rate = 1.0
+        with self.assertRaises(api_client.GettingForecastError):
+            client.get_daily_forecast(BERLIN)
+        # the fourth attempt was rejected by the breaker
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        started = time.perf_counter()
+        with self.assertRaises(api_client.GettingForecastError):
+            client.get_daily_forecast(PARIS)
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.breakers.stats()[self.breaker.name]["trips"], 1)
+
+    def test_cached_responses_are_served_while_the_circuit_is_open(self):
+        client = self.make_client()
+        forecast = client.get_daily_forecast(BERLIN)
+        self.stub.error_rate = 1.0
+        with self.assertRaises(api_client.GettingForecastError):
+            client.get_daily_forecast(PARIS)
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        self.assertEqual(client.get_daily_forecast(BERLIN), forecast)
+
+    def test_retries_fit_in_the_deadline(self):
+        client = self.make_client(retries=5, read_timeout=0.2, deadline=0.5)
+        self.stub.latency = 0.3
+        started = time.perf_counter()
+        with self.assertRaises(api_client.GettingForecastError):
+            client.get_daily_forecast(BERLIN)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertLessEqual(self.stub.requests, 3)
+
+
+def hourly_series(first_hour: str, hours: int, first_day: str, days: int) -> dm.HourlyTimeSeries:
+    start, day = datetime.fromisoformat(first_hour), date.fromisoformat(first_day)
+    hourly = dm.ColumnarForecast(
+        [(start + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M") for i in range(hours)],
+        {"temp": dm.Column(list(range(hours)), "°C")},
+        dm.WeatherDataPerHour,
+    )
+    daily = dm.ColumnarForecast(
+        [(day + timedelta(days=i)).isoformat() for i in range(days)],
+        {
+            "temp_min": dm.Column(list(range(days)), "°C"),
+            "temp_max": dm.Column(list(range(10, 10 + days)), "°C"),
+        },
+        dm.TemperatureRange,
+    )
+    return dm.HourlyTimeSeries(hourly, daily)
+
+
+class HourlyTimeSeriesTests(SimpleTestCase):
+    def setUp(self):
+        self.series = hourly_series("2024-05-01T00:00", 72, "2024-05-01", 3)
+
+    def test_covers(self):
+        self.assertTrue(self.series.covers(date(2024, 5, 1), date(2024, 5, 3)))
+        self.assertTrue(self.series.covers(date(2024, 5, 2), date(2024, 5, 2)))
+        self.assertFalse(self.series.covers(date(2024, 4, 30), date(2024, 5, 1)))
+        self.assertFalse(self.series.covers(date(2024, 5, 3), date(2024, 5, 4)))
+        empty = hourly_series("2024-05-01T00:00", 0, "2024-05-01", 0)
+        self.assertFalse(empty.covers(date(2024, 5, 1), date(2024, 5, 1)))
+
+    def test_one_day_is_its_local_midnight_to_midnight(self):
+        forecast = self.series.for_dates(date(2024, 5, 2), date(2024, 5, 2))
+        self.assertEqual(
+            (forecast.hourly.time[0], forecast.hourly.time[-1]), ("2024-05-02T00:00", "2024-05-02T23:00")
+        )
+        self.assertEqual(list(forecast.hourly.columns["temp"].values), list(range(24, 48)))
+        self.assertEqual((forecast.temp_min.value, forecast.temp_max.value), ([1], [11]))
+
+    def test_range_across_day_boundaries(self):
+        forecast = self.series.for_dates(date(2024, 5, 2), date(2024, 5, 3))
+        self.assertEqual(len(forecast.hourly), 48)
+        self.assertEqual(
+            (forecast.hourly.time[0], forecast.hourly.time[-1]), ("2024-05-02T00:00", "2024-05-03T23:00")
+        )
+        self.assertEqual(forecast.temp_max.value, [11, 12])
+        self.assertIs(self.series.for_dates().hourly, self.series.hourly)
+
+    def test_partial_days_keep_only_their_own_hours(self):
+        # a series starting in the evening, e.g. local times of a timezone ahead of the model run
+        series = hourly_series("2024-04-30T22:00", 28, "2024-04-30", 2)
+        forecast = series.for_dates(date(2024, 5, 1), date(2024, 5, 1))
+        self.assertEqual(forecast.hourly.time[0], "2024-05-01T00:00")
+        self.assertEqual(len(forecast.hourly), 24)
+        self.assertEqual(len(series.for_dates(date(2024, 4, 30), date(2024, 4, 30)).hourly), 2)
+
+
+class HourlyForecastSlicingTests(StubUpstreamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = api_client.OpenMeteoApiClient(
+            forecast_url=self.stub.forecast_url,
+            geodata_url=self.stub.geodata_url,
+            cache_backend="memory",
+            breakers=self.breakers,
+            horizon_days=3,
+        )
+        self.addCleanup(self.api.close)
+        # the stub starts its forecasts on the current UTC day
+        self.today = datetime.now(UTC).date()
+
+    def test_days_of_the_horizon_are_sliced_from_one_response(self):
+        tomorrow = self.today + timedelta(days=1)
+        forecast = self.api.get_hourly_forecast_for_dates(BERLIN, self.today, tomorrow)
+        self.assertEqual(len(forecast.hourly), 48)
+        self.assertTrue(forecast.hourly.time[0].startswith(self.today.isoformat()))
+        self.assertTrue(forecast.hourly.time[-1].startswith(tomorrow.isoformat()))
+        for day in range(3):
+            requested = self.today + timedelta(days=day)
+            forecast = self.api.get_hourly_forecast_for_date(BERLIN, requested)
+            self.assertEqual({time[:10] for time in forecast.hourly.time}, {requested.isoformat()})
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_days_beyond_the_horizon_are_fetched_on_their_own(self):
+        later = self.today + timedelta(days=5)
+        forecast = self.api.get_hourly_forecast_for_dates(BERLIN, later, later)
+        self.assertEqual({time[:10] for time in forecast.hourly.time}, {later.isoformat()})
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_series_are_kept_per_timezone(self):
+        # local days differ between timezones, a series is only reused for its own
+        self.api.get_hourly_forecast_for_date(BERLIN, self.today)
+        self.api.get_hourly_forecast_for_date(BERLIN._replace(timezone="Asia/Tokyo"), self.today)
+        self.assertEqual(self.stub.requests, 2)
+
+
+class AsyncOpenMeteoApiClientFaultTests(StubUpstreamTestCase):
+    def make_client(self, **kwargs) -> api_client.AsyncOpenMeteoApiClient:
+        kwargs = {"retries": 3, "timeout": 1.0, "deadline": 5.0, **kwargs}
+        return api_client.AsyncOpenMeteoApiClient(
+            forecast_url=self.stub.forecast_url,
+            geodata_url=self.stub.geodata_url,
+            breakers=self.breakers,
+            **kwargs,
+        )
+
+    async def test_circuit_opens_and_fails_fast(self):
+        client = self.make_client()
+        self.stub.fail_next = 2
+        await client.get_daily_forecast(BERLIN)
+        self.stub.error_rate = 1.0
+        with self.assertRaises(api_client.GettingForecastError):
+            await client.get_daily_forecast(PARIS)
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        requests = self.stub.requests
+        with self.assertRaises(api_client.GettingForecastError):
+            await client.get_daily_forecast(BERLIN, forecast_days=3)
+        self.assertEqual(self.stub.requests, requests)
+        await client.close()
+
+    async def test_retries_fit_in_the_deadline(self):
+        client = self.make_client(retries=5, timeout=0.2, deadline=0.5)
+        self.stub.latency = 0.3
+        started = time.perf_counter()
+        with self.assertRaises(api_client.GettingForecastError):
+            await client.get_daily_forecast(BERLIN)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertLessEqual(self.stub.requests, 3)
+        await client.close()
+
+
+class StubUpstreamTests(SimpleTestCase):
+    def test_recorded_forecasts_are_replayed_on_the_current_day(self):
+        recordings = Recordings()
+        query = {"latitude": ["52.52"], "longitude": ["13.41"], "daily": ["temperature_2m_max"]}
+        recorded_on = date.today() - timedelta(days=3)
+        recordings.add("/v1/forecast", query, 200, {"daily": {"time": [recorded_on.isoformat()], "t": [9]}})
+        recordings.responses[Recordings.key("/v1/forecast", query)]["recorded_on"] = recorded_on.isoformat()
+        with StubUpstream(recordings=recordings) as stub:
+            replayed = httpx.get(stub.forecast_url, params=query).json()
+            generated = httpx.get(stub.forecast_url, params={**query, "latitude": "0"}).json()
+        self.assertEqual(replayed, {"daily": {"time": [date.today().isoformat()], "t": [9]}})
+        self.assertIn("daily_units", generated)
+
+    def test_reverse_geocoding(self):
+        with StubUpstream() as stub:
+            geocoder = api_client.ReverseGeocoder(nominatim_url=stub.nominatim_url)
+            name, timezone = geocoder.get_city(BERLIN)
+        self.assertTrue(name.startswith("Town "))
+        self.assertEqual(timezone, "UTC")
+
+
+class LazyInitializationTests(SimpleTestCase):
+    def test_urls_import_without_redis_settings_or_upstream_clients(self):
+        env = {name: value for name, value in os.environ.items() if not name.startswith("REDIS_")}
+        script = (
+            "import sys, django; django.setup(); import config.urls; "
+            "print(sorted({'geopy', 'requests_cache'} & sys.modules.keys()))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_wsgi_refuses_async_views(self):
+        # every request would run on a new event loop and leave its async clients behind
+        env = {**os.environ, "FORECAST_ASYNC_VIEWS": "1"}
+        result = subprocess.run(
+            [sys.executable, "-c", "import config.wsgi"],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("ImproperlyConfigured", result.stderr)
+
+
+def geonames_row(name: str, latitude: float, longitude: float, population: int, *alternate_names: str):
+    return geoindex.GeoNamesRow(
+        name, name, list(alternate_names), latitude, longitude, "XX", population, "Europe/Berlin"
+    )
+
+
+class GeoIndexTestCase(SimpleTestCase):
+    def build(self, *rows: geoindex.GeoNamesRow) -> geoindex.CityIndex:
+        geoindex.build_index(rows, self.path)
+        index = geoindex.CityIndex(self.path)
+        self.addCleanup(index.close)
+        return index
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = Path(tmp_dir.name) / "cities.idx"
+
+
+class GeoIndexBuildTests(GeoIndexTestCase):
+    def test_rebuild_leaves_mapped_index_intact(self):
+        old = self.build(geonames_row("Berlin", 52.52, 13.41, 3_400_000))
+        new = self.build(geonames_row("Paris", 48.86, 2.35, 2_100_000))
+        self.assertEqual(old.lookup("berlin").name, "Berlin")
+        self.assertIsNone(old.lookup("paris"))
+        self.assertEqual(new.lookup("paris").name, "Paris")
+        self.assertEqual(os.listdir(self.path.parent), [self.path.name])
+
+    def test_failed_build_keeps_previous_index(self):
+        self.build(geonames_row("Berlin", 52.52, 13.41, 3_400_000))
+        paris = geonames_row("Paris", 48.86, 2.35, 2_100_000)
+        with mock.patch.object(os, "fsync", side_effect=OSError("no space left")), self.assertRaises(OSError):
+            geoindex.build_index([paris], self.path)
+        self.assertEqual(geoindex.CityIndex(self.path).lookup("berlin").name, "Berlin")
+        self.assertEqual(os.listdir(self.path.parent), [self.path.name])
+
+
+class CityIndexTests(GeoIndexTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = self.build(
+            geonames_row("München", 48.137, 11.575, 1_500_000, "Munich", "Monaco di Baviera")._replace(
+                ascii_name="Muenchen"
+            ),
+            geonames_row("Springfield", 39.80, -89.64, 114_000),
+            geonames_row("Springfield", 37.21, -93.29, 169_000),
+            geonames_row("Spring", 30.08, -95.42, 62_000),
+            geonames_row("Munster", 51.96, 7.63, 315_000),
+            # on both sides of the antimeridian
+            geonames_row("Suva", -18.14, 178.44, 77_000),
+            geonames_row("Somosomo", -16.77, -179.97, 1_000),
+        )
+
+    def test_rejects_other_files(self):
+        other = self.path.with_name("other.idx")
+        other.write_bytes(b"\0" * 64)
+        with self.assertRaises(geoindex.GeoIndexError):
+            geoindex.CityIndex(other)
+        self.assertIsNone(geoindex.CityIndex.open(self.path.with_name("missing.idx")))
+
+    def test_lookup_is_case_accent_and_alias_insensitive(self):
+        for query in ("München", "MUNCHEN", "muenchen", "munich", "monaco-di  baviera"):
+            with self.subTest(query=query):
+                city = self.index.lookup(query)
+                self.assertEqual((city.name, city.timezone), ("München", "Europe/Berlin"))
+        self.assertIsNone(self.index.lookup("Munic"))
+        self.assertIsNone(self.index.lookup("  "))
+
+    def test_lookup_prefers_the_most_populous_namesake(self):
+        self.assertEqual(self.index.lookup("springfield").latitude, 37.21)
+
+    def test_prefix_search_ranks_by_population(self):
+        cities = self.index.search_prefix("spr")
+        self.assertEqual(
+            [(city.name, city.population) for city in cities],
+            [("Springfield", 169_000), ("Springfield", 114_000), ("Spring", 62_000)],
+        )
+        self.assertEqual(len(self.index.search_prefix("spr", limit=2)), 2)
+        self.assertEqual(self.index.search_prefix(""), [])
+        self.assertEqual(self.index.search_prefix("xyz"), [])
+
+    def test_prefix_search_returns_a_city_once_whatever_the_names_matched(self):
+        # München, Muenchen and Munich all start with "mu"
+        self.assertEqual([city.name for city in self.index.search_prefix("mu")], ["München", "Munster"])
+
+    def test_nearest(self):
+        self.assertEqual(self.index.nearest(48.2, 11.6).name, "München")
+        self.assertIsNone(self.index.nearest(48.2, 11.6, max_distance_km=1))
+
+    def test_nearest_searches_neighbouring_cells(self):
+        # the cell of the point has no city, München is in the next one
+        self.assertEqual(geoindex.grid_cell(47.99, 11.5), (137, 191))
+        self.assertEqual(self.index.nearest(47.99, 11.5, max_distance_km=30).name, "München")
+        self.assertIsNone(self.index.nearest(0.0, -30.0, max_distance_km=500))
+
+    def test_nearest_wraps_around_the_antimeridian(self):
+        self.assertEqual(self.index.nearest(-18.5, -179.9, max_distance_km=200).name, "Suva")
+        self.assertEqual(self.index.nearest(-16.77, 179.95, max_distance_km=10).name, "Somosomo")
+
+
+class AutocompleteViewTests(GeoIndexTestCase):
+    def setUp(self):
+        super().setUp()
+        index = self.build(
+            geonames_row("Berlin", 52.52, 13.41, 3_400_000), geonames_row("Bern", 46.95, 7.45, 134_000)
+        )
+        self.use_index(index)
+
+    def use_index(self, index: geoindex.CityIndex | None) -> None:
+        for name, value in (("_city_index", index), ("_city_index_loaded", True)):
+            patcher = mock.patch.object(deps.container, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_results(self):
+        response = self.client.get("/forecast/autocomplete/", {"q": "ber", "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"],
+            [{"name": "Berlin", "country_code": "XX", "latitude": 52.52, "longitude": 13.41}],
+        )
+        response = self.client.get("/forecast/autocomplete/", {"q": " "})
+        self.assertEqual(response.json(), {"results": []})
+
+    def test_invalid_limit(self):
+        for limit in ("ten", "0", "-1"):
+            with self.subTest(limit=limit):
+                response = self.client.get("/forecast/autocomplete/", {"q": "ber", "limit": limit})
+                self.assertEqual(response.status_code, 400)
+
+    def test_unavailable_without_index(self):
+        self.use_index(None)
+        self.assertEqual(self.client.get("/forecast/autocomplete/", {"q": "ber"}).status_code, 503)
+
+
+class GeoGridTests(SimpleTestCase):
+    def test_encode(self):
+        self.assertEqual(geogrid.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(geogrid.encode(-25.38262, -49.26561, 8), "6gkzwgjz")
+
+    def test_snap_to_cell_center(self):
+        south, north, west, east = geogrid.bounds("u33dc")
+        self.assertEqual(geogrid.snap(52.52, 13.41, 5), geogrid.snap(52.53, 13.43, 5))
+        latitude, longitude = geogrid.snap(52.52, 13.41, 5)
+        self.assertTrue(south < latitude < north and west < longitude < east)
+        self.assertEqual(geogrid.encode(latitude, longitude, 5), "u33dc")
+        self.assertEqual(geogrid.snap(52.52, 13.41, 0), (52.52, 13.41))
+
+
+class GridSnappingTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubUpstream().start()
+        self.addCleanup(self.stub.stop)
+        self.client = api_client.OpenMeteoApiClient(
+            forecast_url=self.stub.forecast_url, geodata_url=self.stub.geodata_url, cache_backend="memory"
+        )
+        self.addCleanup(self.client.close)
+        self.reverse_geocoder = mock.Mock(spec=api_client.ReverseGeocoder)
+
+    def make_service(self, grid_precision: int) -> sv.ForecastService:
+        return sv.ForecastService(
+            mock.Mock(), None, self.client, self.reverse_geocoder, grid_precision=grid_precision
+        )
+
+    def test_nearby_coordinates_and_city_name_share_a_forecast(self):
+        service = self.make_service(5)
+        geo_data = self.client.get_geodata_by_city("Berlin")
+        self.reverse_geocoder.get_city.return_value = ("Berlin", geo_data.timezone)
+        day = date.today()
+        by_name = service.get_hourly_forecast_for_dates(day, day, city_name="Berlin")
+        requests = self.stub.requests
+        # a few hundred meters away from the geocoded city, in the same cell
+        near = geogrid.snap(geo_data.latitude, geo_data.longitude, 5)
+        coords = sv.Coords(str(near[0] + 0.002), str(near[1] - 0.003))
+        by_coords = service.get_hourly_forecast_for_dates(day, day, coords=coords)
+        self.assertEqual(self.stub.requests, requests)
+        self.assertEqual(by_coords[:2], by_name[:2])
+
+    def test_without_grid_coordinates_are_used_as_is(self):
+        service = self.make_service(0)
+        self.reverse_geocoder.get_city.return_value = ("Berlin", "UTC")
+        day = date.today()
+        service.get_hourly_forecast_for_dates(day, day, coords=sv.Coords("52.52", "13.41"))
+        requests = self.stub.requests
+        service.get_hourly_forecast_for_dates(day, day, coords=sv.Coords("52.521", "13.41"))
+        self.assertEqual(self.stub.requests, requests + 1)
+
+
+class ParallelPipelineTests(SimpleTestCase):
+    """Coordinates missing from the local index are reverse geocoded while the forecast is fetched."""
+
+    DELAY = 0.3
+
+    def setUp(self):
+        self.client = mock.Mock(spec=api_client.OpenMeteoApiClient)
+        self.reverse_geocoder = mock.Mock(spec=api_client.ReverseGeocoder, asks_upstream=True)
+        self.reverse_geocoder.get_local_city.return_value = None
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.service = sv.ForecastService(
+            mock.Mock(), None, self.client, self.reverse_geocoder, self.executor
+        )
+
+    def slow(self, result):
+        def call(*args, **kwargs):
+            time.sleep(self.DELAY)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return call
+
+    def test_latency_is_the_slower_call(self):
+        self.reverse_geocoder.get_city.side_effect = self.slow(("Berlin", "UTC"))
+        self.client.get_daily_forecast.side_effect = self.slow("daily")
+        self.client.get_hourly_forecast_for_dates.side_effect = self.slow("hourly")
+        start = time.perf_counter()
+        daily, hourly, city, _ = self.service.get_daily_and_hourly_forecast(
+            7, date.today(), mock.Mock(), coords=sv.Coords("52.52", "13.41")
+        )
+        self.assertLess(time.perf_counter() - start, 2 * self.DELAY)
+        self.assertEqual((daily, hourly, city), ("daily", "hourly", "Berlin"))
+
+    def test_failure_doesnt_wait_for_the_other_calls(self):
+        self.reverse_geocoder.get_city.side_effect = api_client.CoordinatesNotFoundError
+        self.client.get_daily_forecast.side_effect = self.slow("daily")
+        start = time.perf_counter()
+        with self.assertRaises(api_client.CoordinatesNotFoundError):
+            self.service.get_daily_forecast(7, mock.Mock(), coords=sv.Coords("52.52", "13.41"))
+        self.assertLess(time.perf_counter() - start, self.DELAY)
+
+    def test_local_city_gives_the_timezone(self):
+        self.reverse_geocoder.get_local_city.return_value = ("Berlin", "Europe/Berlin")
+        self.reverse_geocoder.get_city.return_value = ("Berlin", "Europe/Berlin")
+        self.client.get_daily_forecast.return_value = "daily"
+        self.service.get_daily_forecast(7, mock.Mock(), coords=sv.Coords("52.52", "13.41"))
+        geo_data = self.client.get_daily_forecast.call_args.args[0]
+        self.assertEqual(geo_data.timezone, "Europe/Berlin")
+
+    def test_async_latency_and_cancellation(self):
+        client = mock.Mock(spec=api_client.AsyncOpenMeteoApiClient)
+        cancelled = []
+
+        async def daily(*args, **kwargs):
+            try:
+                await asyncio.sleep(self.DELAY)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "daily"
+
+        client.get_daily_forecast.side_effect = daily
+        service = sv.AsyncForecastService(
+            mock.Mock(), None, client, self.reverse_geocoder, executor=self.executor
+        )
+        self.reverse_geocoder.get_city.side_effect = self.slow(("Berlin", "UTC"))
+        with mock.patch.object(service, "register_search", mock.AsyncMock()):
+            start = time.perf_counter()
+            forecast, city, _ = async_to_sync(service.get_daily_forecast)(
+                7, mock.Mock(), coords=sv.Coords("52.52", "13.41")
+            )
+            self.assertLess(time.perf_counter() - start, 2 * self.DELAY)
+            self.assertEqual((forecast, city), ("daily", "Berlin"))
+            self.reverse_geocoder.get_city.side_effect = api_client.CoordinatesNotFoundError
+            with self.assertRaises(api_client.CoordinatesNotFoundError):
+                async_to_sync(service.get_daily_forecast)(
+                    7, mock.Mock(), coords=sv.Coords("52.52", "13.41")
+                )
+        self.assertEqual(cancelled, [True])
+
+
+class MemoryHistoryStoreTests(SimpleTestCase):
+    def test_move_to_front_and_cap(self):
+        store = sh.MemoryHistoryStore(max_length=3)
+        for city in ("Berlin", "Paris", "Rome", "Berlin", "Oslo"):
+            store.push("visitor", city)
+        self.assertEqual(store.get("visitor"), ["Rome", "Berlin", "Oslo"])
+        self.assertEqual(store.get("someone else"), [])
+
+
+class FlakyCitiesCountRepository:
+    """In-memory backing store whose first `failures` writes raise."""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.counts: collections.Counter[str] = collections.Counter()
+        self.failures = failures
+        self.writes = 0
+
+    def create_or_incr(self, city_name: str) -> None:
+        self.incr_many({city_name: 1})
+
+    def incr_many(self, counts: t.Mapping[str, int]) -> None:
+        self.writes += 1
+        if self.writes <= self.failures:
+            raise redis.ConnectionError("store down")
+        self.counts.update(counts)
+
+    def count(self, window: str | None = None) -> int:
+        return len(self.counts)
+
+    def get_ranked(self, offset: int, limit: int, window: str | None = None) -> list[dm.CitiesCountDTO]:
+        ranked = self.counts.most_common()[offset:offset + limit]
+        return [dm.CitiesCountDTO(name, count, rank) for rank, (name, count) in enumerate(ranked, offset + 1)]
+
+    def get_all(self) -> list[dm.CitiesCountDTO]:
+        return [dm.CitiesCountDTO(name, count) for name, count in self.counts.items()]
+
+
+class BufferedCitiesCountRepositoryTests(SimpleTestCase):
+    def setUp(self):
+        # buffers of a test must not be flushed by another test's close_buffers
+        patcher = mock.patch.object(repositories, "_buffers", [])
+        self.registered = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def buffer(self, store: FlakyCitiesCountRepository, **kwargs):
+        buffer = repositories.BufferedCitiesCountRepository(store, **{"flush_interval": 60, **kwargs})
+        self.addCleanup(buffer.close, timeout=1)
+        return buffer
+
+    def search(self, buffer: repositories.BufferedCitiesCountRepository, *cities: str) -> None:
+        for city in cities:
+            buffer.create_or_incr(city)
+
+    def test_failed_flush_is_restored_and_retried(self):
+        store = FlakyCitiesCountRepository(failures=1)
+        buffer = self.buffer(store)
+        self.search(buffer, "Berlin", "Berlin", "Paris")
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.stats.failed_flushes, 1)
+        self.assertEqual(store.counts, {})
+        # the increments are back in the buffer, merged with the ones counted since
+        self.search(buffer, "Berlin")
+        self.assertCountEqual(
+            buffer.get_all(), [dm.CitiesCountDTO("Berlin", 3), dm.CitiesCountDTO("Paris", 1)]
+        )
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(store.counts, {"Berlin": 3, "Paris": 1})
+        self.assertEqual((buffer.stats.flushes, buffer.stats.flushed), (1, 4))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_reads_add_the_pending_increments(self):
+        store = FlakyCitiesCountRepository()
+        store.counts.update({"Berlin": 2})
+        buffer = self.buffer(store)
+        self.search(buffer, "Berlin", "Oslo")
+        self.assertCountEqual(
+            buffer.get_all(), [dm.CitiesCountDTO("Berlin", 3), dm.CitiesCountDTO("Oslo", 1)]
+        )
+        self.assertEqual(store.counts, {"Berlin": 2})
+
+    def test_thread_flushes_when_flush_size_is_reached(self):
+        store = FlakyCitiesCountRepository()
+        buffer = self.buffer(store, flush_size=3)
+        self.search(buffer, "Berlin", "Paris")
+        time.sleep(0.05)
+        self.assertEqual(store.counts, {})
+        self.search(buffer, "Berlin")
+        wait_until(lambda: store.counts == {"Berlin": 2, "Paris": 1})
+        self.assertEqual(buffer.stats.last_flush_size, 3)
+
+    def test_thread_flushes_every_interval(self):
+        store = FlakyCitiesCountRepository(failures=1)
+        buffer = self.buffer(store, flush_interval=0.01)
+        self.search(buffer, "Berlin")
+        # the first write fails, the next tick writes the restored increment
+        wait_until(lambda: store.counts == {"Berlin": 1})
+        self.assertEqual((buffer.stats.failed_flushes, buffer.stats.flushed), (1, 1))
+
+    def test_max_pending_drops_newer_increments(self):
+        store = FlakyCitiesCountRepository(failures=1)
+        buffer = self.buffer(store, max_pending=2)
+        self.search(buffer, "Berlin", "Paris", "Rome")
+        self.assertEqual(buffer.stats.dropped, 1)
+        # restored increments still count against the limit
+        buffer.flush()
+        self.search(buffer, "Oslo")
+        self.assertEqual(buffer.stats.dropped, 2)
+        self.assertEqual(buffer.flush(), 2)
+        self.search(buffer, "Oslo")
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(store.counts, {"Berlin": 1, "Paris": 1, "Oslo": 1})
+
+    def test_close_buffers_writes_pending_increments(self):
+        stores = [FlakyCitiesCountRepository(), FlakyCitiesCountRepository()]
+        buffers = [self.buffer(store) for store in stores]
+        self.search(buffers[0], "Berlin")
+        self.search(buffers[1], "Paris", "Paris")
+        self.assertEqual(self.registered, buffers)
+        repositories.close_buffers()
+        self.assertEqual([store.counts for store in stores], [{"Berlin": 1}, {"Paris": 2}])
+        self.assertEqual(self.registered, [])
+        self.assertFalse(any(buffer._thread.is_alive() for buffer in buffers))
+        # a closed buffer keeps counting, but only close() writes
+        self.search(buffers[0], "Berlin")
+        buffers[0].close()
+        self.assertEqual(stores[0].counts, {"Berlin": 2})
+
+    def test_forked_child_forgets_the_parent_buffers(self):
+        store = FlakyCitiesCountRepository()
+        self.search(self.buffer(store), "Berlin")
+        self.assertEqual(len(self.registered), 1)
+        lock = repositories._buffers_lock
+        self.addCleanup(setattr, repositories, "_buffers_lock", lock)
+        repositories._forget_buffers()
+        self.assertEqual(self.registered, [])
+        self.assertIsNot(repositories._buffers_lock, lock)
+        # the child exits without writing the increments counted by its parent
+        repositories.close_buffers()
+        self.assertEqual(store.counts, {})
+
+
+class CitiesCountRepositoryRedisTests(SimpleTestCase):
+    HOUR, DAY = 3600, 86400
+
+    def setUp(self):
+        self.db = fakeredis.FakeRedis(decode_responses=True)
+        with mock.patch.object(core_redis, "get_default_connection", return_value=self.db):
+            self.repo = repositories.CitiesCountRepositoryRedis()
+        self.clock = FakeClock()
+        self.clock.now = 1_700_000_000.0
+        patcher = mock.patch.object(repositories, "time", mock.Mock(time=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ranking(self, window: str | None = None) -> list[tuple[str, int]]:
+        return [(dto.name, dto.count) for dto in self.repo.get_ranked(0, 10, window)]
+
+    def test_windows_rank_only_their_buckets(self):
+        now = self.clock.now
+        self.repo.incr_many({"Berlin": 3, "Paris": 1}, now=now)
+        self.repo.incr_many({"Paris": 5}, now=now - 2 * self.HOUR)
+        self.repo.incr_many({"Rome": 9}, now=now - 2 * self.DAY)
+        self.assertEqual(self.ranking("hour"), [("Berlin", 3), ("Paris", 1)])
+        self.assertEqual(self.ranking("day"), [("Paris", 6), ("Berlin", 3)])
+        self.assertEqual(self.ranking(), [("Rome", 9), ("Paris", 6), ("Berlin", 3)])
+        self.assertEqual([self.repo.count(w) for w in ("hour", "day", None)], [2, 2, 3])
+        self.assertEqual([dto.rank for dto in self.repo.get_ranked(1, 2, "day")], [2])
+
+    def test_window_edges(self):
+        bucket_seconds, buckets = repositories.WINDOWS["hour"]
+        current = self.clock.now // bucket_seconds * bucket_seconds
+        self.repo.incr_many({"Berlin": 1}, now=current - (buckets - 1) * bucket_seconds)
+        self.repo.incr_many({"Paris": 1}, now=current - buckets * bucket_seconds)
+        self.assertEqual(self.ranking("hour"), [("Berlin", 1)])
+
+    def test_buckets_expire_after_their_window(self):
+        self.repo.incr_many({"Berlin": 1}, now=self.clock.now)
+        for window, (bucket_seconds, buckets) in repositories.WINDOWS.items():
+            key = self.repo._bucket_key(window, int(self.clock.now // bucket_seconds))
+            self.assertEqual(self.db.zscore(key, "Berlin"), 1)
+            self.assertTrue(buckets * bucket_seconds < self.db.ttl(key) <= (buckets + 1) * bucket_seconds)
+        self.assertEqual(self.db.ttl(repositories.CITIES_RANK_KEY), -1)
+
+    def test_window_ranking_is_cached(self):
+        self.repo.incr_many({"Berlin": 1}, now=self.clock.now)
+        self.assertEqual(self.ranking("hour"), [("Berlin", 1)])
+        key = self.repo._ranking_key("hour")
+        self.assertTrue(0 < self.db.ttl(key) <= repositories.WINDOW_CACHE_TTL)
+        # increments show up in the window once the cached union expires
+        self.repo.incr_many({"Paris": 2}, now=self.clock.now)
+        self.assertEqual(self.ranking("hour"), [("Berlin", 1)])
+        self.assertEqual(self.ranking(), [("Paris", 2), ("Berlin", 1)])
+        self.db.delete(key)
+        self.assertEqual(self.ranking("hour"), [("Paris", 2), ("Berlin", 1)])
+
+    def test_batched_increments_go_out_when_the_batch_ends(self):
+        with core_redis.batched():
+            self.repo.incr_many({"Berlin": 1}, now=self.clock.now)
+            self.repo.incr_many({"Berlin": 1}, now=self.clock.now)
+            self.assertEqual(self.db.zscore(repositories.CITIES_RANK_KEY, "Berlin"), None)
+        self.assertEqual(self.ranking(), [("Berlin", 2)])
+
+    def test_unknown_window(self):
+        with self.assertRaisesMessage(ValueError, "Unknown window 'week'"):
+            self.repo.get_ranked(0, 10, "week")
+
+
+def zipf_stream(keys: int, length: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    return rng.choices([f"city-{rank}" for rank in range(keys)], weights=weights, k=length)
+
+
+class SketchTests(SimpleTestCase):
+    EPSILON, DELTA = 0.01, 0.01
+
+    def test_count_min_error_bounds(self):
+        stream = zipf_stream(2000, 20_000, seed=1)
+        cms = sketch.CountMinSketch.from_error(self.EPSILON, self.DELTA)
+        for key in stream:
+            cms.add(key)
+        counts = collections.Counter(stream)
+        errors = [cms.estimate(key) - count for key, count in counts.items()]
+        self.assertEqual(cms.total, len(stream))
+        self.assertGreaterEqual(min(errors), 0)
+        over_bound = sum(error > self.EPSILON * len(stream) for error in errors)
+        self.assertLessEqual(over_bound, self.DELTA * len(counts))
+
+    def test_merge_equals_the_sketch_of_the_concatenated_stream(self):
+        first, second = zipf_stream(500, 3000, seed=2), zipf_stream(500, 3000, seed=3)
+        left, right, whole = (
+            sketch.CountMinSketch.from_error(self.EPSILON, self.DELTA) for _ in range(3)
+        )
+        for key in first:
+            left.add(key)
+        for key in second:
+            right.add(key)
+        for key in first + second:
+            whole.add(key)
+        left.merge(right)
+        self.assertEqual((left.cells, left.total), (whole.cells, whole.total))
+        with self.assertRaises(ValueError):
+            left.merge(sketch.CountMinSketch(left.width + 1, left.depth))
+
+    def test_space_saving_evicts_the_smallest_counter(self):
+        summary = sketch.SpaceSaving(3)
+        for key in ["Berlin"] * 5 + ["Paris"] * 3 + ["Rome"] * 2:
+            summary.add(key)
+        summary.add("Oslo")
+        # Rome had the smallest count, Oslo takes over its counter and records it as the error
+        self.assertEqual(summary.top(), [("Berlin", 5, 0), ("Paris", 3, 0), ("Oslo", 3, 2)])
+        summary.add("Rome", 4)
+        self.assertEqual(summary.top(1), [("Rome", 7, 3)])
+        self.assertEqual(len(summary), 3)
+
+    def test_space_saving_keeps_the_frequent_keys(self):
+        stream = zipf_stream(1000, 20_000, seed=4)
+        capacity = 50
+        summary = sketch.SpaceSaving(capacity)
+        for key in stream:
+            summary.add(key)
+        counts = collections.Counter(stream)
+        for key, count, error in summary.top():
+            self.assertTrue(count - error <= counts[key] <= count)
+        frequent = {key for key, count in counts.items() if count > len(stream) / capacity}
+        self.assertTrue(frequent)
+        self.assertLessEqual(frequent, set(summary.counts))
+
+    def test_heavy_hitters_rank_by_the_sketch_estimate(self):
+        summary = sketch.HeavyHitters(self.EPSILON, self.DELTA, capacity=2)
+        for key in ["Berlin"] * 5 + ["Paris"] * 3 + ["Rome"]:
+            summary.add(key)
+        # Rome took over the counter of Paris, the sketch doesn't inherit its count
+        self.assertEqual(summary.candidates.counts, {"Berlin": 5, "Rome": 4})
+        self.assertEqual(summary.top(), [("Berlin", 5), ("Rome", 1)])
+        self.assertEqual(summary.estimate("Paris"), 3)
+
+
+class CitiesCountSketchRedisTests(SimpleTestCase):
+    EPSILON, DELTA = 0.01, 0.01
+
+    def setUp(self):
+        self.db = fakeredis.FakeRedis(decode_responses=True)
+        with mock.patch.object(core_redis, "get_default_connection", return_value=self.db):
+            self.store = repositories.CitiesCountSketchRedis(self.EPSILON, self.DELTA, top_k=3)
+
+    def summary(self, stream: list[str], capacity: int = 10) -> sketch.HeavyHitters:
+        summary = sketch.HeavyHitters(self.EPSILON, self.DELTA, capacity)
+        for key in stream:
+            summary.add(key)
+        return summary
+
+    def test_merged_summaries_equal_the_sketch_of_the_concatenated_stream(self):
+        first, second = zipf_stream(200, 2000, seed=5), zipf_stream(200, 2000, seed=6)
+        self.store.merge(self.summary(first))
+        self.store.merge(self.summary(second))
+        whole = self.summary(first + second, capacity=200)
+        self.assertEqual(self.store.total(), len(first) + len(second))
+        for key in set(first + second):
+            self.assertEqual(self.store.estimate(key), whole.estimate(key))
+        ranked = self.store.get_all()
+        self.assertEqual([(dto.name, dto.count) for dto in ranked], whole.top(3))
+        self.assertEqual([dto.rank for dto in ranked], [1, 2, 3])
+        self.assertEqual(self.store.count(), 3)
+
+    def test_candidates_are_rescored_with_the_global_estimate(self):
+        self.store.merge(self.summary(["Berlin"] * 2 + ["Paris"] * 3))
+        # Paris takes over the only counter of the second worker, Berlin is rescored anyway
+        self.store.merge(self.summary(["Berlin"] * 4 + ["Paris"], capacity=1))
+        ranked = [(dto.name, dto.count) for dto in self.store.get_all()]
+        self.assertEqual(ranked, [("Berlin", 6), ("Paris", 4)])
+
+    def test_cells_saturate(self):
+        index = sketch.cell_indexes("Berlin", self.store.width, self.store.depth)[0]
+        self.db.bitfield(self.store.key).set("u32", f"#{index}", 2**32 - 2).execute()
+        self.store.merge(self.summary(["Berlin"] * 3))
+        cell = self.db.bitfield(self.store.key).get("u32", f"#{index}").execute()
+        self.assertEqual(cell, [2**32 - 1])
+        self.assertEqual(self.store.estimate("Berlin"), 3)
+
+    def test_dimensions_must_match(self):
+        with self.assertRaises(ValueError):
+            self.store.merge(sketch.HeavyHitters(self.EPSILON / 2, self.DELTA, 10))
+        with self.assertRaisesMessage(ValueError, "window"):
+            self.store.get_ranked(0, 10, "hour")
+
+
+class IdleConnection(redis.Connection):
+    """Connection that never touches the network."""
+
+    def connect(self, *args, **kwargs) -> None:
+        pass
+
+    def can_read(self, *args, **kwargs) -> bool:
+        return False
+
+
+class RedisPoolTests(SimpleTestCase):
+    def sample(self, name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_exhaustion_and_round_trip_are_observed(self):
+        pool = core_redis.BlockingConnectionPool(
+            name="test", max_connections=1, timeout=0.01, connection_class=IdleConnection
+        )
+        exhausted = self.sample("redis_pool_exhausted_total", pool="test")
+        round_trips = self.sample("redis_round_trip_seconds_count", pool="test")
+        connection = pool.get_connection("GET")
+        with self.assertRaisesMessage(redis.ConnectionError, core_redis.NO_CONNECTION_AVAILABLE):
+            pool.get_connection("GET")
+        self.assertEqual(self.sample("redis_pool_exhausted_total", pool="test"), exhausted + 1)
+        pool.release(connection)
+        self.assertEqual(
+            self.sample("redis_round_trip_seconds_count", pool="test"), round_trips + 1
+        )
+        self.assertEqual(self.sample("redis_pool_wait_seconds_count", pool="test"), 2)
+
+    def test_batched_writes_share_one_pipeline_per_pool(self):
+        shared, other = mock.Mock(), mock.Mock()
+        first, second = mock.Mock(connection_pool=shared), mock.Mock(connection_pool=shared)
+        third = mock.Mock(connection_pool=other)
+        with core_redis.batched():
+            for connection in (first, second, third):
+                with core_redis.write(connection) as pipe:
+                    pipe.incr("key")
+            with core_redis.batched():
+                with core_redis.write(second) as pipe:
+                    pipe.incr("key")
+            first.pipeline.return_value.execute.assert_not_called()
+        second.pipeline.assert_not_called()
+        self.assertEqual(first.pipeline.return_value.incr.call_count, 3)
+        first.pipeline.return_value.execute.assert_called_once_with()
+        third.pipeline.return_value.execute.assert_called_once_with()
+
+    def test_writes_of_a_failed_batch_are_dropped(self):
+        connection = mock.Mock()
+        with self.assertRaises(ValueError), core_redis.batched():
+            with core_redis.write(connection) as pipe:
+                pipe.incr("key")
+            raise ValueError
+        connection.pipeline.return_value.execute.assert_not_called()
+        with core_redis.write(connection) as pipe:
+            pipe.incr("key")
+        connection.pipeline.return_value.execute.assert_called_once_with()
+
+
+@override_settings(FORECAST_PAYLOAD_CACHE_ENABLED=False)
+class StubServiceTestCase(SimpleTestCase):
+    """Views served by a forecast service whose upstream is a `StubUpstream`."""
+
+    def setUp(self):
+        self.stub = stub = StubUpstream().start()
+        self.addCleanup(stub.stop)
+        client = api_client.OpenMeteoApiClient(
+            forecast_url=stub.forecast_url, geodata_url=stub.geodata_url, cache_backend="memory"
+        )
+        self.addCleanup(client.close)
+        service = sv.ForecastService(mock.Mock(), None, client, mock.Mock(spec=api_client.ReverseGeocoder))
+        for name, value in (("_forecast_service", service), ("_history_store", sh.MemoryHistoryStore())):
+            patcher = mock.patch.object(deps.container, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def search(self, city: str):
+        response = self.client.get("/forecast/daily/", {"location": city, "duration_days": 1})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class PayloadCacheTests(SimpleTestCase):
+    def test_keys_are_normalized(self):
+        cache = pc.PayloadCache()
+        key = cache.key("daily", "München", duration_days=7, hourly_date="2024-05-01")
+        self.assertEqual(cache.key("daily", "  MUNCHEN ", hourly_date="2024-05-01", duration_days=7), key)
+        self.assertNotEqual(cache.key("daily", "München", duration_days=6, hourly_date="2024-05-01"), key)
+        self.assertNotEqual(cache.key("hourly", "München", duration_days=7, hourly_date="2024-05-01"), key)
+        self.assertIsNone(cache.key("daily", None, duration_days=7))
+        self.assertIsNone(cache.key("daily", None, sv.Coords("north", "13.4"), duration_days=7))
+
+    def test_coordinates_are_rounded_or_snapped_to_a_cell(self):
+        cache = pc.PayloadCache()
+        key = cache.key("daily", None, sv.Coords("52.52001", "13.40999"))
+        self.assertEqual(cache.key("daily", None, sv.Coords("52.52", "13.41")), key)
+        self.assertNotEqual(cache.key("daily", None, sv.Coords("52.53", "13.41")), key)
+        # both points are in the same ~5 km cell
+        cache = pc.PayloadCache(grid_precision=5)
+        self.assertEqual(
+            cache.key("daily", None, sv.Coords("52.52", "13.41")),
+            cache.key("daily", None, sv.Coords("52.521", "13.412")),
+        )
+
+    def test_entries_expire_with_the_model_update(self):
+        cache = pc.PayloadCache(update_interval=3600, update_offset=600)
+        self.assertEqual(cache.ttl(now=3600 * 10 + 600), 3600)
+        self.assertEqual(cache.ttl(now=3600 * 10 + 500), 100)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_entries_expire_with_the_freshness_of_their_forecast(self):
+        cache = pc.PayloadCache(update_interval=3600, fresh_for=900)
+        with mock.patch.object(pc, "time", mock.Mock(time=mock.Mock(return_value=3600 * 10))):
+            entry = cache.set("key", b"{}", "Berlin", age=600)
+            self.assertEqual((entry.max_age, entry.age), (300, 600))
+            self.assertEqual(cache.get("key"), entry)
+            # not capped without a stale cache
+            self.assertEqual(pc.PayloadCache(update_interval=3600).set("key", b"{}", "Berlin").max_age, 3600)
+
+    def test_etag_matches(self):
+        etag = pc.make_etag(b"{}")
+        self.assertTrue(pc.etag_matches(etag, etag))
+        self.assertTrue(pc.etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(pc.etag_matches("*", etag))
+        self.assertFalse(pc.etag_matches('"other"', etag))
+        self.assertFalse(pc.etag_matches(None, etag))
+
+
+class InlineExecutor:
+    """Runs submitted calls right away, so background refreshes are done when `submit` returns."""
+
+    def __init__(self) -> None:
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        fn(*args)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class StaleCacheTests(SimpleTestCase):
+    KEY = "forecast_stale:daily:test"
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 1_700_000_000.0
+        self.executor = InlineExecutor()
+        self.cache = sc.StaleCache(
+            fresh_for=900, stale_while_revalidate=600, stale_if_error=3600,
+            executor=self.executor, clock=self.clock,
+        )
+        self.cache.cache.clear()
+        self.cache.put(self.KEY, "cached")
+        self.fetch = mock.Mock(return_value="fetched")
+
+    def get(self, after: float):
+        self.clock.now += after
+        return self.cache.get(self.KEY, self.fetch)
+
+    def test_keys_tell_timezones_apart(self):
+        local = api_client.GeoData(52.52, 13.41, "Europe/Berlin")
+        key = sc.StaleCache.key("daily", local, 7)
+        self.assertEqual(sc.StaleCache.key("daily", api_client.GeoData(*local), 7), key)
+        self.assertNotEqual(sc.StaleCache.key("daily", local._replace(timezone="UTC"), 7), key)
+
+    def test_fresh_entry_is_served_as_is(self):
+        self.assertEqual(self.get(899), ("cached", sc.Freshness(sc.FRESH, 899)))
+        self.fetch.assert_not_called()
+
+    def test_stale_entry_is_served_while_it_is_refreshed(self):
+        self.assertEqual(self.get(900), ("cached", sc.Freshness(sc.STALE, 900)))
+        self.assertEqual(self.executor.submitted, 1)
+        self.assertEqual(self.get(10), ("fetched", sc.Freshness(sc.FRESH, 10)))
+        self.fetch.assert_called_once()
+
+    def test_one_refresh_at_a_time(self):
+        self.cache.executor = mock.Mock()
+        for after in (900, 1, 1):
+            self.assertEqual(self.get(after)[1].state, sc.STALE)
+        self.cache.executor.submit.assert_called_once()
+
+    def test_expired_entry_is_fetched_before_answering(self):
+        self.assertEqual(self.get(1500), ("fetched", sc.Freshness()))
+        self.assertEqual(self.executor.submitted, 0)
+        self.assertEqual(self.get(0), ("fetched", sc.Freshness(sc.FRESH, 0)))
+        # nothing cached yet is expired as well
+        self.assertEqual(self.cache.get("other", lambda: "new"), ("new", sc.Freshness()))
+
+    def test_stale_if_error(self):
+        self.fetch.side_effect = api_client.ForecastApiError("upstream down")
+        with self.assertLogs("forecast.stale_cache", "WARNING"):
+            self.assertEqual(self.get(4499), ("cached", sc.Freshness(sc.STALE_IF_ERROR, 4499)))
+        with self.assertRaises(api_client.ForecastApiError):
+            self.get(1)
+        with self.assertRaises(api_client.ForecastApiError):
+            self.cache.get("other", self.fetch)
+
+    def test_failed_refresh_keeps_the_stale_entry(self):
+        self.fetch.side_effect = api_client.ForecastApiError("upstream down")
+        with self.assertLogs("forecast.stale_cache", "WARNING"):
+            self.assertEqual(self.get(900)[0], "cached")
+        # the next request tries again
+        self.fetch.side_effect = None
+        self.assertEqual(self.get(1)[1].state, sc.STALE)
+        self.assertEqual(self.get(0), ("fetched", sc.Freshness()))
+
+    def test_unexpected_refresh_error_is_logged(self):
+        self.fetch.side_effect = KeyError("time")
+        with self.assertLogs("forecast.stale_cache", "ERROR") as logs:
+            self.assertEqual(self.get(900)[0], "cached")
+        self.assertIn("KeyError", logs.output[0])
+        self.assertEqual(self.cache._refreshing, set())
+
+    def test_async_states_and_refresh_errors(self):
+        async def fetch():
+            return self.fetch()
+
+        async def get(after: float):
+            self.clock.now += after
+            result = await self.cache.aget(self.KEY, fetch)
+            await asyncio.gather(*self.cache._tasks)
+            return result
+
+        async def main():
+            return [await get(after) for after in (0, 900, 0, 0)]
+
+        self.fetch.side_effect = [RuntimeError("bug"), "fetched"]
+        with self.assertLogs("forecast.stale_cache", "ERROR"):
+            results = asyncio.run(main())
+        # the failed refresh is tried again by the next request
+        self.assertEqual(results, [
+            ("cached", sc.Freshness(sc.FRESH, 0)),
+            ("cached", sc.Freshness(sc.STALE, 900)),
+            ("cached", sc.Freshness(sc.STALE, 900)),
+            ("fetched", sc.Freshness(sc.FRESH, 0)),
+        ])
+        self.assertEqual(self.cache._refreshing, set())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class StaleCacheRefreshTests(StubServiceTestCase):
+    """The stale cache fetches from the upstream, not from the HTTP caches behind it."""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.clock.now = time.time()
+        self.service = deps.container._forecast_service
+        self.service.stale_cache = sc.StaleCache(fresh_for=900, executor=InlineExecutor(), clock=self.clock)
+        self.service.stale_cache.cache.clear()
+
+    def test_stale_entry_is_refreshed_from_the_upstream(self):
+        self.search("Berlin")
+        upstream_calls = self.stub.requests
+        # the HTTP cache keeps the response for an hour, the refresh doesn't read it
+        self.clock.now += 900
+        self.assertEqual(self.search("Berlin")[views.FRESHNESS_HEADER], "stale; age=900")
+        self.assertEqual(self.stub.requests, upstream_calls + 1)
+        self.assertEqual(self.search("Berlin")[views.FRESHNESS_HEADER], "fresh; age=0")
+        self.clock.now += 1500
+        self.assertEqual(self.search("Berlin")[views.FRESHNESS_HEADER], "fresh; age=0")
+        self.assertEqual(self.stub.requests, upstream_calls + 2)
+
+    def test_forced_hourly_forecast_skips_the_time_series(self):
+        client = self.service.client
+        today = date.today()
+        client.get_hourly_forecast_for_dates(BERLIN, today, today)
+        upstream_calls = self.stub.requests
+        client.get_hourly_forecast_for_dates(BERLIN, today, today)
+        self.assertEqual(self.stub.requests, upstream_calls)
+        client.get_hourly_forecast_for_dates(BERLIN, today, today, force_refresh=True)
+        self.assertEqual(self.stub.requests, upstream_calls + 1)
+
+
+@override_settings(
+    FORECAST_PAYLOAD_CACHE_ENABLED=True,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PayloadCacheViewsTests(StubServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(deps.container, "_payload_cache", pc.PayloadCache(fresh_for=900))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_response_is_revalidated_with_its_etag(self):
+        response = self.search("Berlin")
+        etag = response["ETag"]
+        self.assertEqual(response[views.FRESHNESS_HEADER], "fresh; age=0")
+        upstream_calls = self.stub.requests
+        response = self.client.get(
+            "/forecast/daily/", {"location": "berlin", "duration_days": 1}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.stub.requests, upstream_calls)
+
+    def test_cached_response_reports_the_age_of_its_forecast(self):
+        body = self.search("Berlin").content
+        now = time.time() + 100
+        with mock.patch.object(pc, "time", mock.Mock(time=mock.Mock(return_value=now))):
+            response = self.search("Berlin")
+        self.assertEqual(response.content, body)
+        self.assertEqual(response[views.FRESHNESS_HEADER], "fresh; age=100")
+        self.assertLessEqual(int(response["Cache-Control"].removeprefix("max-age=")), 800)
+
+
+@override_settings(
+    FORECAST_PAYLOAD_CACHE_ENABLED=True,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PrewarmTests(StubServiceTestCase):
+    """A prewarmed city is answered without asking the upstream."""
+
+    def setUp(self):
+        super().setUp()
+        self.service = deps.container._forecast_service
+        self.service.stale_cache = sc.StaleCache(fresh_for=900)
+        self.service.repo = FlakyCitiesCountRepository()
+        self.service.repo.counts.update({"Berlin": 3, "Paris": 1})
+        patcher = mock.patch.object(deps.container, "_payload_cache", pc.PayloadCache(fresh_for=900))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def prewarm(self, *args: str) -> str:
+        stdout = io.StringIO()
+        call_command(
+            "prewarm_forecasts", "--once", "--jitter", "0", *args, stdout=stdout, stderr=io.StringIO()
+        )
+        return stdout.getvalue()
+
+    def daily(self, city: str):
+        # the default parameters of a daily forecast, the ones the prewarmer warms
+        response = self.client.get("/forecast/daily/", {"location": city})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_prewarmed_response_comes_from_the_payload_cache(self):
+        self.assertIn("'refreshed': 1", self.prewarm("--top", "1"))
+        upstream_calls = self.stub.requests
+        with mock.patch.object(self.service, "get_daily_forecast", side_effect=AssertionError):
+            response = self.daily("berlin")
+        self.assertEqual(self.stub.requests, upstream_calls)
+        self.assertEqual(response[views.FRESHNESS_HEADER], "fresh; age=0")
+        self.assertEqual(json.loads(response.content)["location"], "Berlin")
+        # only the top cities are warmed
+        self.daily("Paris")
+        self.assertGreater(self.stub.requests, upstream_calls)
+
+    def test_passes_end_before_the_forecasts_go_stale(self):
+        for stale_cache, interval in ((self.service.stale_cache, 900 - 300 - 30), (None, 3600 - 300 - 30)):
+            self.service.stale_cache = stale_cache
+            stop = mock.Mock(spec=threading.Event)
+            stop.is_set.side_effect = [False, True]
+            prewarmer = prewarm.Prewarmer(self.service, jitter=30, stop=stop)
+            with mock.patch.object(prewarmer, "run_once", return_value=prewarm.PrewarmStats()):
+                prewarmer.run_forever(10, expire_after=3600, lead=300)
+            self.assertAlmostEqual(stop.wait.call_args.args[0], interval, delta=1)
+
+    @override_settings(FORECAST_PAYLOAD_CACHE_ENABLED=False)
+    def test_prewarmed_forecast_comes_from_the_stale_cache(self):
+        self.assertIn("'refreshed': 2", self.prewarm("--top", "2"))
+        upstream_calls = self.stub.requests
+        with mock.patch.object(self.service.client, "get_daily_forecast", side_effect=AssertionError):
+            for city in ("Berlin", "Paris"):
+                self.assertEqual(self.daily(city)[views.FRESHNESS_HEADER], "fresh; age=0")
+        self.assertEqual(self.stub.requests, upstream_calls)
+
+
+class BatchForecastViewsTests(StubServiceTestCase):
+    def lines(self, response) -> list[dict]:
+        self.assertEqual(response["Content-Type"], views.BATCH_CONTENT_TYPE)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_locations_are_fetched_in_batches_and_streamed_with_their_index(self):
+        service = deps.container.forecast_service
+        service.reverse_geocoder.get_city.return_value = ("Coordsville", "UTC")
+        client = service.client
+        fetch = mock.patch.object(client, "_try_get_forecast", wraps=client._try_get_forecast)
+        with mock.patch.object(api_client.OpenMeteoApiClient, "BATCH_SIZE", 2), fetch as fetch:
+            response = self.client.get(
+                "/forecast/daily/batch/",
+                {
+                    "location": ["Berlin", "Unknown place", "Paris", "Rome"],
+                    "coords": "52.5,13.4",
+                    "duration_days": 2,
+                },
+            )
+            # failed locations are streamed first, as soon as they are known
+            lines = sorted(self.lines(response), key=lambda line: line["index"])
+        self.assertEqual([line["index"] for line in lines], [0, 1, 2, 3, 4])
+        self.assertEqual(
+            [line.get("location") for line in lines], ["Berlin", None, "Paris", "Rome", "Coordsville"]
+        )
+        self.assertEqual(lines[1]["status"], 404)
+        self.assertIn("Unknown place", lines[1]["error"])
+        self.assertEqual(lines[4]["query"], {"lat": "52.5", "lon": "13.4"})
+        self.assertTrue(all(len(line["forecast"]) == 2 for line in lines if "forecast" in line))
+        # the four located places in two upstream calls of two
+        self.assertEqual([len(call.args[0]["latitude"].split(",")) for call in fetch.call_args_list], [2, 2])
+
+    def test_each_batch_is_written_once_fetched(self):
+        client = deps.container.forecast_service.client
+        fetch = mock.patch.object(client, "_try_get_forecast", wraps=client._try_get_forecast)
+        with mock.patch.object(api_client.OpenMeteoApiClient, "BATCH_SIZE", 2), fetch as fetch:
+            response = self.client.get(
+                "/forecast/daily/batch/", {"location": ["Berlin", "Paris", "Rome"], "duration_days": 2}
+            )
+            content = iter(response.streaming_content)
+            first_batch = [json.loads(next(content)) for _ in range(2)]
+            self.assertEqual(fetch.call_count, 1)
+            last_batch = [json.loads(line) for line in content]
+            self.assertEqual(fetch.call_count, 2)
+        self.assertEqual([line["location"] for line in first_batch + last_batch], ["Berlin", "Paris", "Rome"])
+
+    def test_async_batches_are_yielded_once_fetched(self):
+        client = mock.Mock(spec=api_client.AsyncOpenMeteoApiClient, BATCH_SIZE=2)
+        client.get_daily_forecasts.side_effect = lambda geo_datas, **kwargs: ["forecast"] * len(geo_datas)
+        service = sv.AsyncForecastService(mock.Mock(), None, client, mock.Mock())
+
+        async def resolve(location):
+            if location == "Unknown place":
+                return api_client.CoordinatesNotFoundError(location)
+            return BERLIN, location
+
+        async def main():
+            calls = []
+            async for item in service.get_daily_forecasts(1, ["Berlin", "Unknown place", "Paris", "Rome"]):
+                calls.append((item.index, client.get_daily_forecasts.await_count))
+            return calls
+
+        with mock.patch.object(service, "_try_resolve", side_effect=resolve):
+            calls = asyncio.run(main())
+        self.assertEqual(sorted(calls), [(0, 1), (1, 0), (2, 1), (3, 2)])
+
+    def test_invalid_duration_is_rejected(self):
+        service = mock.Mock()
+        for duration_days in ("seven", "0", "-1", "17"):
+            with self.subTest(duration_days=duration_days), mock.patch.object(
+                deps, "get_async_forecast_service", return_value=service
+            ):
+                params = {"location": "Berlin", "duration_days": duration_days}
+                self.assertEqual(self.client.get("/forecast/daily/", params).status_code, 400)
+                self.assertEqual(self.client.get("/forecast/daily/batch/", params).status_code, 400)
+                for view in (views.daily_forecast_async_view, views.daily_batch_forecast_async_view):
+                    request = RequestFactory().get("/", params)
+                    self.assertEqual(async_to_sync(view)(request).status_code, 400)
+        service.get_daily_forecasts.assert_not_called()
+        service.get_daily_forecast.assert_not_called()
+
+
+class SearchHistoryViewsTests(StubServiceTestCase):
+    """Histories are kept by their own cookie, SimpleTestCase fails on any session query."""
+
+    def test_history_follows_the_cookie(self):
+        response = self.search("Berlin")
+        cookie = response.cookies[settings.FORECAST_HISTORY_COOKIE_NAME]
+        self.assertTrue(cookie["httponly"])
+        self.search("Paris")
+        self.search("Berlin")
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        response = self.client.get("/forecast/search-history/")
+        self.assertEqual(
+            [item["city_name"] for item in response.json()["results"]], ["Paris", "Berlin"]
+        )
+        response = self.client.get("/forecast/last-viewed-city/")
+        self.assertEqual(response.json(), {"last_viewed_city": "Berlin"})
+
+    def test_empty_history(self):
+        self.assertEqual(self.client.get("/forecast/last-viewed-city/").status_code, 404)
+        self.assertNotIn(settings.FORECAST_HISTORY_COOKIE_NAME, self.client.cookies)
+
+
+class MetricsTests(StubServiceTestCase):
+    def sample(self, name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_requests_and_upstream_calls_are_observed(self):
+        request_labels = {"endpoint": "forecast:daily", "method": "GET", "status": "200"}
+        host = urlsplit(self.stub.forecast_url).netloc
+        requests_before = self.sample("forecast_http_request_duration_seconds_count", **request_labels)
+        upstream_before = self.sample(
+            "forecast_upstream_request_duration_seconds_count", host=host, status="200"
+        )
+        self.search("Berlin")
+        self.assertEqual(
+            self.sample("forecast_http_request_duration_seconds_count", **request_labels),
+            requests_before + 1,
+        )
+        self.assertGreater(
+            self.sample("forecast_upstream_request_duration_seconds_count", host=host, status="200"),
+            upstream_before,
+        )
+
+    @override_settings(FORECAST_METRICS_TOKEN="scrape-token")
+    def test_scrape(self):
+        self.search("Berlin")
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'forecast_cache_requests_total{layer="http"', response.content)
+        self.assertIn(
+            b'forecast_http_request_duration_seconds_bucket{endpoint="forecast:daily"', response.content
+        )
+
+    @override_settings(FORECAST_METRICS_TOKEN="scrape-token")
+    def test_scrape_needs_the_token_or_an_admin(self):
+        for headers in ({}, {"HTTP_AUTHORIZATION": "Bearer other"}, {"HTTP_AUTHORIZATION": "scrape-token"}):
+            self.assertEqual(self.client.get("/metrics", **headers).status_code, 403)
+        with override_settings(FORECAST_METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+        request = APIRequestFactory().get("/metrics")
+        force_authenticate(request, mock.Mock(is_staff=True))
+        self.assertEqual(views.metrics_view(request).status_code, 200)
+
+
+class ProfilingTests(StubServiceTestCase):
+    def names(self, span: dict) -> list[str]:
+        return [span["name"], *(name for child in span.get("children", ()) for name in self.names(child))]
+
+    @override_settings(FORECAST_PROFILING_SAMPLE_RATE=1.0, FORECAST_PROFILING_SLOW_THRESHOLD=0)
+    def test_slow_requests_are_logged_with_their_spans(self):
+        with self.assertLogs("forecast.middleware", "WARNING") as logs:
+            self.search("Berlin")
+        trace = json.loads(logs.records[0].getMessage().removeprefix("slow request: "))
+        self.assertEqual(trace["status"], 200)
+        self.assertEqual(trace["spans"]["name"], "forecast:daily")
+        names = self.names(trace["spans"])
+        self.assertIn("ForecastService.get_daily_forecast", names)
+        self.assertIn("upstream", names)
+        self.assertIn("OpenMeteoMixin._process_daily_forecast", names)
+
+    @override_settings(FORECAST_PROFILING_TOKEN="secret")
+    def test_profile_requested_with_the_token(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        params = {"location": "Berlin", "duration_days": 1}
+        with override_settings(FORECAST_PROFILING_DIR=Path(directory.name)):
+            profiled = self.client.get("/forecast/daily/", params, headers={"X-Forecast-Profile": "secret"})
+            refused = self.client.get("/forecast/daily/", params, headers={"X-Forecast-Profile": "guess"})
+        dump = profiled.headers[ProfilingMiddleware.DUMP_HEADER]
+        stats = pstats.Stats(str(Path(directory.name) / dump))
+        self.assertTrue(any(name == "get_daily_forecast" for _, _, name in stats.stats))
+        self.assertNotIn(ProfilingMiddleware.DUMP_HEADER, refused.headers)
+
+    def test_spans_of_parallel_calls_keep_their_parent(self):
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        service = deps.container._forecast_service
+        service.executor = executor
+        with profiling.collect("test") as root:
+            service.get_daily_and_hourly_forecast(1, date.today(), mock.Mock(), "Berlin")
+        [call] = root.as_dict()["children"]
+        children = [child["name"] for child in call["children"]]
+        self.assertIn("ForecastService._try_get_daily_forecast", children)
+        self.assertIn("ForecastService._try_get_hourly_forecast_for_dates", children)
@@ -1,13 +1,29 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 app_name = "forecast"
 
+if settings.FORECAST_ASYNC_VIEWS:
+    daily_forecast_view = views.daily_forecast_async_view
+    daily_batch_forecast_view = views.daily_batch_forecast_async_view
+    hourly_forecast_view = views.hourly_forecast_async_view
+    hourly_range_forecast_view = views.hourly_range_forecast_async_view
+else:
+    daily_forecast_view = views.daily_forecast_view
+    daily_batch_forecast_view = views.daily_batch_forecast_view
+    hourly_forecast_view = views.hourly_forecast_view
+    hourly_range_forecast_view = views.hourly_range_forecast_view
+
 urlpatterns = [
-    path("daily/", views.daily_forecast_view, name="daily"),
-    path("hourly/<str:date>/", views.hourly_forecast_view, name="hourly"),
+    path("daily/", daily_forecast_view, name="daily"),
+    path("daily/batch/", daily_batch_forecast_view, name="daily-batch"),
+    path("hourly/", hourly_range_forecast_view, name="hourly-range"),
+    path("hourly/<str:date>/", hourly_forecast_view, name="hourly"),
+    path("autocomplete/", views.autocomplete_view, name="autocomplete"),
     path("search-history/", views.history_view, name="history"),
     path("cities-count/", views.cities_count_view, name="city-count"),
     path("last-viewed-city/", views.last_viewed_city_view, name="last-viewed-city"),
+    path("client-stats/", views.client_stats_view, name="client-stats"),
 ]
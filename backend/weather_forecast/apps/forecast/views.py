@@ -1,105 +1,499 @@
-from dataclasses import asdict
-from datetime import datetime
+import hmac
+import os
+from datetime import date, datetime
 
-from rest_framework import generics, status
-from rest_framework.decorators import api_view
+from django.conf import settings
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from rest_framework import generics, permissions, renderers, status
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.exceptions import APIException
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from forecast import api_client
+from forecast import api_client, encoding, metrics
 from forecast import dependecies as deps
+from forecast import payload_cache as pc
+from forecast import stale_cache as sc
+from forecast import renderers as r
 from forecast import serializers as s
 from forecast.domain import service as sv
-from forecast.models import CitiesCount
 from forecast.search_history import SearchHistory
 
 logger = deps.get_logger(__name__)
 
 
+FORECAST_ERRORS = (api_client.ForecastApiError, sv.ForecastServiceError)
+# forecasts are domain models, rendered with orjson without converting them to dicts first
+FORECAST_RENDERERS = [r.ForecastJSONRenderer, renderers.BrowsableAPIRenderer]
+# batch results are streamed as newline delimited json, one line per location
+BATCH_CONTENT_TYPE = "application/x-ndjson"
+# how old the served forecast is and whether it is being refreshed, see forecast.stale_cache
+FRESHNESS_HEADER = "X-Forecast-Freshness"
+# Open-Meteo forecasts at most 16 days ahead
+DEFAULT_DURATION_DAYS, MAX_DURATION_DAYS = 7, 16
+
+
+def _forecast_error(e: Exception, location: str | None) -> tuple[dict, int]:
+    """Maps an exception raised by the forecast service to an error payload and status code."""
+    if isinstance(e, api_client.CoordinatesNotFoundError):
+        return (
+            {"error": f"Unknown city with name {location}. Can't found coordinates."},
+            status.HTTP_404_NOT_FOUND,
+        )
+    if isinstance(e, api_client.GettingCoordinatesError):
+        return (
+            {"error": f"Can't get coordinates for city {location}. Please try again later."},
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+    logger.exception("get_forecast_view: %s", e)
+    msg = "Can't get forecast. Please try again later."
+    if isinstance(e, sv.ForecastServiceError) and len(e.args) > 0:
+        msg = e.args[0]
+    return {"error": msg}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def _get_coords(query_params) -> sv.Coords | None:
+    lat, lon = query_params.get("lat"), query_params.get("lon")
+    return sv.Coords(lat, lon) if lat and lon else None
+
+
+def _get_date_range(query_params) -> tuple[date, date]:
+    """Inclusive start_date - end_date range, raises ValueError with a message for the client."""
+    try:
+        start_date = date.fromisoformat(query_params["start_date"])
+        end_date = date.fromisoformat(query_params.get("end_date") or query_params["start_date"])
+    except (KeyError, ValueError) as e:
+        raise ValueError("start_date and end_date must be dates in YYYY-MM-DD format") from e
+    if end_date < start_date:
+        raise ValueError("end_date must not be before start_date")
+    if (end_date - start_date).days >= settings.FORECAST_HOURLY_HORIZON_DAYS:
+        raise ValueError(f"The range can't be longer than {settings.FORECAST_HOURLY_HORIZON_DAYS} days")
+    return start_date, end_date
+
+
+def _get_duration_days(query_params) -> int:
+    """Days of a daily forecast, raises ValueError with a message for the client."""
+    try:
+        duration_days = int(query_params.get("duration_days", DEFAULT_DURATION_DAYS))
+    except ValueError:
+        duration_days = 0
+    if not 1 <= duration_days <= MAX_DURATION_DAYS:
+        raise ValueError(f"duration_days must be an integer from 1 to {MAX_DURATION_DAYS}")
+    return duration_days
+
+
+def _get_hourly_date(query_params) -> date | None:
+    """Day of the hourly forecast added to the daily one, raises ValueError with a message for the client."""
+    raw_date = query_params.get("hourly_date")
+    if not raw_date:
+        return None
+    try:
+        return date.fromisoformat(raw_date)
+    except ValueError as e:
+        raise ValueError("hourly_date must be a date in YYYY-MM-DD format") from e
+
+
+def _daily_cache_params(duration_days: int, hourly_date: date | None) -> dict:
+    params = {"duration_days": duration_days}
+    if hourly_date is not None:
+        params["hourly_date"] = hourly_date.isoformat()
+    return params
+
+
+def _get_batch_locations(query_params) -> list[str | sv.Coords]:
+    """Repeated location and coords=lat,lon parameters, raises ValueError with a message for the client."""
+    locations: list[str | sv.Coords] = [location for location in query_params.getlist("location") if location]
+    for raw_coords in query_params.getlist("coords"):
+        lat, _, lon = raw_coords.partition(",")
+        if not lat.strip() or not lon.strip():
+            raise ValueError("coords must be given as lat,lon")
+        locations.append(sv.Coords(lat.strip(), lon.strip()))
+    if not locations:
+        raise ValueError("At least one location or coords must be provided")
+    if len(locations) > settings.FORECAST_BATCH_MAX_LOCATIONS:
+        raise ValueError(
+            f"At most {settings.FORECAST_BATCH_MAX_LOCATIONS} locations can be requested at once"
+        )
+    return locations
+
+
+def _batch_line(item: sv.BatchItem) -> bytes:
+    """One line of a batch response, failed locations carry the error of the single location endpoint."""
+    if isinstance(item.query, sv.Coords):
+        query: str | dict = item.query._asdict()
+        location = f"{item.query.lat},{item.query.lon}"
+    else:
+        query = location = item.query
+    if item.error is not None:
+        data, status_code = _forecast_error(item.error, location)
+        line = {"index": item.index, "query": query, **data, "status": status_code}
+    else:
+        line = {"index": item.index, "query": query, "location": item.city_name, "forecast": item.forecast}
+    return encoding.dumps(line) + b"\n"
+
+
+def _search_history(request: HttpRequest) -> SearchHistory:
+    return SearchHistory(request, deps.container.history_store, settings.FORECAST_HISTORY_COOKIE_NAME)
+
+
+def _payload_cache_key(request: Request, *args, **kwargs) -> str | None:
+    """Key of the cached rendered response, None when it shouldn't be cached."""
+    payload_cache = deps.container.payload_cache
+    # the browsable api renders html around the payload, only plain json is cached
+    if payload_cache is None or request.accepted_renderer.format != "json":
+        return None
+    return payload_cache.key(*args, **kwargs)
+
+
+def _payload_response(request: HttpRequest, payload: pc.CachedPayload) -> HttpResponse:
+    if pc.etag_matches(request.headers.get("If-None-Match"), payload.etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(payload.body, content_type="application/json")
+    response["ETag"] = payload.etag
+    response["Cache-Control"] = f"max-age={payload.max_age}"
+    # only fresh forecasts are rendered into the payload cache, and only while they are fresh
+    response[FRESHNESS_HEADER] = sc.Freshness(sc.FRESH, payload.age).header()
+    return response
+
+
+def _with_freshness(response: HttpResponse, freshness: sc.Freshness) -> HttpResponse:
+    response[FRESHNESS_HEADER] = freshness.header()
+    if not freshness.is_fresh:
+        # a stale forecast is about to be replaced, clients shouldn't keep it around
+        response["Cache-Control"] = "no-cache"
+    return response
+
+
 @api_view()
-def daily_forecast_view(request: Request) -> Response:
+@renderer_classes(FORECAST_RENDERERS)
+def daily_forecast_view(request: Request) -> Response | HttpResponse:
     service = deps.get_forecast_service()
     location = request.query_params.get("location")
-    lat, lon = request.query_params.get("lat"), request.query_params.get("lon")
-    coords = sv.Coords(lat, lon) if lat and lon else None
-    duration_days = int(request.query_params.get("duration_days", 7))
+    coords = _get_coords(request.query_params)
     if not location and not coords:
         return Response(
             {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
         )
     try:
-        forecast, city = service.get_daily_forecast(
-            duration_days, SearchHistory(request), location, coords
-        )
-    except api_client.CoordinatesNotFoundError:
+        duration_days = _get_duration_days(request.query_params)
+        hourly_date = _get_hourly_date(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    history = _search_history(request)
+    cache_key = _payload_cache_key(
+        request, "daily", location, coords, **_daily_cache_params(duration_days, hourly_date)
+    )
+    if cache_key is not None:
+        payload = deps.container.payload_cache.get(cache_key)
+        if payload is not None:
+            service.register_search(history, payload.city)
+            return _payload_response(request, payload)
+    try:
+        if hourly_date is None:
+            forecast, city, freshness = service.get_daily_forecast(duration_days, history, location, coords)
+            data = {"forecast": forecast, "location": city}
+        else:
+            # the daily and the hourly forecast are fetched concurrently
+            forecast, hourly, city, freshness = service.get_daily_and_hourly_forecast(
+                duration_days, hourly_date, history, location, coords
+            )
+            data = {"forecast": forecast, "hourly": hourly, "location": city}
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return Response(data, status=status_code)
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(Response(data), freshness)
+    payload = deps.container.payload_cache.set(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
+
+
+@api_view()
+def daily_batch_forecast_view(request: Request) -> Response | StreamingHttpResponse:
+    service = deps.get_forecast_service()
+    try:
+        locations = _get_batch_locations(request.query_params)
+        duration_days = _get_duration_days(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    items = service.get_daily_forecasts(duration_days, locations)
+    return StreamingHttpResponse(map(_batch_line, items), content_type=BATCH_CONTENT_TYPE)
+
+
+@api_view()
+@renderer_classes(FORECAST_RENDERERS)
+def hourly_forecast_view(request: Request, date: str) -> Response | HttpResponse:
+    service = deps.get_forecast_service()
+    location = request.query_params.get("location")
+    raw_date = date
+    try:
+        date = datetime.fromisoformat(date)
+    except ValueError:
+        logger.error("Incorrect date format: %s", raw_date)
         return Response(
-            {"error": f"Unknown city with name {location}. Can't found coordinates."},
-            status=status.HTTP_404_NOT_FOUND,
+            {"error": "Incorrect date format. Expected format: YYYY-MM-DDTHH:MM"},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-    except api_client.GettingCoordinatesError:
+    coords = _get_coords(request.query_params)
+    if not location and not coords:
         return Response(
-            {"error": f"Can't get coordinates for city {location}. Please try again later."},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
         )
-    except sv.ForecastServiceError as e:
-        logger.exception("get_forecast_view: %s", e)
-        msg = e.args[0] if len(e.args) > 0 else "Can't get forecast. Please try again later."
-        return Response({"error": msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    return Response({"forecast": forecast, "location": city})
+    cache_key = _payload_cache_key(request, "hourly", location, coords, date=raw_date)
+    if cache_key is not None:
+        payload = deps.container.payload_cache.get(cache_key)
+        if payload is not None:
+            return _payload_response(request, payload)
+    try:
+        forecast, city, freshness = service.get_hourly_forecast_for_date(date, location, coords)
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return Response(data, status=status_code)
+    data = {"forecast": forecast, "location": city, "date": raw_date}
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(Response(data), freshness)
+    payload = deps.container.payload_cache.set(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
 
 
 @api_view()
-def hourly_forecast_view(request: Request, date: str) -> Response:
+@renderer_classes(FORECAST_RENDERERS)
+def hourly_range_forecast_view(request: Request) -> Response | HttpResponse:
     service = deps.get_forecast_service()
     location = request.query_params.get("location")
-    lat, lon = request.query_params.get("lat"), request.query_params.get("lon")
+    try:
+        start_date, end_date = _get_date_range(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    coords = _get_coords(request.query_params)
+    if not location and not coords:
+        return Response(
+            {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    cache_key = _payload_cache_key(
+        request, "hourly_range", location, coords, start_date=start_date, end_date=end_date
+    )
+    if cache_key is not None:
+        payload = deps.container.payload_cache.get(cache_key)
+        if payload is not None:
+            return _payload_response(request, payload)
+    try:
+        forecast, city, freshness = service.get_hourly_forecast_for_dates(
+            start_date, end_date, location, coords
+        )
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return Response(data, status=status_code)
+    data = {
+        "forecast": forecast,
+        "location": city,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+    }
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(Response(data), freshness)
+    payload = deps.container.payload_cache.set(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
+
+
+# Async counterparts of the views above. DRF views can't be coroutines, so these are plain
+# Django views and only pay off when served through config.asgi (see FORECAST_ASYNC_VIEWS).
+
+
+def _forecast_response(data: dict) -> HttpResponse:
+    return HttpResponse(encoding.dumps(data), content_type="application/json")
+
+
+async def daily_forecast_async_view(request: HttpRequest) -> HttpResponse:
+    service = deps.get_async_forecast_service()
+    location = request.GET.get("location")
+    coords = _get_coords(request.GET)
+    if not location and not coords:
+        return JsonResponse(
+            {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        duration_days = _get_duration_days(request.GET)
+        hourly_date = _get_hourly_date(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    history = _search_history(request)
+    payload_cache = deps.container.payload_cache
+    cache_key = None
+    if payload_cache is not None:
+        cache_key = payload_cache.key(
+            "daily", location, coords, **_daily_cache_params(duration_days, hourly_date)
+        )
+    if cache_key is not None:
+        payload = await payload_cache.aget(cache_key)
+        if payload is not None:
+            await service.register_search(history, payload.city)
+            return _payload_response(request, payload)
+    try:
+        if hourly_date is None:
+            forecast, city, freshness = await service.get_daily_forecast(
+                duration_days, history, location, coords
+            )
+            data = {"forecast": forecast, "location": city}
+        else:
+            forecast, hourly, city, freshness = await service.get_daily_and_hourly_forecast(
+                duration_days, hourly_date, history, location, coords
+            )
+            data = {"forecast": forecast, "hourly": hourly, "location": city}
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return JsonResponse(data, status=status_code)
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(_forecast_response(data), freshness)
+    payload = await payload_cache.aset(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
+
+
+async def daily_batch_forecast_async_view(request: HttpRequest) -> HttpResponse:
+    service = deps.get_async_forecast_service()
+    try:
+        locations = _get_batch_locations(request.GET)
+        duration_days = _get_duration_days(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    async def lines():
+        async for item in service.get_daily_forecasts(duration_days, locations):
+            yield _batch_line(item)
+
+    return StreamingHttpResponse(lines(), content_type=BATCH_CONTENT_TYPE)
+
+
+async def hourly_forecast_async_view(request: HttpRequest, date: str) -> HttpResponse:
+    service = deps.get_async_forecast_service()
+    location = request.GET.get("location")
     raw_date = date
     try:
         date = datetime.fromisoformat(date)
     except ValueError:
         logger.error("Incorrect date format: %s", raw_date)
-        return Response(
+        return JsonResponse(
             {"error": "Incorrect date format. Expected format: YYYY-MM-DDTHH:MM"},
             status=status.HTTP_400_BAD_REQUEST,
         )
-    coords = sv.Coords(lat, lon) if lat and lon else None
+    coords = _get_coords(request.GET)
     if not location and not coords:
-        return Response(
+        return JsonResponse(
             {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
         )
+    payload_cache = deps.container.payload_cache
+    cache_key = None
+    if payload_cache is not None:
+        cache_key = payload_cache.key("hourly", location, coords, date=raw_date)
+    if cache_key is not None:
+        payload = await payload_cache.aget(cache_key)
+        if payload is not None:
+            return _payload_response(request, payload)
     try:
-        forecast, city = service.get_hourly_forecast_for_date(date, location, coords)
-    except api_client.CoordinatesNotFoundError:
-        return Response(
-            {"error": f"Unknown city with name {location}. Can't found coordinates."},
-            status=status.HTTP_404_NOT_FOUND,
+        forecast, city, freshness = await service.get_hourly_forecast_for_date(date, location, coords)
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return JsonResponse(data, status=status_code)
+    data = {"forecast": forecast, "location": city, "date": raw_date}
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(_forecast_response(data), freshness)
+    payload = await payload_cache.aset(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
+
+
+async def hourly_range_forecast_async_view(request: HttpRequest) -> HttpResponse:
+    service = deps.get_async_forecast_service()
+    location = request.GET.get("location")
+    try:
+        start_date, end_date = _get_date_range(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    coords = _get_coords(request.GET)
+    if not location and not coords:
+        return JsonResponse(
+            {"error": "Either city_name or coords must be provided"}, status=status.HTTP_400_BAD_REQUEST
         )
-    except api_client.GettingCoordinatesError:
+    payload_cache = deps.container.payload_cache
+    cache_key = None
+    if payload_cache is not None:
+        cache_key = payload_cache.key(
+            "hourly_range", location, coords, start_date=start_date, end_date=end_date
+        )
+    if cache_key is not None:
+        payload = await payload_cache.aget(cache_key)
+        if payload is not None:
+            return _payload_response(request, payload)
+    try:
+        forecast, city, freshness = await service.get_hourly_forecast_for_dates(
+            start_date, end_date, location, coords
+        )
+    except FORECAST_ERRORS as e:
+        data, status_code = _forecast_error(e, location)
+        return JsonResponse(data, status=status_code)
+    data = {
+        "forecast": forecast,
+        "location": city,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+    }
+    if cache_key is None or not freshness.is_fresh:
+        return _with_freshness(_forecast_response(data), freshness)
+    payload = await payload_cache.aset(cache_key, encoding.dumps(data), city, freshness.age)
+    return _payload_response(request, payload)
+
+
+@api_view()
+def autocomplete_view(request: Request) -> Response:
+    query = request.query_params.get("q", "")
+    try:
+        limit = min(int(request.query_params.get("limit", 10)), 50)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+    city_index = deps.container.city_index
+    if city_index is None:
         return Response(
-            {"error": f"Can't get coordinates for city {location}. Please try again later."},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            {"error": "City search is not available."}, status=status.HTTP_503_SERVICE_UNAVAILABLE
         )
-    except sv.ForecastServiceError as e:
-        logger.exception("get_forecast_view: %s", e)
-        msg = e.args[0] if len(e.args) > 0 else "Can't get forecast. Please try again later."
-        return Response({"error": msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    return Response({"forecast": forecast, "location": city, "date": raw_date})
+    cities = city_index.search_prefix(query, limit) if query.strip() else []
+    return Response({"results": s.CitySerializer(cities, many=True).data})
 
 
 class CitiesCountView(generics.ListAPIView):
+    """Most searched cities, ranked and paginated by the repository.
+
+    `?window=hour` or `?window=day` ranks by the searches of the last hour or day only.
+    """
+
     serializer_class = s.CitiesCountSerializer
-    service = deps.get_forecast_service()
 
-    def get_queryset(self) -> Response | list[CitiesCount]:
+    @property
+    def service(self) -> sv.ForecastService:
+        return deps.get_forecast_service()
+
+    def get_queryset(self) -> sv.CitiesRanking:
+        return self.service.get_cities_ranking(self.request.query_params.get("window") or None)
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
         try:
-            res = self.service.get_cities_count()
+            return super().list(request, *args, **kwargs)
+        except APIException:
+            raise
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.exception("cities_count_view: %s", e)
             return Response(
                 {"error": "Can't get cities count. Please try again later."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
-        return res
 
 
 cities_count_view = CitiesCountView.as_view()
@@ -109,7 +503,7 @@ class HistoryView(generics.ListAPIView):
     serializer_class = s.HistorySerializer
 
     def get_queryset(self) -> list[str]:
-        return list(SearchHistory(self.request))
+        return list(_search_history(self.request))
 
 
 history_view = HistoryView.as_view()
@@ -119,7 +513,7 @@ history_view = HistoryView.as_view()
 def last_viewed_city_view(request) -> Response:
     service = deps.get_forecast_service()
     try:
-        res = service.get_last_viewed_city(SearchHistory(request))
+        res = service.get_last_viewed_city(_search_history(request))
     except sv.NotFoundError:
         return Response({"last_viewed_city": ""}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
@@ -129,3 +523,34 @@ def last_viewed_city_view(request) -> Response:
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
     return Response({"last_viewed_city": res})
+
+
+@api_view()
+@permission_classes([permissions.IsAdminUser])
+def client_stats_view(request) -> Response:
+    return Response(
+        {
+            "pid": os.getpid(),
+            "pools": deps.container.pool_stats(),
+            "single_flight": deps.container.single_flight_stats(),
+            "circuit_breakers": deps.container.breaker_stats(),
+            "popularity": deps.container.popularity_stats(),
+        }
+    )
+
+
+class HasMetricsToken(permissions.BasePermission):
+    """Bearer token of FORECAST_METRICS_TOKEN, which a Prometheus scrape job can send."""
+
+    def has_permission(self, request, view) -> bool:
+        token = settings.FORECAST_METRICS_TOKEN
+        scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+        return bool(token) and scheme.lower() == "bearer" and hmac.compare_digest(given, token)
+
+
+@api_view()
+@permission_classes([permissions.IsAdminUser | HasMetricsToken])
+def metrics_view(request) -> HttpResponse:
+    """Prometheus scrape endpoint, the metrics of all the workers of the server."""
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,8 @@
+"""Performance benchmarks for the forecast backend.
+
+Every benchmark is a runnable module, executed from the ``weather_forecast`` directory:
+
+    python -m benchmarks.async_vs_sync --help
+
+and prints its results as JSON so runs can be compared between commits.
+"""
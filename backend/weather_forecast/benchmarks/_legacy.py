@@ -0,0 +1,82 @@
+"""The forecast parsing path the clients used before the columnar representation.
+
+Kept with its own copy of the original, plain (``__dict__`` based) models as the baseline
+the parsing and serialization benchmarks compare against.
+"""
+
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class amount:  # noqa: N801
+    value: int
+    unit: str | None = None
+
+
+@dataclass
+class WeatherDataPerHour:
+    temp: amount
+    temp_feels_like: amount
+    rain: float
+    precipitation_probability: amount
+
+
+@dataclass
+class WeatherDataPerDay:
+    temp_min: amount
+    temp_max: amount
+    rain_sum: amount
+    precipitation_probability: amount
+
+
+def process_daily_forecast(raw_forecast: dict) -> dict[str, WeatherDataPerDay]:
+    daily = raw_forecast["daily"]
+    units = raw_forecast["daily_units"]
+    processed = {}
+    for i in range(len(daily["time"])):
+        processed[daily["time"][i]] = WeatherDataPerDay(
+            temp_max=amount(daily["temperature_2m_max"][i], units["temperature_2m_max"]),
+            temp_min=amount(daily["temperature_2m_min"][i], units["temperature_2m_min"]),
+            rain_sum=amount(daily["rain_sum"][i], units["rain_sum"]),
+            precipitation_probability=amount(
+                daily["precipitation_probability_max"][i], units["precipitation_probability_max"]
+            ),
+        )
+    return processed
+
+
+def process_hourly_forecast(raw_forecast: dict) -> dict:
+    hourly = raw_forecast["hourly"]
+    units = raw_forecast["hourly_units"]
+    processed = {
+        "hourly": {},
+        "temp_min": amount(
+            raw_forecast["daily"]["temperature_2m_min"], raw_forecast["daily_units"]["temperature_2m_min"]
+        ),
+        "temp_max": amount(
+            raw_forecast["daily"]["temperature_2m_max"], raw_forecast["daily_units"]["temperature_2m_max"]
+        ),
+    }
+    for i in range(len(hourly["time"])):
+        processed["hourly"][hourly["time"][i]] = WeatherDataPerHour(
+            temp=amount(hourly["temperature_2m"][i], units["temperature_2m"]),
+            rain=amount(hourly["rain"][i], units["rain"]),
+            temp_feels_like=amount(hourly["apparent_temperature"][i], units["apparent_temperature"]),
+            precipitation_probability=amount(
+                hourly["precipitation_probability"][i], units["precipitation_probability"]
+            ),
+        )
+    return processed
+
+
+def daily_as_dict(forecast: dict[str, WeatherDataPerDay]) -> dict:
+    """What ForecastService used to hand to the views."""
+    return {day: asdict(data) for day, data in forecast.items()}
+
+
+def hourly_as_dict(forecast: dict) -> dict:
+    return {
+        "hourly": {hour: asdict(data) for hour, data in forecast["hourly"].items()},
+        "temp_min": asdict(forecast["temp_min"]),
+        "temp_max": asdict(forecast["temp_max"]),
+    }
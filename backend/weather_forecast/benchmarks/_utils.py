@@ -0,0 +1,167 @@
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import typing as t
+from pathlib import Path
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: t.Sequence[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(latencies: t.Sequence[float]) -> dict[str, float]:
+    """Latency summary in milliseconds."""
+    return {
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def time_calls(fn: t.Callable[[], t.Any], number: int, repeat: int) -> dict[str, float]:
+    """Best and mean duration of a call in microseconds, over `repeat` runs of `number` calls."""
+    timings = [timing / number * 1e6 for timing in timeit.repeat(fn, number=number, repeat=repeat)]
+    return {"best_us": round(min(timings), 2), "mean_us": round(statistics.fmean(timings), 2)}
+
+
+def git_commit() -> str | None:
+    """Commit of the benchmarked tree, with a ``-dirty`` suffix when it has uncommitted changes."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty", "--abbrev=12"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(name: str, results: t.Any, output: str | None = None) -> None:
+    """Prints (and optionally writes) a machine readable benchmark report."""
+    payload = {
+        "benchmark": name,
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    encoded = json.dumps(payload, indent=2)
+    if output:
+        Path(output).write_text(encoded)
+    print(encoded)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def django_env(**overrides: str) -> dict[str, str]:
+    """Environment for a Django process started by a benchmark."""
+    env = dict(os.environ)
+    env.setdefault("DJANGO_SECRET_KEY", "benchmark")
+    env.setdefault("REDIS_HOST", "localhost")
+    env.setdefault("REDIS_PORT", "6379")
+    env["DJANGO_SETTINGS_MODULE"] = "config.settings"
+    env.update(overrides)
+    return env
+
+
+def setup_django(**overrides: str) -> None:
+    """Configures Django in the benchmark process itself, for in-process micro-benchmarks."""
+    import django
+
+    os.environ.update(django_env(**overrides))
+    django.setup()
+
+
+def wait_for_http(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{url} did not come up in {timeout}s")
+
+
+def start_process(args: list[str], env: dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        args, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def _run_load(
+    urls: t.Callable[[int], str],
+    total: int,
+    concurrency: int,
+    timeout: float,
+    cookies: dict[str, str] | None = None,
+) -> dict[str, t.Any]:
+    import asyncio
+
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await client.get(urls(i))
+                key = str(response.status_code)
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, cookies=cookies) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "statuses": statuses,
+        **summarize_latencies(latencies),
+    }
+
+
+def run_load(
+    urls: t.Callable[[int], str],
+    total: int,
+    concurrency: int,
+    timeout: float = 30.0,
+    cookies: dict[str, str] | None = None,
+) -> dict[str, t.Any]:
+    """Issues ``total`` GET requests to ``urls(i)`` from ``concurrency`` concurrent clients."""
+    import asyncio
+
+    return asyncio.run(_run_load(urls, total, concurrency, timeout, cookies))
@@ -0,0 +1,90 @@
+"""Load benchmark of the sync WSGI forecast views against the async ASGI ones.
+
+Both servers run under gunicorn with the same number of workers and talk to a local stub
+upstream (see ``benchmarks.stub_upstream``) with a fixed latency, so the numbers show how
+many concurrent upstream waits a worker can absorb. The HTTP cache is set to expire
+immediately and rendered responses aren't cached, so every request makes its geocoding and
+forecast round trips.
+
+    python -m benchmarks.async_vs_sync --workers 2 --concurrency 64 --requests 1000
+"""
+
+import argparse
+import sys
+from datetime import date
+
+from benchmarks import _utils
+
+SERVERS = {
+    "wsgi": ["config.wsgi:application"],
+    "asgi": ["config.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+
+
+def bench_server(mode: str, args: argparse.Namespace, stub_url: str) -> dict:
+    port = _utils.free_port()
+    env = _utils.django_env(
+        FORECAST_API_URL=f"{stub_url}/v1/forecast",
+        FORECAST_GEODATA_API_URL=f"{stub_url}/v1/search",
+        FORECAST_API_CACHE_BACKEND="memory",
+        FORECAST_API_CACHE_EXPIRE_AFTER="0",
+        FORECAST_API_GEODATA_CACHE_EXPIRE_AFTER="0",
+        FORECAST_PAYLOAD_CACHE_ENABLED="0",
+        FORECAST_ASYNC_VIEWS="1" if mode == "asgi" else "0",
+    )
+    server = _utils.start_process(
+        [
+            sys.executable, "-m", "gunicorn", *SERVERS[mode],
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(args.workers),
+        ],
+        env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    today = date.today().isoformat()
+
+    def url(i: int) -> str:
+        return f"{base_url}/forecast/hourly/{today}/?location=city{i % args.cities}"
+
+    try:
+        _utils.wait_for_http(f"{base_url}/forecast/hourly/{today}/")
+        _utils.run_load(url, args.workers * 4, args.workers)  # warm up every worker
+        return _utils.run_load(url, args.requests, args.concurrency)
+    finally:
+        _utils.stop_process(server)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--cities", type=int, default=50, help="distinct locations requested")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub upstream latency, seconds")
+    parser.add_argument("--modes", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    stub_port = _utils.free_port()
+    stub = _utils.start_process(
+        [
+            sys.executable, "-m", "benchmarks.stub_upstream",
+            "--port", str(stub_port), "--latency", str(args.latency),
+        ],
+        _utils.django_env(),
+    )
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    try:
+        _utils.wait_for_http(stub_url)
+        results = {mode: bench_server(mode, args, stub_url) for mode in args.modes}
+    finally:
+        _utils.stop_process(stub)
+    _utils.report(
+        "async_vs_sync",
+        {"params": vars(args), **results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Cold start benchmark: import time of the application and time to the first response.
+
+``import`` imports the WSGI and ASGI applications in fresh interpreters. ``boot`` starts
+gunicorn with one worker and ``config/gunicorn.py``, with and without ``preload_app``, and
+polls a daily forecast against a local stub upstream (see ``benchmarks.stub_upstream``)
+until the first successful response. Every run starts a new server, so it pays for the
+master's and the worker's boot, the lazy initialization of the forecast dependencies and
+the first upstream round trips. The worker is replaced after every request
+(``--max-requests 1``), so the second response is the first one of a worker forked by a
+running master, as when a worker is restarted or added; uvicorn's worker may still answer
+it before exiting, which makes this measure meaningless with ``--mode asgi``. Like the
+server itself, the benchmark needs the Redis of the Django cache.
+
+    python -m benchmarks.coldstart --repeat 5
+    python -m benchmarks.coldstart --benchmarks boot --mode asgi --latency 0.05
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import typing as t
+
+import httpx
+
+from benchmarks import _utils
+
+APPLICATIONS = {
+    "wsgi": "config.wsgi:application",
+    "asgi": "config.asgi:application",
+}
+WORKER_CLASSES = {"wsgi": [], "asgi": ["-k", "uvicorn.workers.UvicornWorker"]}
+IMPORT_SCRIPT = """
+import importlib, time
+start = time.perf_counter()
+module, name = {target!r}.split(":")
+getattr(importlib.import_module(module), name)
+print(time.perf_counter() - start)
+"""
+POLL_INTERVAL = 0.01
+
+
+def _summary(durations: t.Sequence[float]) -> dict[str, float]:
+    return {
+        "min_ms": round(min(durations) * 1000, 3),
+        "median_ms": round(statistics.median(durations) * 1000, 3),
+        "max_ms": round(max(durations) * 1000, 3),
+    }
+
+
+def bench_import(args: argparse.Namespace) -> dict[str, t.Any]:
+    results = {}
+    for mode, target in APPLICATIONS.items():
+        durations = []
+        for _ in range(args.repeat):
+            completed = subprocess.run(
+                [sys.executable, "-c", IMPORT_SCRIPT.format(target=target)],
+                cwd=_utils.BASE_DIR, env=_utils.django_env(), capture_output=True, text=True, check=True,
+            )
+            durations.append(float(completed.stdout))
+        results[mode] = _summary(durations)
+    return results
+
+
+def _first_response(url: str, timeout: float) -> float:
+    """Duration of the first request to `url` answered, polling until the server listens."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = httpx.get(url, timeout=timeout)
+        except httpx.TransportError:
+            time.sleep(POLL_INTERVAL)
+            continue
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}: {response.text[:200]}")
+        return time.perf_counter() - started
+    raise TimeoutError(f"{url} did not answer in {timeout}s")
+
+
+def boot_once(args: argparse.Namespace, stub_url: str, preload: bool) -> dict[str, float]:
+    port = _utils.free_port()
+    env = _utils.django_env(
+        FORECAST_API_URL=f"{stub_url}/v1/forecast",
+        FORECAST_GEODATA_API_URL=f"{stub_url}/v1/search",
+        FORECAST_NOMINATIM_URL=stub_url,
+        FORECAST_API_CACHE_BACKEND="memory",
+        FORECAST_HISTORY_BACKEND="memory",
+        FORECAST_ASYNC_VIEWS="1" if args.mode == "asgi" else "0",
+        GUNICORN_PRELOAD_APP="1" if preload else "0",
+    )
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    url = f"http://127.0.0.1:{port}/forecast/daily/?location=Berlin&duration_days=7"
+    started = time.perf_counter()
+    server = _utils.start_process(
+        [
+            sys.executable, "-m", "gunicorn", APPLICATIONS[args.mode], *WORKER_CLASSES[args.mode],
+            "-c", "config/gunicorn.py",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", "1",
+            "--max-requests", "1",
+        ],
+        env,
+    )
+    try:
+        _first_response(url, args.timeout)
+        booted = time.perf_counter() - started
+        respawned = _first_response(url, args.timeout)
+    finally:
+        _utils.stop_process(server)
+    return {"boot_to_first_response": booted, "respawn_to_first_response": respawned}
+
+
+def bench_boot(args: argparse.Namespace) -> dict[str, t.Any]:
+    stub_port = _utils.free_port()
+    stub = _utils.start_process(
+        [
+            sys.executable, "-m", "benchmarks.stub_upstream",
+            "--port", str(stub_port),
+            "--latency", str(args.latency),
+        ],
+        _utils.django_env(),
+    )
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    results = {}
+    try:
+        _utils.wait_for_http(stub_url)
+        for preload in (False, True):
+            runs = [boot_once(args, stub_url, preload) for _ in range(args.repeat)]
+            results["preload" if preload else "no_preload"] = {
+                name: _summary([run[name] for run in runs]) for name in runs[0]
+            }
+    finally:
+        _utils.stop_process(stub)
+    return results
+
+
+BENCHMARKS = {"import": bench_import, "boot": bench_boot}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--mode", choices=APPLICATIONS, default="wsgi", help="server booted by `boot`")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub upstream latency, seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for a response")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = {name: BENCHMARKS[name](args) for name in args.benchmarks}
+    _utils.report("coldstart", {"params": vars(args), **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
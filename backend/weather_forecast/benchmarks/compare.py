@@ -0,0 +1,91 @@
+"""Compares two reports of the same benchmark and flags regressions.
+
+Every numeric result found in both reports is compared by its name: times (``*_ms``,
+``*_us``, ``*_s``), memory (``*_bytes``) and error rates are better lower, throughputs
+(``*_rps``, ``*_per_s``), speedups and recall better higher. Other numbers, parameters
+included, are left out. A change of more than ``--threshold`` in the worse direction is a
+regression and makes the command exit with status 1, so it can gate a CI job.
+
+    python -m benchmarks.endpoints --output base.json   # on the base commit
+    python -m benchmarks.endpoints --output head.json   # on the change
+    python -m benchmarks.compare base.json head.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+import typing as t
+from pathlib import Path
+
+LOWER_IS_BETTER = ("_ms", "_us", "_s", "_bytes", "_error")
+HIGHER_IS_BETTER = ("_rps", "_per_s", "speedup", "recall")
+# sections describing the run rather than measuring it
+IGNORED = {"params", "skipped", "statuses"}
+
+
+def direction(name: str) -> int:
+    """1 when a higher value is better, -1 when a lower one is, 0 when it isn't a measurement."""
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def flatten(results: t.Any, prefix: str = "") -> dict[str, float]:
+    """Measurements of a report by their dotted path."""
+    if isinstance(results, dict):
+        flat = {}
+        for name, value in results.items():
+            if name not in IGNORED:
+                flat.update(flatten(value, f"{prefix}{name}."))
+        return flat
+    name = prefix.rstrip(".")
+    if isinstance(results, (int, float)) and not isinstance(results, bool) and direction(name):
+        return {name: float(results)}
+    return {}
+
+
+def compare(base: dict, head: dict, threshold: float) -> dict[str, t.Any]:
+    base_results, head_results = flatten(base["results"]), flatten(head["results"])
+    changes = {}
+    for name in sorted(base_results.keys() & head_results.keys()):
+        before, after = base_results[name], head_results[name]
+        change = (after - before) / before if before else 0.0
+        changes[name] = {
+            "base": before,
+            "head": after,
+            "change": round(change, 4),
+            "regression": change * direction(name) < -threshold,
+        }
+    return {
+        "benchmark": head["benchmark"],
+        "base_commit": base.get("commit"),
+        "head_commit": head.get("commit"),
+        "threshold": threshold,
+        "regressions": [name for name, change in changes.items() if change["regression"]],
+        "changes": changes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base", help="report of the reference run")
+    parser.add_argument("head", help="report of the run to check")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change tolerated")
+    parser.add_argument("--output", help="also write the JSON comparison to this file")
+    args = parser.parse_args()
+
+    base, head = (json.loads(Path(path).read_text()) for path in (args.base, args.head))
+    if base["benchmark"] != head["benchmark"]:
+        parser.error(f"can't compare a {base['benchmark']} report with a {head['benchmark']} one")
+    comparison = compare(base, head, args.threshold)
+    encoded = json.dumps(comparison, indent=2)
+    if args.output:
+        Path(args.output).write_text(encoded)
+    print(encoded)
+    sys.exit(1 if comparison["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""End-to-end load benchmark of every endpoint of ``forecast.urls``.
+
+The server runs under gunicorn, as WSGI or ASGI (``--mode``), against a local stub upstream
+(see ``benchmarks.stub_upstream``) standing in for Open-Meteo and Nominatim, optionally
+replaying recorded responses and injecting latency and errors. Endpoints are loaded one
+after another, each with ``--requests`` requests from ``--concurrency`` clients spread
+over ``--cities`` locations, and reported with their throughput, latency percentiles and
+response statuses. Locations alternate between city names and coordinates, and the search
+history endpoints are loaded by a visitor who has made a search.
+
+Caches are used as configured; with ``--cold`` the upstream, stale and payload caches are
+disabled and every forecast request reaches the stub. Like the server itself, the benchmark
+needs the Redis of the Django cache, of the popularity counters and of the search history.
+
+    python -m benchmarks.endpoints --mode wsgi --workers 2 --concurrency 32 --requests 500
+    python -m benchmarks.endpoints --endpoints daily hourly --latency 0.05 --jitter 0.05 --cold
+"""
+
+import argparse
+import sys
+import typing as t
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+import httpx
+
+from benchmarks import _utils
+
+SERVERS = {
+    "wsgi": ["config.wsgi:application"],
+    "asgi": ["config.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+# endpoints that can't be benchmarked anonymously
+SKIPPED = {"client-stats": "admin only"}
+# endpoints reading the search history, loaded by one visitor who has searched before
+VISITOR_ENDPOINTS = {"history", "last-viewed-city"}
+BATCH_SIZE = 10
+
+
+def location_params(i: int, cities: int) -> dict[str, str]:
+    """City name or coordinates of the i-th request, both drawn from `cities` locations."""
+    n = i % cities
+    if i % 2:
+        # half a degree apart, each in its own grid cell, spread over the mid latitudes
+        return {"lat": f"{35 + n % 25 * 0.5:.4f}", "lon": f"{-10 + n // 25 * 0.5:.4f}"}
+    return {"location": f"city{n}"}
+
+
+def endpoint_urls(args: argparse.Namespace) -> dict[str, t.Callable[[int], str]]:
+    """Url of the i-th request to each endpoint, by url name."""
+    from django.urls import reverse
+
+    today = date.today()
+
+    def url(name: str, params: dict[str, t.Any] | list[tuple[str, t.Any]] | None = None, **kwargs) -> str:
+        path = reverse(f"forecast:{name}", kwargs=kwargs or None)
+        return f"{path}?{urlencode(params)}" if params else path
+
+    def batch(i: int) -> str:
+        locations = [("location", f"city{(i * BATCH_SIZE + j) % args.cities}") for j in range(BATCH_SIZE)]
+        return url("daily-batch", [*locations, ("duration_days", 7)])
+
+    end = today + timedelta(days=2)
+    return {
+        "daily": lambda i: url("daily", {**location_params(i, args.cities), "duration_days": 7}),
+        "daily-batch": batch,
+        "hourly-range": lambda i: url(
+            "hourly-range",
+            {**location_params(i, args.cities), "start_date": today.isoformat(), "end_date": end.isoformat()},
+        ),
+        "hourly": lambda i: url("hourly", location_params(i, args.cities), date=today.isoformat()),
+        "autocomplete": lambda i: url("autocomplete", {"q": f"city{i % args.cities}"[:5]}),
+        "history": lambda i: url("history"),
+        "city-count": lambda i: url("city-count"),
+        "last-viewed-city": lambda i: url("last-viewed-city"),
+    }
+
+
+def url_names() -> list[str]:
+    from forecast.urls import urlpatterns
+
+    return [pattern.name for pattern in urlpatterns]
+
+
+def _absolute(base_url: str, path: t.Callable[[int], str]) -> t.Callable[[int], str]:
+    return lambda i: base_url + path(i)
+
+
+def bench_server(args: argparse.Namespace, stub_url: str, endpoints: list[str]) -> dict[str, t.Any]:
+    port = _utils.free_port()
+    overrides = {
+        "FORECAST_API_URL": f"{stub_url}/v1/forecast",
+        "FORECAST_GEODATA_API_URL": f"{stub_url}/v1/search",
+        "FORECAST_NOMINATIM_URL": stub_url,
+        "FORECAST_API_CACHE_BACKEND": args.cache_backend,
+        "FORECAST_HISTORY_BACKEND": args.history_backend,
+        "FORECAST_ASYNC_VIEWS": "1" if args.mode == "asgi" else "0",
+    }
+    if args.cold:
+        overrides.update(
+            FORECAST_API_CACHE_EXPIRE_AFTER="0",
+            FORECAST_API_GEODATA_CACHE_EXPIRE_AFTER="0",
+            FORECAST_PAYLOAD_CACHE_ENABLED="0",
+            FORECAST_STALE_CACHE_ENABLED="0",
+        )
+    server = _utils.start_process(
+        [
+            sys.executable, "-m", "gunicorn", *SERVERS[args.mode],
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(args.workers),
+        ],
+        _utils.django_env(**overrides),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    urls = endpoint_urls(args)
+    try:
+        _utils.wait_for_http(base_url)
+        results = {}
+        visitor = {}
+        if VISITOR_ENDPOINTS & set(endpoints):
+            response = httpx.get(base_url + urls["daily"](0), timeout=30)
+            visitor = dict(response.cookies)
+        for name in endpoints:
+            endpoint_url = _absolute(base_url, urls[name])
+            cookies = visitor if name in VISITOR_ENDPOINTS else None
+            _utils.run_load(endpoint_url, args.workers * 4, args.workers, cookies=cookies)  # warm up
+            results[name] = _utils.run_load(endpoint_url, args.requests, args.concurrency, cookies=cookies)
+        return results
+    finally:
+        _utils.stop_process(server)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=SERVERS, default="wsgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--cities", type=int, default=50, help="distinct locations requested")
+    parser.add_argument("--endpoints", nargs="+", help="url names, every endpoint by default")
+    parser.add_argument("--cold", action="store_true", help="disable the caches of upstream responses")
+    parser.add_argument("--cache-backend", default="memory", help="FORECAST_API_CACHE_BACKEND of the server")
+    parser.add_argument("--history-backend", default="redis", help="FORECAST_HISTORY_BACKEND of the server")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub upstream latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="stub upstream latency jitter, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing upstream calls")
+    parser.add_argument("--recordings", help="upstream responses replayed by the stub")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    _utils.setup_django()
+    benchmarked = [name for name in url_names() if name in endpoint_urls(args)]
+    endpoints = args.endpoints or benchmarked
+    unknown = set(endpoints) - set(benchmarked)
+    if unknown:
+        parser.error(f"unknown endpoints {sorted(unknown)}, expected some of {benchmarked}")
+    unbenchmarked = set(url_names()) - set(benchmarked) - set(SKIPPED)
+    if unbenchmarked:
+        # a new url was added to forecast.urls, it needs a url builder in endpoint_urls
+        parser.error(f"no load defined for {sorted(unbenchmarked)}")
+
+    stub_port = _utils.free_port()
+    stub_args = [
+        sys.executable, "-m", "benchmarks.stub_upstream",
+        "--port", str(stub_port),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate),
+    ]
+    if args.recordings:
+        stub_args += ["--recordings", args.recordings]
+    stub = _utils.start_process(stub_args, _utils.django_env())
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    try:
+        _utils.wait_for_http(stub_url)
+        results = bench_server(args, stub_url, endpoints)
+    finally:
+        _utils.stop_process(stub)
+    _utils.report(
+        "endpoints",
+        {"params": vars(args), "skipped": SKIPPED, "endpoints": results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
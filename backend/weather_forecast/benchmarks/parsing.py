@@ -0,0 +1,82 @@
+"""Micro-benchmark of forecast response parsing and serialization.
+
+Compares the columnar representation the clients produce with the previous per-timestep
+path (see ``benchmarks._legacy``), which built an `amount` per metric and a row dataclass
+per timestep and turned each one back into a dict with `dataclasses.asdict`. Both parse
+the same stub upstream payload and produce identical output.
+
+    python -m benchmarks.parsing --days 16 --number 200
+"""
+
+import argparse
+
+from benchmarks import _legacy, _utils, stub_upstream
+
+
+def sample_payloads(days: int) -> tuple[dict, dict]:
+    """Daily and hourly Open-Meteo responses covering `days` days, as the clients request them."""
+    from forecast.api_client import OpenMeteoMixin
+
+    params = {"latitude": ["52.52"], "longitude": ["13.41"], "forecast_days": [str(days)]}
+    daily = stub_upstream.forecast_response(
+        {**params, "daily": [",".join(OpenMeteoMixin.DAILY_VARIABLES.values())]}
+    )
+    hourly = stub_upstream.forecast_response(
+        {
+            **params,
+            "hourly": [",".join(OpenMeteoMixin.HOURLY_VARIABLES.values())],
+            "daily": ["temperature_2m_min,temperature_2m_max"],
+        }
+    )
+    return daily, hourly
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=16, help="forecast horizon of the parsed payload")
+    parser.add_argument("--number", type=int, default=200, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    _utils.setup_django()
+    from forecast.api_client import OpenMeteoMixin
+
+    client = OpenMeteoMixin()
+    daily_raw, hourly_raw = sample_payloads(args.days)
+
+    def legacy_daily() -> dict:
+        return _legacy.daily_as_dict(_legacy.process_daily_forecast(daily_raw))
+
+    def legacy_hourly() -> dict:
+        return _legacy.hourly_as_dict(_legacy.process_hourly_forecast(hourly_raw))
+
+    assert legacy_daily() == client._process_daily_forecast(daily_raw).as_dict()
+    assert legacy_hourly() == client._process_hourly_forecast(hourly_raw).for_dates().as_dict()
+
+    results = {
+        "daily": {
+            "timesteps": len(daily_raw["daily"]["time"]),
+            "dataclasses_asdict": _utils.time_calls(legacy_daily, args.number, args.repeat),
+            "columnar": _utils.time_calls(
+                lambda: client._process_daily_forecast(daily_raw).as_dict(), args.number, args.repeat
+            ),
+        },
+        "hourly": {
+            "timesteps": len(hourly_raw["hourly"]["time"]),
+            "dataclasses_asdict": _utils.time_calls(legacy_hourly, args.number, args.repeat),
+            "columnar": _utils.time_calls(
+                lambda: client._process_hourly_forecast(hourly_raw).for_dates().as_dict(),
+                args.number,
+                args.repeat,
+            ),
+        },
+    }
+    for result in results.values():
+        legacy, columnar = result["dataclasses_asdict"], result["columnar"]
+        result["speedup"] = round(legacy["best_us"] / columnar["best_us"], 2)
+    _utils.report("parsing", {"params": vars(args), **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
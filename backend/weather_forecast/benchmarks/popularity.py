@@ -0,0 +1,139 @@
+"""Throughput, accuracy and memory of the city popularity repositories.
+
+The same synthetic stream of searches, Zipf distributed city names mixed with one-off junk
+queries (typos, random input), is counted by:
+
+- ``sql``: ``CitiesCountRepositorySQL``, one upsert per search, in a throwaway database;
+- ``redis``: ``CitiesCountRepositoryRedis``, one round trip per search;
+- ``buffered``: the redis repository behind the write-behind buffer;
+- ``sketch``: ``SketchCitiesCountRepository``, a Count-Min sketch plus Space-Saving summary
+  per worker merged into a shared redis sketch. ``--workers`` summaries are merged, as
+  with that many gunicorn workers.
+
+Accuracy is measured against the exact counts of the stream: recall of the true top-K and
+the relative error of the reported counts. ``redis_bytes`` is what the repository keeps in
+redis (MEMORY USAGE), ``local_peak_bytes`` what it allocates in the worker (tracemalloc).
+
+The redis repositories write to ``--redis-db``, which is FLUSHED before every run.
+
+    python -m benchmarks.popularity --searches 100000 --junk 0.3 --redis-db 15
+"""
+
+import argparse
+import collections
+import random
+import time
+import tracemalloc
+import typing as t
+
+from benchmarks import _utils
+
+REPOSITORIES = ("sql", "redis", "buffered", "sketch")
+
+
+def search_stream(searches: int, cities: int, junk: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    names = [f"city{i}" for i in range(cities)]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(cities)]
+    junk_count = int(searches * junk)
+    stream = rng.choices(names, weights, k=searches - junk_count)
+    stream += [f"{rng.choice(names)}{rng.randrange(10**6)}" for _ in range(junk_count)]
+    rng.shuffle(stream)
+    return stream
+
+
+def accuracy(ranked: list[t.Any], exact: collections.Counter[str], top_k: int) -> dict[str, float]:
+    true_top = {name for name, _ in exact.most_common(top_k)}
+    reported = ranked[:top_k]
+    errors = [abs(dto.count - exact[dto.name]) / exact[dto.name] for dto in reported if exact[dto.name]]
+    return {
+        "recall": round(len(true_top & {dto.name for dto in reported}) / max(len(true_top), 1), 4),
+        "mean_relative_error": round(sum(errors) / len(errors), 6) if errors else 0.0,
+        "max_relative_error": round(max(errors, default=0.0), 6),
+    }
+
+
+def redis_bytes(db: t.Any) -> int:
+    return sum(db.memory_usage(key) or 0 for key in db.scan_iter())
+
+
+def bench_repository(name: str, stream: list[str], args: argparse.Namespace) -> dict[str, t.Any]:
+    from core import redis as core_redis
+
+    from forecast import repositories as repos
+
+    db = core_redis.get_connection(args.redis_db, decode_responses=True)
+    db.flushdb()
+    if name == "sql":
+        writers = [repos.CitiesCountRepositorySQL()]
+    elif name == "redis":
+        writers = [repos.CitiesCountRepositoryRedis()]
+    elif name == "buffered":
+        writers = [repos.BufferedCitiesCountRepository(repos.CitiesCountRepositoryRedis())]
+    else:
+        store = repos.CitiesCountSketchRedis(args.epsilon, args.delta, args.top_k)
+        writers = [
+            repos.SketchCitiesCountRepository(store, args.epsilon, args.delta, args.top_k)
+            for _ in range(args.workers)
+        ]
+    for writer in writers:
+        for repo in (writer, getattr(writer, "repo", None)):
+            if hasattr(repo, "db"):
+                repo.db = db
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i, city_name in enumerate(stream):
+        writers[i % len(writers)].create_or_incr(city_name)
+    for writer in writers:
+        if isinstance(writer, repos.BufferedCitiesCountRepository):
+            writer.close()
+    elapsed = time.perf_counter() - started
+    local_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    reader = writers[0]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "searches_per_s": round(len(stream) / elapsed, 1),
+        "stored_cities": reader.count(),
+        "local_peak_bytes": local_peak,
+        "redis_bytes": redis_bytes(db) if name != "sql" else 0,
+        **accuracy(reader.get_ranked(0, args.top_k), collections.Counter(stream), args.report_top),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--searches", type=int, default=100_000)
+    parser.add_argument("--cities", type=int, default=20_000, help="distinct real city names")
+    parser.add_argument("--junk", type=float, default=0.3, help="share of one-off junk queries")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--epsilon", type=float, default=0.001)
+    parser.add_argument("--delta", type=float, default=0.01)
+    parser.add_argument("--top-k", type=int, default=1000, help="cities kept by the sketch")
+    parser.add_argument("--report-top", type=int, default=100, help="K of the accuracy metrics")
+    parser.add_argument("--workers", type=int, default=4, help="sketch summaries merged")
+    parser.add_argument("--redis-db", type=int, default=15)
+    parser.add_argument("--repositories", nargs="+", choices=REPOSITORIES, default=list(REPOSITORIES))
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    _utils.setup_django()
+    from django.test.utils import setup_databases, teardown_databases
+
+    stream = search_stream(args.searches, args.cities, args.junk, args.seed)
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        results = {name: bench_repository(name, stream, args) for name in args.repositories}
+    finally:
+        teardown_databases(databases, verbosity=0)
+    _utils.report(
+        "popularity",
+        {"params": vars(args), "distinct_queries": len(set(stream)), **results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Time and memory a forecast response takes from the upstream payload to JSON bytes.
+
+Three paths produce the same JSON document for the same stub upstream payload:
+
+- ``asdict``: the original per-timestep ``__dict__`` dataclasses, ``dataclasses.asdict``
+  and the json module, which is what the DRF JSONRenderer did with them;
+- ``columnar_as_dict``: the columnar forecast turned into dicts, then the json module;
+- ``encoder``: the columnar forecast encoded by ``forecast.encoding``.
+
+Memory is measured with tracemalloc: ``retained`` is what the parsed forecast keeps alive
+(what a cache or a coalesced call holds on to), ``peak`` the high-water mark of a request.
+
+    python -m benchmarks.serialization --days 16
+"""
+
+import argparse
+import json
+import sys
+import tracemalloc
+import typing as t
+
+from benchmarks import _legacy, _utils
+from benchmarks.parsing import sample_payloads
+
+
+def to_json(data: t.Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def measure_memory(parse: t.Callable[[], t.Any], serialize: t.Callable[[t.Any], bytes]) -> dict[str, int]:
+    tracemalloc.start()
+    try:
+        parsed = parse()
+        retained = tracemalloc.get_traced_memory()[0]
+        serialize(parsed)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"retained_bytes": retained, "peak_bytes": peak}
+
+
+def instance_size(obj: t.Any) -> int:
+    return sys.getsizeof(obj) + (sys.getsizeof(obj.__dict__) if hasattr(obj, "__dict__") else 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=16, help="forecast horizon of the serialized payload")
+    parser.add_argument("--number", type=int, default=100, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    _utils.setup_django()
+    from forecast import encoding
+    from forecast.api_client import OpenMeteoMixin
+    from forecast.domain import models as dm
+
+    client = OpenMeteoMixin()
+    daily_raw, hourly_raw = sample_payloads(args.days)
+    paths = {
+        "daily": {
+            "asdict": (
+                lambda: _legacy.process_daily_forecast(daily_raw),
+                lambda forecast: to_json(
+                    {"forecast": _legacy.daily_as_dict(forecast), "location": "Berlin"}
+                ),
+            ),
+            "columnar_as_dict": (
+                lambda: client._process_daily_forecast(daily_raw),
+                lambda forecast: to_json({"forecast": forecast.as_dict(), "location": "Berlin"}),
+            ),
+            "encoder": (
+                lambda: client._process_daily_forecast(daily_raw),
+                lambda forecast: encoding.dumps({"forecast": forecast, "location": "Berlin"}),
+            ),
+        },
+        "hourly": {
+            "asdict": (
+                lambda: _legacy.process_hourly_forecast(hourly_raw),
+                lambda forecast: to_json(
+                    {"forecast": _legacy.hourly_as_dict(forecast), "location": "Berlin"}
+                ),
+            ),
+            "columnar_as_dict": (
+                lambda: client._process_hourly_forecast(hourly_raw).for_dates(),
+                lambda forecast: to_json({"forecast": forecast.as_dict(), "location": "Berlin"}),
+            ),
+            "encoder": (
+                lambda: client._process_hourly_forecast(hourly_raw).for_dates(),
+                lambda forecast: encoding.dumps({"forecast": forecast, "location": "Berlin"}),
+            ),
+        },
+    }
+
+    results: dict[str, t.Any] = {}
+    for kind, kind_paths in paths.items():
+        documents = [json.loads(serialize(parse())) for parse, serialize in kind_paths.values()]
+        assert all(document == documents[0] for document in documents), f"{kind} outputs differ"
+        results[kind] = {
+            name: {
+                **_utils.time_calls(lambda: serialize(parse()), args.number, args.repeat),
+                **measure_memory(parse, serialize),
+            }
+            for name, (parse, serialize) in kind_paths.items()
+        }
+        before, after = results[kind]["asdict"], results[kind]["encoder"]
+        results[kind]["speedup"] = round(before["best_us"] / after["best_us"], 2)
+    results["amount_instance_bytes"] = {
+        "dict": instance_size(_legacy.amount(1.0, "°C")),
+        "slots": instance_size(dm.amount(1.0, "°C")),
+    }
+    _utils.report("serialization", {"params": vars(args), **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""Local stand-in for the Open-Meteo forecast and geocoding APIs and for Nominatim.
+
+Responses are generated deterministically from the request parameters, so the stub can
+serve any city, coordinate pair or date range. Responses of the live services can be
+recorded once and replayed instead: with `--record` requests the stub has no recording of
+are forwarded to the live service and the answers are saved to `--recordings`. Forecasts
+requested without explicit dates are replayed with their dates moved to the current day.
+
+Every response is delayed by `latency` plus up to `jitter` seconds. Faults can be injected:
+a share of the requests (`error_rate`), or the next `fail_next` ones, are answered with
+`error_status`. Run standalone with
+
+    python -m benchmarks.stub_upstream --port 8099 --latency 0.1 --jitter 0.05 --error-rate 0.05
+    python -m benchmarks.stub_upstream --port 8099 --recordings recordings.json [--record]
+
+and point FORECAST_API_URL, FORECAST_GEODATA_API_URL and FORECAST_NOMINATIM_URL at it.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import signal
+import sys
+import threading
+import time
+import typing as t
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import httpx
+
+UNITS = {
+    "temperature_2m": "°C",
+    "temperature_2m_max": "°C",
+    "temperature_2m_min": "°C",
+    "apparent_temperature": "°C",
+    "apparent_temperature_max": "°C",
+    "apparent_temperature_min": "°C",
+    "rain": "mm",
+    "rain_sum": "mm",
+    "precipitation_probability": "%",
+    "precipitation_probability_max": "%",
+}
+
+
+# live services requests are forwarded to when recording, by path
+LIVE_UPSTREAMS = {
+    "/v1/forecast": "https://api.open-meteo.com",
+    "/v1/search": "https://geocoding-api.open-meteo.com",
+    "/reverse": "https://nominatim.openstreetmap.org",
+}
+# Nominatim's usage policy asks for an identifying user agent
+USER_AGENT = "weatherApp-benchmarks"
+
+
+def _seed(*parts: t.Any) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=4).digest(), "big")
+
+
+def _value(variable: str, seed: int, step: int) -> float | int:
+    wave = ((seed + step * 37) % 200) / 10
+    if variable.startswith("precipitation_probability"):
+        return int(wave * 5) % 101
+    if variable.startswith("rain"):
+        return round(wave % 3, 1)
+    return round(wave - 5, 1)
+
+
+def _list_param(query: dict[str, list[str]], name: str) -> list[str]:
+    return [item for value in query.get(name, []) for item in value.split(",") if item]
+
+
+def geocoding_response(query: dict[str, list[str]]) -> dict:
+    name = query.get("name", [""])[0]
+    if not name or name.lower().startswith("unknown"):
+        return {"generationtime_ms": 0.1}
+    seed = _seed(name.lower())
+    return {
+        "results": [
+            {
+                "name": name,
+                "latitude": round((seed % 18000) / 100 - 90, 4),
+                "longitude": round((seed // 18000 % 36000) / 100 - 180, 4),
+                "timezone": "UTC",
+            }
+        ]
+    }
+
+
+def reverse_geocoding_response(query: dict[str, list[str]]) -> dict:
+    latitude, longitude = float(query.get("lat", ["0"])[0]), float(query.get("lon", ["0"])[0])
+    town = f"Town {_seed(round(latitude, 2), round(longitude, 2)) % 10_000}"
+    return {
+        "lat": str(latitude),
+        "lon": str(longitude),
+        "display_name": f"{town}, Stubland",
+        "address": {"town": town, "country": "Stubland"},
+    }
+
+
+def forecast_response(query: dict[str, list[str]]) -> dict | list[dict]:
+    latitudes = _list_param(query, "latitude") or ["0"]
+    longitudes = _list_param(query, "longitude") or ["0"]
+    if len(latitudes) > 1:
+        # several locations are answered with a list, one forecast per coordinate pair
+        return [
+            forecast_response({**query, "latitude": [latitude], "longitude": [longitude]})
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+    latitude, longitude = float(latitudes[0]), float(longitudes[0])
+    if "start_date" in query:
+        start = date.fromisoformat(query["start_date"][0])
+        end = date.fromisoformat(query.get("end_date", query["start_date"])[0])
+        days = (end - start).days + 1
+    else:
+        start = datetime.utcnow().date()
+        days = int(query.get("forecast_days", ["7"])[0])
+    seed = _seed(round(latitude, 2), round(longitude, 2))
+    response = {"latitude": latitude, "longitude": longitude, "timezone": "UTC"}
+    daily = _list_param(query, "daily")
+    if daily:
+        response["daily_units"] = {"time": "iso8601", **{v: UNITS.get(v, "") for v in daily}}
+        response["daily"] = {
+            "time": [(start + timedelta(days=i)).isoformat() for i in range(days)],
+            **{v: [_value(v, seed, i) for i in range(days)] for v in daily},
+        }
+    hourly = _list_param(query, "hourly")
+    if hourly:
+        first_hour = datetime(start.year, start.month, start.day)
+        hours = days * 24
+        response["hourly_units"] = {"time": "iso8601", **{v: UNITS.get(v, "") for v in hourly}}
+        response["hourly"] = {
+            "time": [(first_hour + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M") for i in range(hours)],
+            **{v: [_value(v, seed, i) for i in range(hours)] for v in hourly},
+        }
+    return response
+
+
+def _shift_time(value: str, days: int) -> str:
+    if "T" in value:
+        return (datetime.fromisoformat(value) + timedelta(days=days)).strftime("%Y-%m-%dT%H:%M")
+    return (date.fromisoformat(value) + timedelta(days=days)).isoformat()
+
+
+def shift_dates(payload: t.Any, days: int) -> t.Any:
+    """Forecast payload with the timestamps of its daily and hourly series moved by `days`."""
+    if isinstance(payload, list):
+        return [shift_dates(item, days) for item in payload]
+    if not days or not isinstance(payload, dict):
+        return payload
+    shifted = dict(payload)
+    for series in ("daily", "hourly"):
+        if isinstance(payload.get(series), dict) and "time" in payload[series]:
+            shifted[series] = {
+                **payload[series],
+                "time": [_shift_time(value, days) for value in payload[series]["time"]],
+            }
+    return shifted
+
+
+class Recordings:
+    """Responses of the live services by path and query, kept in a JSON file."""
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self.responses: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if path is not None and Path(path).exists():
+            self.responses = json.loads(Path(path).read_text())["responses"]
+
+    @staticmethod
+    def key(path: str, query: dict[str, list[str]]) -> str:
+        items = sorted((name, value) for name, values in query.items() for value in values)
+        return f"{path}?{urlencode(items)}"
+
+    def get(self, path: str, query: dict[str, list[str]]) -> tuple[int, t.Any] | None:
+        entry = self.responses.get(self.key(path, query))
+        if entry is None:
+            return None
+        payload = entry["payload"]
+        if "start_date" not in query:
+            # relative to the day of the recording, replayed as if it was recorded today
+            days = (date.today() - date.fromisoformat(entry["recorded_on"])).days
+            payload = shift_dates(payload, days)
+        return entry["status"], payload
+
+    def add(self, path: str, query: dict[str, list[str]], status: int, payload: t.Any) -> None:
+        with self._lock:
+            self.responses[self.key(path, query)] = {
+                "status": status,
+                "recorded_on": date.today().isoformat(),
+                "payload": payload,
+            }
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            encoded = json.dumps({"responses": self.responses}, ensure_ascii=False, indent=1)
+        Path(self.path).write_text(encoded)
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubUpstream"
+
+    def do_GET(self) -> None:  # noqa: N802
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        delay = self.server.delay()
+        if delay:
+            time.sleep(delay)
+        if self.server.should_fail():
+            self._send_json(self.server.error_status, {"error": True, "reason": "injected fault"})
+            return
+        recorded = self.server.recordings.get(url.path, query)
+        if recorded is not None:
+            self._send_json(*recorded)
+        elif self.server.record and url.path in LIVE_UPSTREAMS:
+            self._send_json(*self.server.forward(url.path, query))
+        elif url.path.endswith("/search"):
+            self._send_json(200, geocoding_response(query))
+        elif url.path.endswith("/forecast"):
+            self._send_json(200, forecast_response(query))
+        elif url.path.endswith("/reverse"):
+            self._send_json(200, reverse_geocoding_response(query))
+        else:
+            self._send_json(404, {"error": True, "reason": f"unknown path {url.path}"})
+
+    def _send_json(self, status: int, payload: dict | list) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        pass
+
+
+class StubUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        jitter: float = 0.0,
+        recordings: Recordings | None = None,
+        record: bool = False,
+    ) -> None:
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.recordings = recordings or Recordings()
+        # forward requests without a recording to the live services and record the answers
+        self.record = record
+        # requests answered with an error before error_rate applies again
+        self.fail_next = 0
+        # requests received, faulty ones included
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def delay(self) -> float:
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def forward(self, path: str, query: dict[str, list[str]]) -> tuple[int, t.Any]:
+        response = httpx.get(
+            LIVE_UPSTREAMS[path] + path, params=query, headers={"User-Agent": USER_AGENT}, timeout=30
+        )
+        payload = response.json()
+        if response.status_code == 200:
+            self.recordings.add(path, query, response.status_code, payload)
+        return response.status_code, payload
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def handle_error(self, request: t.Any, client_address: t.Any) -> None:
+        # clients giving up on a slow response close the connection, that's expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def forecast_url(self) -> str:
+        return f"{self.base_url}/v1/forecast"
+
+    @property
+    def geodata_url(self) -> str:
+        return f"{self.base_url}/v1/search"
+
+    @property
+    def nominatim_url(self) -> str:
+        return self.base_url
+
+    def start(self) -> "StubUpstream":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.record:
+            self.recordings.save()
+
+    def __enter__(self) -> "StubUpstream":
+        return self.start()
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds more, uniform")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--recordings", help="JSON file of recorded responses to replay")
+    parser.add_argument(
+        "--record", action="store_true", help="forward unrecorded requests to the live services, record them"
+    )
+    args = parser.parse_args()
+    if args.record and not args.recordings:
+        parser.error("--record needs --recordings")
+    server = StubUpstream(
+        args.host,
+        args.port,
+        args.latency,
+        args.error_rate,
+        args.error_status,
+        args.jitter,
+        Recordings(args.recordings),
+        args.record,
+    )
+    print(
+        f"stub upstream listening on {server.base_url}, {len(server.recordings)} recorded responses",
+        flush=True,
+    )
+    # terminated by benchmarks with SIGTERM, recordings are saved on the way out
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if server.record:
+            server.recordings.save()
+
+
+if __name__ == "__main__":
+    main()
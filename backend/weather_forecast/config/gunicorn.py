@@ -0,0 +1,49 @@
+"""Gunicorn settings, passed with `-c config/gunicorn.py` in entrypoint.sh.
+
+The application is imported once in the master and the workers are forked from it, so they
+start serving without importing Django and the forecast app again and share the pages of
+the imported modules. Nothing opens a socket or starts a thread on import: connections,
+clients and executors are built on first use in each worker (see forecast.dependecies), and
+the ones of the master, if any, are dropped in the children right after the fork.
+"""
+
+import gc
+import os
+import sys
+
+preload_app = os.environ.get("GUNICORN_PRELOAD_APP", "1") == "1"
+
+
+def when_ready(server) -> None:
+    if not server.cfg.preload_app:
+        return
+    from django.urls import get_resolver
+
+    from forecast import dependecies
+
+    # Django imports the views on the first request, done here the workers don't each do it
+    get_resolver().url_patterns
+    # only imported when the clients are built on first use, the modules are safe to share
+    import geopy.geocoders  # noqa: F401
+    import requests_cache  # noqa: F401
+
+    # the city index is a read-only mmap kept across forks, opened once it is shared by all workers
+    dependecies.container.city_index
+    # objects of the master are never collected in the workers, so the collector doesn't touch
+    # (and copy) the pages they share with the master
+    gc.freeze()
+
+
+def worker_exit(server, worker) -> None:
+    # popularity increments buffered by the worker, written while it can still log a failure
+    repositories = sys.modules.get("forecast.repositories")
+    if repositories is not None:
+        repositories.close_buffers()
+
+
+def child_exit(server, worker) -> None:
+    # counters and histograms of an exited worker stay in the sums, its live gauges are dropped
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,10 @@ DJANGO_APPS = [
 
 INSTALLED_APPS = THIRD_PARTY_APPS + LOCAL_APPS + DJANGO_APPS
 MIDDLEWARE = [
+    # first, so the time spent in the other middlewares is observed too
+    "forecast.middleware.MetricsMiddleware",
+    # unused unless FORECAST_PROFILING_SAMPLE_RATE or FORECAST_PROFILING_TOKEN is set
+    "forecast.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -51,6 +56,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "forecast.middleware.SearchHistoryMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -117,10 +123,30 @@ USE_TZ = True
 
 # CACHE
 
+# every Redis client of a process shares one pool per database (see core.redis) of at most
+# `MAX_CONNECTIONS` connections. A command waits up to `POOL_TIMEOUT` seconds for a free
+# connection and `SOCKET_TIMEOUT` seconds for a reply, connections idle for more than
+# `HEALTH_CHECK_INTERVAL` seconds are pinged before use
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 1.0))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 2.0))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 1.0))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",
         "LOCATION": "redis://redis:6379",
+        # Django builds a client, and so a pool, per thread
+        "OPTIONS": {
+            "pool_class": "core.redis.BlockingConnectionPool",
+            "name": "cache",
+            "max_connections": REDIS_MAX_CONNECTIONS,
+            "timeout": REDIS_POOL_TIMEOUT,
+            "socket_timeout": REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+            "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        },
     }
 }
 
@@ -134,7 +160,137 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-FORECAST_HISTORY_SESSION_KEY = "forecast_history"
+# search histories are kept per visitor, identified by this cookie, in "redis" or in "memory"
+# of each process. A history keeps the last `MAX_LENGTH` cities and is forgotten after `TTL`
+# seconds without searches
+FORECAST_HISTORY_BACKEND = os.environ.get("FORECAST_HISTORY_BACKEND", "redis")
+FORECAST_HISTORY_REDIS_DB = 2
+FORECAST_HISTORY_COOKIE_NAME = "forecast_history"
+FORECAST_HISTORY_MAX_LENGTH = int(os.environ.get("FORECAST_HISTORY_MAX_LENGTH", 50))
+FORECAST_HISTORY_TTL = int(os.environ.get("FORECAST_HISTORY_TTL", 30 * 24 * 3600))
+
+# FORECAST API CLIENT
+
+FORECAST_API_URL = os.environ.get("FORECAST_API_URL", "https://api.open-meteo.com/v1/forecast")
+FORECAST_GEODATA_API_URL = os.environ.get(
+    "FORECAST_GEODATA_API_URL", "https://geocoding-api.open-meteo.com/v1/search"
+)
+
+# where upstream responses are cached: "redis" shares one cache between all workers and nodes,
+# "sqlite" keeps a .cache file per working directory, "memory" a dict per process
+FORECAST_API_CACHE_BACKEND = os.environ.get("FORECAST_API_CACHE_BACKEND", "redis")
+FORECAST_API_CACHE_REDIS_DB = 1
+# seconds an upstream response is reused, per endpoint type
+FORECAST_API_CACHE_EXPIRE_AFTER = {
+    "forecast": int(os.environ.get("FORECAST_API_CACHE_EXPIRE_AFTER", 3600)),
+    "geodata": int(os.environ.get("FORECAST_API_GEODATA_CACHE_EXPIRE_AFTER", 7 * 24 * 3600)),
+}
+# days of hourly forecast fetched per location in one upstream call (Open-Meteo provides up to
+# 16), hourly requests for any of these days are then sliced from it. Parsed forecasts are
+# kept for this many locations per process
+FORECAST_HOURLY_HORIZON_DAYS = int(os.environ.get("FORECAST_HOURLY_HORIZON_DAYS", 16))
+FORECAST_TIME_SERIES_CACHE_SIZE = int(os.environ.get("FORECAST_TIME_SERIES_CACHE_SIZE", 1024))
+
+# seconds to connect to an upstream and to wait for its response data. An upstream call,
+# retries included, gives up after `DEADLINE` seconds, keep it below the gunicorn timeout
+FORECAST_API_CONNECT_TIMEOUT = float(os.environ.get("FORECAST_API_CONNECT_TIMEOUT", 3.05))
+FORECAST_API_READ_TIMEOUT = float(os.environ.get("FORECAST_API_READ_TIMEOUT", 10))
+FORECAST_API_DEADLINE = float(os.environ.get("FORECAST_API_DEADLINE", 15))
+# seconds a worker may hold the lock marking an upstream request as in flight. Never less than
+# the deadline: a lock expiring while its holder still retries sends every waiting worker upstream
+FORECAST_API_SINGLE_FLIGHT_LOCK_TIMEOUT = max(
+    float(os.environ.get("FORECAST_API_SINGLE_FLIGHT_LOCK_TIMEOUT", 5)), FORECAST_API_DEADLINE
+)
+# after this many consecutive failures calls to an upstream host are rejected without being made,
+# for `RECOVERY_TIMEOUT` seconds until a trial call is let through
+FORECAST_API_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("FORECAST_API_BREAKER_FAILURE_THRESHOLD", 5))
+FORECAST_API_BREAKER_RECOVERY_TIMEOUT = float(os.environ.get("FORECAST_API_BREAKER_RECOVERY_TIMEOUT", 30))
+
+# local city index built by `manage.py build_geoindex`, geocoding falls back to the api without it
+FORECAST_CITY_INDEX_PATH = Path(
+    os.environ.get("FORECAST_CITY_INDEX_PATH", BASE_DIR / "data" / "cities.idx")
+)
+
+# coordinates further than this from every indexed city are resolved through Nominatim,
+# unless the fallback is disabled
+FORECAST_REVERSE_GEOCODING_MAX_DISTANCE_KM = 30
+FORECAST_REVERSE_GEOCODING_NOMINATIM_FALLBACK = (
+    os.environ.get("FORECAST_REVERSE_GEOCODING_NOMINATIM_FALLBACK", "1") == "1"
+)
+FORECAST_NOMINATIM_URL = os.environ.get("FORECAST_NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+
+# geohash precision coordinates are snapped to before geocoding and forecast lookups, requests
+# in one cell share cached forecasts: 5 is a cell of about 5 x 5 km, close to the resolution
+# of the Open-Meteo models, 6 about 1.2 x 0.6 km. 0 uses coordinates as they are
+FORECAST_GRID_PRECISION = int(os.environ.get("FORECAST_GRID_PRECISION", 5))
+
+# number of per-host connection pools kept by the shared client and keep-alive connections in each
+FORECAST_API_POOL_CONNECTIONS = int(os.environ.get("FORECAST_API_POOL_CONNECTIONS", 4))
+FORECAST_API_POOL_MAXSIZE = int(os.environ.get("FORECAST_API_POOL_MAXSIZE", 10))
+
+# rendered forecast responses are cached in this CACHES alias until the next upstream model
+# update, or until their forecast is no longer fresh in the stale cache. Open-Meteo refreshes
+# its models every `INTERVAL` seconds, `OFFSET` seconds past the start of an interval
+FORECAST_PAYLOAD_CACHE_ENABLED = os.environ.get("FORECAST_PAYLOAD_CACHE_ENABLED", "1") == "1"
+FORECAST_PAYLOAD_CACHE = "default"
+FORECAST_PAYLOAD_CACHE_UPDATE_INTERVAL = int(os.environ.get("FORECAST_PAYLOAD_CACHE_UPDATE_INTERVAL", 3600))
+FORECAST_PAYLOAD_CACHE_UPDATE_OFFSET = int(os.environ.get("FORECAST_PAYLOAD_CACHE_UPDATE_OFFSET", 0))
+
+# parsed forecasts are kept in this CACHES alias. Younger than `FRESH_FOR` seconds they are
+# served as is, for `STALE_WHILE_REVALIDATE` seconds more they are served while refreshed in
+# the background, and up to `STALE_IF_ERROR` seconds past fresh they replace upstream errors
+FORECAST_STALE_CACHE_ENABLED = os.environ.get("FORECAST_STALE_CACHE_ENABLED", "1") == "1"
+FORECAST_STALE_CACHE = "default"
+FORECAST_STALE_CACHE_FRESH_FOR = int(os.environ.get("FORECAST_STALE_CACHE_FRESH_FOR", 900))
+FORECAST_STALE_CACHE_STALE_WHILE_REVALIDATE = int(
+    os.environ.get("FORECAST_STALE_CACHE_STALE_WHILE_REVALIDATE", 2700)
+)
+FORECAST_STALE_CACHE_STALE_IF_ERROR = int(os.environ.get("FORECAST_STALE_CACHE_STALE_IF_ERROR", 6 * 3600))
+
+# threads shared by the forecast service for blocking work done in parallel (geocoding of batches)
+FORECAST_EXECUTOR_MAX_WORKERS = int(os.environ.get("FORECAST_EXECUTOR_MAX_WORKERS", 16))
+# most locations accepted by one request to the batch endpoint
+FORECAST_BATCH_MAX_LOCATIONS = int(os.environ.get("FORECAST_BATCH_MAX_LOCATIONS", 100))
+
+# searched cities are counted in memory and written every `INTERVAL` seconds, or once `SIZE`
+# searches are pending. At most `MAX_PENDING` are kept while the store is unreachable
+FORECAST_POPULARITY_WRITE_BEHIND = os.environ.get("FORECAST_POPULARITY_WRITE_BEHIND", "1") == "1"
+FORECAST_POPULARITY_FLUSH_INTERVAL = float(os.environ.get("FORECAST_POPULARITY_FLUSH_INTERVAL", 1.0))
+FORECAST_POPULARITY_FLUSH_SIZE = int(os.environ.get("FORECAST_POPULARITY_FLUSH_SIZE", 1000))
+FORECAST_POPULARITY_MAX_PENDING = 100_000
+# approximate the counters with a Count-Min sketch and a top-K instead, constant memory whatever
+# the number of distinct queries. Counts are overestimated by less than `EPSILON` * total searches
+# with probability 1 - `DELTA`, only the `TOP_K` most searched cities are ranked
+FORECAST_POPULARITY_SKETCH = os.environ.get("FORECAST_POPULARITY_SKETCH", "0") == "1"
+FORECAST_POPULARITY_SKETCH_EPSILON = float(os.environ.get("FORECAST_POPULARITY_SKETCH_EPSILON", 0.001))
+FORECAST_POPULARITY_SKETCH_DELTA = float(os.environ.get("FORECAST_POPULARITY_SKETCH_DELTA", 0.01))
+FORECAST_POPULARITY_SKETCH_TOP_K = int(os.environ.get("FORECAST_POPULARITY_SKETCH_TOP_K", 1000))
+
+# the prewarm_forecasts command refreshes the forecasts of the `TOP_CITIES` most searched cities
+# `LEAD` seconds before they stop being fresh, with `CONCURRENCY` threads starting each city after a random
+# delay of up to `JITTER` seconds
+FORECAST_PREWARM_TOP_CITIES = int(os.environ.get("FORECAST_PREWARM_TOP_CITIES", 100))
+FORECAST_PREWARM_CONCURRENCY = int(os.environ.get("FORECAST_PREWARM_CONCURRENCY", 4))
+FORECAST_PREWARM_JITTER = float(os.environ.get("FORECAST_PREWARM_JITTER", 30))
+FORECAST_PREWARM_LEAD = float(os.environ.get("FORECAST_PREWARM_LEAD", 300))
+
+# serve the forecast endpoints with the asyncio views, only under config.asgi: config.wsgi
+# refuses to start with them
+FORECAST_ASYNC_VIEWS = os.environ.get("FORECAST_ASYNC_VIEWS", "0") == "1"
+
+# trace a `SAMPLE_RATE` share of the requests and log the span trees of the ones slower than
+# `SLOW_THRESHOLD` seconds. A request sent with the X-Forecast-Profile header set to `TOKEN` is
+# profiled with cProfile and its stats written to `DIR`. Both are off by default
+FORECAST_PROFILING_SAMPLE_RATE = float(os.environ.get("FORECAST_PROFILING_SAMPLE_RATE", 0))
+FORECAST_PROFILING_SLOW_THRESHOLD = float(os.environ.get("FORECAST_PROFILING_SLOW_THRESHOLD", 1.0))
+FORECAST_PROFILING_TOKEN = os.environ.get("FORECAST_PROFILING_TOKEN", "")
+FORECAST_PROFILING_DIR = Path(
+    os.environ.get("FORECAST_PROFILING_DIR", Path(tempfile.gettempdir()) / "forecast_profiles")
+)
+
+# /metrics answers admins and requests with an "Authorization: Bearer `TOKEN`" header,
+# only admins when it is empty
+FORECAST_METRICS_TOKEN = os.environ.get("FORECAST_METRICS_TOKEN", "")
 
 # REST FRAMEWORK
 
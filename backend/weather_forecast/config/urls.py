@@ -1,8 +1,10 @@
 
 from django.contrib import admin
 from django.urls import include, path
+from forecast.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("forecast/", include("forecast.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# the async views keep an http client and a Redis pool per event loop, and a WSGI server runs
+# every async view on a new loop: each request would leave its client and pool behind
+if settings.FORECAST_ASYNC_VIEWS:
+    raise ImproperlyConfigured("FORECAST_ASYNC_VIEWS requires the ASGI application, config.asgi")
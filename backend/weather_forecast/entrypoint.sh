@@ -1,10 +1,22 @@
 #!sh
 
+# workers write their metrics to files in this directory, /metrics sums them up. It is emptied
+# on start so counters of a previous run aren't added to the new ones.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+
 if [ "$ENVIRONMENT" = "prod" ]; then
     echo "Running in production mode"
-    exec gunicorn config.wsgi:application --bind 0.0.0.0:8000
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    exec gunicorn config.wsgi:application -c config/gunicorn.py --bind 0.0.0.0:8000
+elif [ "$ENVIRONMENT" = "prod-asgi" ]; then
+    echo "Running in production mode (asgi)"
+    export FORECAST_ASYNC_VIEWS=1
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    exec gunicorn config.asgi:application -c config/gunicorn.py --bind 0.0.0.0:8000 -k uvicorn.workers.UvicornWorker
 elif [ "$ENVIRONMENT" = "local" ]; then
     echo "Running in development mode"
+    # a single process, the default registry is enough
+    unset PROMETHEUS_MULTIPROC_DIR
     exec python manage.py runserver 0.0.0.0:8000
 else
     echo "ENVIRONMENT variable is not set"